@@ -10,6 +10,7 @@ import json
 import logging
 from pathlib import Path
 
+from ballot_registry import load_registry
 from party_config import ELECTIONS
 
 # Configure logging
@@ -54,8 +55,19 @@ def normalize_ballot_number(ballot):
     return ballot
 
 
-def match_location(station, locations_data, election_config):
+def match_location(station, locations_data, election_config, registry=None):
     """Try to match a station with its ballot location."""
+    b2l = locations_data.get('ballot_to_location', {})
+
+    # Stations with a registry ID carry their settlement code; no name lookup needed
+    registry_id = station.get('r', station.get('registry_id'))
+    if registry is not None and registry_id is not None:
+        settlement_code, _, ballot = str(registry.keys[registry_id]).partition('__')
+        for bn in [ballot, f"{ballot}.0"]:
+            location = b2l.get(f"{settlement_code}:{bn}")
+            if location:
+                return location
+
     # Get station info (handle both compact and full formats)
     settlement_name = station.get('n') or station.get('settlement_name', '')
     ballot_number = str(station.get('b') or station.get('ballot_number', ''))
@@ -65,7 +77,6 @@ def match_location(station, locations_data, election_config):
         return None
 
     settlements = locations_data.get('settlements', {})
-    b2l = locations_data.get('ballot_to_location', {})
 
     # Find settlement ID by name
     settlement_id = None
@@ -127,6 +138,7 @@ def add_locations_to_tsne(election_id):
 
     election_config = ELECTIONS.get(election_id, {})
     coord_locations = load_station_coordinates()
+    registry = load_registry()
 
     # Match locations for each station
     # Prefer station_coordinates.json (manually verified) over ballot_locations (CEC scraped)
@@ -141,7 +153,7 @@ def add_locations_to_tsne(election_id):
             station['l'] = coord_loc
             matched += 1
         else:
-            location = match_location(station, locations_data, election_config)
+            location = match_location(station, locations_data, election_config, registry)
             if location:
                 station['l'] = location
                 matched += 1
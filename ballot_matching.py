@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Vectorized ballot-ID normalization and cross-election precinct matching.
+
+Ballot IDs have the form "<settlement code>__<ballot number>". Matching
+between two elections follows the rules described in the README:
+
+- Exact matches are preferred (14.1 <-> 14.1, 14 <-> 14)
+- If no exact match exists, 14.1 can match against 14 (the original
+  undivided box), unless the later election also has a 14.0 box
+- Subdivisions .2, .3, etc. only match exactly (no fallback)
+
+IDs are split with numpy string operations and joined with hash lookups
+(Index.get_indexer) instead of per-row Python logic.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def normalize_ballot_numbers(values, divisor=1):
+    """
+    Normalize raw ballot numbers to strings.
+
+    Equivalent to str(b) with a trailing ".0" removed (ballot numbers are
+    read as floats) and, for elections with x10 numbering (K16/K17), whole
+    numbers that are multiples of divisor divided by it.
+
+    Args:
+        values: Series of raw ballot numbers (any dtype)
+        divisor: The election's ballot_number_divisor
+
+    Returns:
+        Series of normalized ballot number strings
+    """
+    values = pd.Series(values)
+
+    if pd.api.types.is_numeric_dtype(values):
+        # Numeric columns: whole numbers print without ".0", others as str(float)
+        v = values.to_numpy(dtype=float)
+        whole = np.isfinite(v) & (v == np.floor(v))
+        n = v[whole].astype(np.int64)
+        if divisor > 1:
+            n = np.where(n % divisor == 0, n // divisor, n)
+        out = np.empty(len(v), dtype=object)
+        out[whole] = list(map(str, n.tolist()))
+        out[~whole] = list(map(str, v[~whole].tolist()))
+        return pd.Series(out, index=values.index)
+
+    # fillna: str(nan) == 'nan', which newer pandas' astype(str) keeps as missing
+    b = values.astype(str).fillna('nan')
+    b = b.str.replace(r'\.0$', '', regex=True)
+    if divisor > 1:
+        is_int = b.str.fullmatch(r'\s*[+-]?\d+\s*').to_numpy(dtype=bool)
+        n = pd.to_numeric(b[is_int]).to_numpy(dtype=np.int64)
+        divisible = n % divisor == 0
+        out = b.to_numpy(dtype=object)
+        out[np.flatnonzero(is_int)[divisible]] = (n[divisible] // divisor).astype(str)
+        b = pd.Series(out, index=b.index)
+    return b
+
+
+def make_ballot_ids(settlement_codes, ballot_numbers, divisor=1):
+    """Build "<settlement>__<ballot>" IDs from raw CSV columns."""
+    settlement_codes = pd.Series(settlement_codes)
+    ballots = normalize_ballot_numbers(ballot_numbers, divisor).to_numpy(dtype=object)
+    if pd.api.types.is_integer_dtype(settlement_codes):
+        settlements = list(map(str, settlement_codes.tolist()))
+    else:
+        settlements = settlement_codes.astype(str).fillna('nan').tolist()
+    ids = [f"{s}__{b}" for s, b in zip(settlements, ballots)]
+    return pd.Series(ids, index=settlement_codes.index, dtype=object)
+
+
+def station_ballots(df):
+    """Ballot numbers of a normalized frame as written in station keys ("14.0")."""
+    ballots = np.char.partition(df.index.to_numpy(dtype=str), '__')[:, 2]
+    return np.where(np.char.find(ballots, '.') >= 0, ballots, np.char.add(ballots, '.0'))
+
+
+def match_ballot_ids(from_ids, to_ids):
+    """
+    Match ballot IDs of a later election to those of an earlier one.
+
+    Args:
+        from_ids: Unique ballot IDs of the earlier election
+        to_ids: Unique ballot IDs of the later election
+
+    Returns:
+        DataFrame with one row per matched precinct, in to_ids order:
+        from_id, to_id, from_pos, to_pos (positions in the inputs) and
+        fallback (True where a .1 box was matched to its undivided base)
+    """
+    from_index = pd.Index(from_ids)
+    to_index = pd.Index(to_ids)
+    exact_pos = from_index.get_indexer(to_index)
+
+    # Split "<settlement>__<ballot>" once; IDs with any other shape never fall back
+    to = np.asarray(to_index, dtype=str)
+    settlement, sep, ballot = np.moveaxis(np.char.partition(to, '__'), -1, 0)
+    well_formed = (sep == '__') & (np.char.find(ballot, '__') < 0)
+
+    # Base IDs of "to" ballots that exist as an explicit .0 variant
+    is_dot_zero = well_formed & np.char.endswith(ballot, '.0')
+    bases_with_zero = pd.Index({f"{s}__{b[:-2]}" for s, b in
+                                zip(settlement[is_dot_zero], ballot[is_dot_zero])})
+
+    # Only .1 can fall back to its base (not .2, .3, etc.)
+    candidates = np.flatnonzero(well_formed & np.char.endswith(ballot, '.1') & (exact_pos < 0))
+    ok = np.zeros(len(candidates), dtype=bool)
+    base_pos = np.full(len(candidates), -1)
+    if len(candidates):
+        major = np.char.partition(ballot[candidates], '.')[:, 0]
+        base = np.char.add(np.char.add(settlement[candidates], '__'), major)
+        base_pos = from_index.get_indexer(base)
+        ok = (base_pos >= 0) & (bases_with_zero.get_indexer(base) < 0)
+
+    from_pos = exact_pos.copy()
+    from_pos[candidates[ok]] = base_pos[ok]
+    fallback = np.zeros(len(to), dtype=bool)
+    fallback[candidates[ok]] = True
+
+    to_pos = np.flatnonzero(from_pos >= 0)
+    from_pos = from_pos[to_pos]
+    return pd.DataFrame({
+        'from_id': from_index[from_pos],
+        'to_id': to_index[to_pos],
+        'from_pos': from_pos,
+        'to_pos': to_pos,
+        'fallback': fallback[to_pos],
+    })
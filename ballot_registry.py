@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Integer ballot identities shared by all elections.
+
+Ballot IDs ("<settlement code>__<ballot number>", see ballot_matching) are
+strings, and every cross-election join used to split and hash them again.
+The registry gives each (settlement code, normalized ballot number) of a
+set of elections one integer, and caches under
+data/cache/ballot_registry/<elections>/:
+
+1. keys.npy: the ballot ID of every registry ID. IDs are assigned by
+   registering the elections in chronological order, each election's
+   unseen ballot IDs in frame order. They are a deterministic function of
+   the ballot files, rebuilt whenever one of them changes, and adding a
+   newer election (K26) only appends IDs.
+2. rows/<election>.npy: the registry ID of every row of load_election_frame.
+3. lineage.npz: subdivision edges (14 -> 14.1, 14.2, ...) between
+   consecutive elections, flagged where the matching rules join the pair.
+4. joins.npz: matched row positions for every election pair, computed with
+   integer lookups and identical to ballot_matching.match_ballot_ids.
+
+election_store.build_match_index builds the registry of just the two
+elections it joins. The IDs published in the T-SNE files come from the
+registry of all available elections, built with:
+
+    python ballot_registry.py
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ballot_matching import match_ballot_ids
+from election_store import available_elections, frame_cache_key, load_election_frame
+
+logger = logging.getLogger(__name__)
+
+# Cached registries, one directory per election set
+REGISTRY_DIR = Path('data/cache/ballot_registry')
+
+# Bump when the layout or the ID assignment changes
+REGISTRY_VERSION = 2
+
+# Number of registries (election sets) kept in memory
+REGISTRY_LRU_SIZE = 4
+
+
+def key_parts(keys):
+    """
+    Subdivision structure of ballot IDs.
+
+    Returns:
+        (base, dot_one, dot_zero): base ID "<settlement>__<major>" of every
+        key ('' unless it is well formed and has a ".N" part), and whether
+        its ballot number ends in ".1" or ".0"
+    """
+    keys = np.asarray(keys, dtype=str)
+    settlement, sep, ballot = np.moveaxis(np.char.partition(keys, '__'), -1, 0)
+    well_formed = (sep == '__') & (np.char.find(ballot, '__') < 0)
+    major, dot, _ = np.moveaxis(np.char.partition(ballot, '.'), -1, 0)
+    subdivided = well_formed & (dot == '.')
+    base = np.where(subdivided, np.char.add(np.char.add(settlement, '__'), major), '')
+    return base, well_formed & np.char.endswith(ballot, '.1'), well_formed & np.char.endswith(ballot, '.0')
+
+
+def join_positions(ids_from, ids_to, base, dot_one, dot_zero):
+    """
+    Match two elections' rows by registry ID (the rules of match_ballot_ids).
+
+    Exact IDs match first; a ".1" box without an exact match falls back to
+    its undivided base unless the later election also has a ".0" box.
+
+    Args:
+        ids_from: Registry IDs of the earlier election's rows
+        ids_to: Registry IDs of the later election's rows
+        base: Registry ID of every key's base (-1 if none)
+        dot_one: Whether every key ends in ".1"
+        dot_zero: Whether every key ends in ".0"
+
+    Returns:
+        (from_pos, to_pos, fallback) arrays, in to_ids order
+    """
+    row_of = np.full(len(base), -1, dtype=np.int64)
+    row_of[ids_from] = np.arange(len(ids_from))
+    from_pos = row_of[ids_to]
+
+    zero_bases = base[ids_to[dot_zero[ids_to]]]
+    has_zero = np.zeros(len(base), dtype=bool)
+    has_zero[zero_bases[zero_bases >= 0]] = True
+
+    to_base = base[ids_to]
+    candidates = np.flatnonzero((from_pos < 0) & dot_one[ids_to] & (to_base >= 0))
+    base_pos = row_of[to_base[candidates]]
+    ok = (base_pos >= 0) & ~has_zero[to_base[candidates]]
+    from_pos[candidates[ok]] = base_pos[ok]
+    fallback = np.zeros(len(ids_to), dtype=bool)
+    fallback[candidates[ok]] = True
+
+    to_pos = np.flatnonzero(from_pos >= 0)
+    return from_pos[to_pos], to_pos, fallback[to_pos]
+
+
+class BallotRegistry:
+    """Registry IDs, per-election rows, lineage and pairwise joins."""
+
+    def __init__(self, keys, rows, frame_keys=None, joins=None, lineage=None):
+        """
+        Wrap registered keys, deriving joins and lineage unless given.
+
+        Args:
+            keys: Ballot ID of every registry ID
+            rows: dict of election ID -> registry IDs of its frame rows
+            frame_keys: election_store cache key of every election's frame
+            joins: Precomputed dict of (from, to) -> (from_pos, to_pos, fallback)
+            lineage: Precomputed lineage arrays (see _lineage)
+        """
+        self.keys = np.asarray(keys, dtype=str)
+        self.rows = {e: np.asarray(ids, dtype=np.int32) for e, ids in rows.items()}
+        self.frame_keys = frame_keys or {}
+        self._index = pd.Index(self.keys)
+
+        base, self.dot_one, self.dot_zero = key_parts(self.keys)
+        self.base = self._index.get_indexer(base).astype(np.int32)
+        self.base[base == ''] = -1
+
+        if joins is None:
+            joins = {(a, b): join_positions(self.rows[a], self.rows[b], self.base, self.dot_one, self.dot_zero)
+                     for a, b in combinations(self.election_ids, 2)}
+        self.joins = joins
+        self.lineage = self._lineage() if lineage is None else lineage
+
+    @property
+    def election_ids(self):
+        """Registered elections, in chronological order."""
+        return sorted(self.rows, key=int)
+
+    def ids(self, election_id):
+        """Registry IDs of an election's rows (load_election_frame order)."""
+        return self.rows[election_id]
+
+    def lookup(self, ballot_ids):
+        """Registry IDs of ballot ID strings (-1 where unregistered)."""
+        return self._index.get_indexer(pd.Index(ballot_ids))
+
+    def fallback_ids(self, election_id):
+        """
+        Registry ID each row of an election falls back to when it has no exact match.
+
+        Only ".1" boxes fall back, to their undivided base, and only if the
+        election has no ".0" box of the same base (see join_positions).
+
+        Returns:
+            int32 array aligned with ids(election_id), -1 where there is none
+        """
+        ids = self.rows[election_id]
+        zero_bases = self.base[ids[self.dot_zero[ids]]]
+        base = np.where(self.dot_one[ids], self.base[ids], -1)
+        base[np.isin(base, zero_bases[zero_bases >= 0])] = -1
+        return base.astype(np.int32)
+
+    def settlement_codes(self, ids):
+        """Settlement code part of the given registry IDs (strings)."""
+        return np.char.partition(self.keys[ids], '__')[:, 0]
+
+    def join(self, election_from, election_to):
+        """
+        Matched rows of two registered elections.
+
+        Returns:
+            (from_pos, to_pos, fallback), positions in the two frames
+        """
+        return self.joins[(election_from, election_to)]
+
+    def _lineage(self):
+        """
+        Subdivision edges between consecutive elections.
+
+        A box "14.N" of an election is a child of "14" if the previous
+        election had "14" but no "14.N". joined marks the edges that the
+        matching rules follow (".1" fallbacks).
+        """
+        parent, child, election, joined = [], [], [], []
+        ids = self.election_ids
+        for a, b in zip(ids[:-1], ids[1:]):
+            in_a = np.zeros(len(self.keys), dtype=bool)
+            in_a[self.rows[a]] = True
+            to = self.rows[b]
+            to_base = self.base[to]
+            new = np.flatnonzero(~in_a[to] & (to_base >= 0))
+            new = new[in_a[to_base[new]]]
+            _, to_pos, fallback = self.join(a, b)
+            is_fallback = np.zeros(len(to), dtype=bool)
+            is_fallback[to_pos[fallback]] = True
+            parent.append(to_base[new])
+            child.append(to[new])
+            election.append(np.full(len(new), int(b)))
+            joined.append(is_fallback[new])
+        return {
+            'parent': np.concatenate(parent or [[]]).astype(np.int32),
+            'child': np.concatenate(child or [[]]).astype(np.int32),
+            'election': np.concatenate(election or [[]]).astype(np.int16),
+            'joined': np.concatenate(joined or [[]]).astype(bool),
+        }
+
+    def save(self, directory):
+        """Write the registry to a directory (atomically replacing an older one)."""
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f'.{directory.name}.'))
+        np.save(tmp_dir / 'keys.npy', self.keys)
+        (tmp_dir / 'rows').mkdir()
+        for election_id, ids in self.rows.items():
+            np.save(tmp_dir / 'rows' / f'{election_id}.npy', ids)
+        np.savez(tmp_dir / 'lineage.npz', **self.lineage)
+        joins = {}
+        for (a, b), (from_pos, to_pos, fallback) in self.joins.items():
+            joins[f'{a}_to_{b}_from_pos'] = from_pos.astype(np.int32)
+            joins[f'{a}_to_{b}_to_pos'] = to_pos.astype(np.int32)
+            joins[f'{a}_to_{b}_fallback'] = fallback
+        np.savez(tmp_dir / 'joins.npz', **joins)
+        with open(tmp_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+            json.dump({'version': REGISTRY_VERSION, 'elections': self.frame_keys}, f, ensure_ascii=False)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _read_registry(directory, frame_keys):
+    """
+    Read a saved registry.
+
+    Returns:
+        BallotRegistry, or None if there is none or it is stale (other
+        layout version or election frames)
+    """
+    manifest_file = directory / 'manifest.json'
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['version'] != REGISTRY_VERSION or manifest['elections'] != frame_keys:
+        return None
+
+    keys = np.load(directory / 'keys.npy')
+    rows = {e: np.load(directory / 'rows' / f'{e}.npy') for e in frame_keys}
+    with np.load(directory / 'joins.npz') as data:
+        joins = {(a, b): tuple(data[f'{a}_to_{b}_{name}'] for name in ('from_pos', 'to_pos', 'fallback'))
+                 for a, b in combinations(sorted(rows, key=int), 2)}
+    with np.load(directory / 'lineage.npz') as data:
+        lineage = {name: data[name] for name in data.files}
+    return BallotRegistry(keys, rows, frame_keys, joins, lineage)
+
+
+def register(keys, ballot_ids):
+    """
+    Append unseen ballot IDs to the registry keys.
+
+    Returns:
+        (keys, ids): the extended keys and the registry ID of every ballot ID
+    """
+    index = pd.Index(keys)
+    ids = index.get_indexer(pd.Index(ballot_ids))
+    new = pd.unique(np.asarray(ballot_ids, dtype=str)[ids < 0])
+    if len(new):
+        keys = np.concatenate([np.asarray(keys, dtype=str), new])
+        ids = pd.Index(keys).get_indexer(pd.Index(ballot_ids))
+    return keys, ids
+
+
+def build_registry(election_ids, use_disk=True):
+    """
+    Register elections from scratch, in chronological order.
+
+    Args:
+        election_ids: Elections to register
+        use_disk: Whether frames come from the election store's disk cache
+
+    Returns:
+        BallotRegistry of the elections
+    """
+    keys = np.empty(0, dtype=str)
+    rows = {}
+    for election_id in sorted(election_ids, key=int):
+        df, _ = load_election_frame(election_id, use_disk=use_disk)
+        keys, rows[election_id] = register(keys, df.index)
+    return BallotRegistry(keys, rows)
+
+
+@lru_cache(maxsize=REGISTRY_LRU_SIZE)
+def _load_registry(election_ids, use_disk, directory):
+    """Load or build the registry of an election set (memoized)."""
+    if not use_disk:
+        return build_registry(election_ids, use_disk=False)
+
+    cache_dir = directory / '_'.join(election_ids)
+    frame_keys = {e: frame_cache_key(e) for e in election_ids}
+    registry = _read_registry(cache_dir, frame_keys)
+    if registry is None:
+        registry = build_registry(election_ids)
+        registry.frame_keys = frame_keys
+        registry.save(cache_dir)
+        logger.info(f"Saved ballot registry ({len(registry.keys)} ballots, {len(election_ids)} elections) "
+                    f"to {cache_dir}")
+    return registry
+
+
+def load_registry(election_ids=None, use_disk=True, directory=REGISTRY_DIR):
+    """
+    Load the registry of a set of elections, building it if needed (memoized).
+
+    IDs depend only on the set and its ballot files: use the default (all
+    available elections) for IDs that are published or compared across
+    runs. Joins and lineage are the same for any set containing the
+    elections involved.
+
+    Args:
+        election_ids: Elections to register (default: all with a ballot file)
+        use_disk: Whether to use the on-disk cache; without it, the
+            registry is built in memory
+        directory: Cache directory
+
+    Returns:
+        BallotRegistry shared between callers; treat it as read-only
+    """
+    election_ids = tuple(sorted(election_ids or available_elections(), key=int))
+    return _load_registry(election_ids, use_disk, Path(directory))
+
+
+def main():
+    """Build the ballot registry of all elections and report its contents."""
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Build the ballot registry under data/cache/ballot_registry')
+    parser.add_argument('--elections', nargs='+', help='Only register specific elections, e.g. --elections 24 25')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    registry = load_registry(args.elections)
+    logger.info(f"Registry: {len(registry.keys)} ballots over {len(registry.election_ids)} elections "
+                f"({time.perf_counter() - start:.2f}s)")
+
+    lineage = registry.lineage
+    for election_id in registry.election_ids[1:]:
+        edges = lineage['election'] == int(election_id)
+        logger.info(f"K{election_id}: {len(registry.ids(election_id))} boxes, {edges.sum()} subdivided from "
+                    f"K{registry.election_ids[registry.election_ids.index(election_id) - 1]} "
+                    f"({(edges & lineage['joined']).sum()} joined by .1 fallback)")
+
+    # Integer joins against the string matching they replace
+    start = time.perf_counter()
+    for a, b in registry.joins:
+        join_positions(registry.ids(a), registry.ids(b), registry.base, registry.dot_one, registry.dot_zero)
+    integer_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for a, b in registry.joins:
+        match_ballot_ids(registry.keys[registry.ids(a)], registry.keys[registry.ids(b)])
+    string_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"{len(registry.joins)} pairwise joins: {integer_ms:.0f}ms by registry ID, "
+                f"{string_ms:.0f}ms by ballot ID string")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Polling venue aggregation units that are stable across elections.
+
+Ballot boxes are split, renumbered and merged between elections, so many
+boxes have no counterpart under the ballot-level rules of ballot_matching,
+while the school or community centre they stand in usually persists. Every
+box is assigned to a venue within its settlement:
+
+- the venue name scraped from the CEC site (data/ballot_locations_NN.json),
+  normalized like settlement names (placeholder names that only repeat the
+  box number are ignored);
+- else the location of its geocoded station in
+  site/data/station_coordinates.json, by name, or by coordinates when the
+  station was geocoded to the venue itself;
+- else the box is a venue of its own.
+
+The aggregation units of a transition are the connected components of the
+graph that links every box to its venue and every ballot-level match of the
+two elections. A venue renamed between elections stays one unit as long as
+one of its boxes matches, and a box that moves between venues merges them.
+Units holding boxes of both elections are matched, and both elections'
+votes are summed per unit (generate_transfer_data.py --venues).
+
+    python ballot_venues.py   # ballot vs venue match coverage per transition
+"""
+
+import json
+import logging
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from ballot_matching import station_ballots
+from election_store import LRU_SIZE, MATCH_LRU_SIZE, build_match_index, load_election_frame
+from party_config import ELECTIONS
+from settlement_registry import normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Scraped CEC venue names, keyed by "<settlement code>:<ballot>"
+BALLOT_LOCATIONS_PATTERN = 'data/ballot_locations_{}.json'
+
+# Scraped names of boxes without a venue read "<settlement> קלפי מס <ballot> מספר ברזל <id>"
+PLACEHOLDER_VENUE_MARKER = 'קלפי מס'
+
+# Geocoded ballot stations keyed by "<settlement>|<ballot>"
+STATION_COORDINATES_FILE = Path('site/data/station_coordinates.json')
+
+# Geocoding sources that place a station at its venue (not the settlement centroid)
+VENUE_COORDINATE_SOURCES = ('venue', 'google_venue')
+
+# Coordinates of unnamed venues are compared at this precision (~10 m)
+VENUE_COORDINATE_DECIMALS = 4
+
+# Default output prefix of the coverage report (.json and .md are appended)
+COVERAGE_OUTPUT = Path('data/benchmarks/venue_coverage')
+
+
+def ballot_locations_file(election_id):
+    """Path of an election's scraped venue names."""
+    return Path(BALLOT_LOCATIONS_PATTERN.format(election_id))
+
+
+@lru_cache(maxsize=1)
+def load_stations():
+    """
+    Load the geocoded ballot stations (memoized).
+
+    Returns:
+        dict mapping "<normalized settlement>|<ballot>" to the station entry
+        (lat, lng, source, location); stations that were not found are
+        dropped, and the dict is empty if the file is missing
+    """
+    if not STATION_COORDINATES_FILE.exists():
+        logger.warning(f"{STATION_COORDINATES_FILE} not found, no station coordinates")
+        return {}
+    with open(STATION_COORDINATES_FILE, 'r', encoding='utf-8') as f:
+        stations = json.load(f).get('stations', {})
+
+    located = {}
+    for key, station in stations.items():
+        if station.get('source') == 'not_found' or station.get('lat') is None or station.get('lng') is None:
+            continue
+        name, _, ballot = key.partition('|')
+        located[f"{normalize_name(name.strip())}|{ballot}"] = station
+    logger.info(f"Loaded {len(located)} located stations from {STATION_COORDINATES_FILE}")
+    return located
+
+
+def station_keys(df):
+    """Station key ("<normalized settlement>|<ballot>") of every precinct of a normalized frame."""
+    names = [normalize_name(name) for name in df['שם ישוב'].fillna('').astype(str).str.strip()]
+    return [f"{name}|{ballot}" for name, ballot in zip(names, station_ballots(df).tolist())]
+
+
+def _venue_name(name):
+    """Normalize a venue name: settlement-name rules plus collapsed whitespace."""
+    return ' '.join(normalize_name(str(name)).split())
+
+
+@lru_cache(maxsize=LRU_SIZE)
+def venue_keys(election_id, use_disk=True):
+    """
+    Venue key of every precinct of an election's normalized frame (memoized).
+
+    Keys are "<settlement code>|<venue name>", "<settlement code>@<lat>,<lng>"
+    for stations known only by coordinates, or the ballot_id itself for
+    boxes without any venue information.
+
+    Returns:
+        str array aligned with the frame's rows
+    """
+    df, _ = load_election_frame(election_id, use_disk=use_disk)
+    locations_file = ballot_locations_file(election_id)
+    names = {}
+    if locations_file.exists():
+        with open(locations_file, 'r', encoding='utf-8') as f:
+            names = {key.replace(':', '__', 1): name
+                     for key, name in json.load(f)['ballot_to_location'].items()
+                     if name and PLACEHOLDER_VENUE_MARKER not in name}
+    else:
+        logger.warning(f"{locations_file} not found, venues of K{election_id} come from station coordinates")
+    stations = load_stations()
+
+    keys = []
+    for ballot_id, station_key in zip(df.index.tolist(), station_keys(df)):
+        code = ballot_id.partition('__')[0]
+        station = stations.get(station_key)
+        name = names.get(ballot_id) or (station.get('location') if station else None)
+        if name:
+            keys.append(f"{code}|{_venue_name(name)}")
+        elif station and station.get('source') in VENUE_COORDINATE_SOURCES:
+            keys.append(f"{code}@{station['lat']:.{VENUE_COORDINATE_DECIMALS}f},"
+                        f"{station['lng']:.{VENUE_COORDINATE_DECIMALS}f}")
+        else:
+            keys.append(ballot_id)
+    return np.array(keys)
+
+
+def _unit_ids(ballot_ids):
+    """Unit IDs "<settlement code>__v<ballot>" named after a representative box."""
+    code, _, ballot = np.moveaxis(np.char.partition(np.asarray(ballot_ids, dtype=str), '__'), -1, 0)
+    return np.char.add(np.char.add(code, '__v'), ballot)
+
+
+@lru_cache(maxsize=MATCH_LRU_SIZE)
+def build_venue_units(election_from, election_to, use_disk=True):
+    """
+    Venue-level aggregation units of a transition (memoized).
+
+    Returns:
+        dict with 'from_unit' and 'to_unit' (unit index of every row of the
+        two normalized frames, -1 where the unit has no box in the other
+        election), 'from_first'/'to_first' (first row of every unit) and
+        'unit_id'/'from_unit_id' ("<settlement code>__v<ballot>" named after
+        that first box); units are ordered by their first later-election
+        row. Shared between callers and read-only
+    """
+    from_keys = venue_keys(election_from, use_disk=use_disk)
+    to_keys = venue_keys(election_to, use_disk=use_disk)
+    matches = build_match_index(election_from, election_to, use_disk=use_disk)
+    n_from, n_to = len(from_keys), len(to_keys)
+
+    # Nodes: boxes of both elections, then venue keys; edges: box-venue and ballot matches
+    _, venue = np.unique(np.concatenate([from_keys, to_keys]), return_inverse=True)
+    n_nodes = n_from + n_to + venue.max() + 1
+    rows = np.concatenate([np.arange(n_from + n_to), matches['from_pos'].to_numpy()])
+    cols = np.concatenate([n_from + n_to + venue, n_from + matches['to_pos'].to_numpy()])
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=False)
+    from_labels, to_labels = labels[:n_from], labels[n_from:n_from + n_to]
+
+    # Keep components with boxes on both sides, numbered by first later-election row
+    components, to_first = np.unique(to_labels, return_index=True)
+    keep = np.isin(components, from_labels)
+    order = np.argsort(to_first[keep])
+    remap = np.full(labels.max() + 1, -1)
+    remap[components[keep][order]] = np.arange(keep.sum())
+    from_unit, to_unit = remap[from_labels], remap[to_labels]
+
+    n_units = int(keep.sum())
+    from_first = np.full(n_units, n_from)
+    np.minimum.at(from_first, from_unit[from_unit >= 0], np.flatnonzero(from_unit >= 0))
+    df_from, _ = load_election_frame(election_from, use_disk=use_disk)
+    df_to, _ = load_election_frame(election_to, use_disk=use_disk)
+    to_first = to_first[keep][order]
+    return {
+        'from_unit': from_unit,
+        'to_unit': to_unit,
+        'from_first': from_first,
+        'to_first': to_first,
+        'unit_id': _unit_ids(df_to.index[to_first]),
+        'from_unit_id': _unit_ids(df_from.index[from_first]),
+    }
+
+
+def match_coverage(election_from, election_to, use_disk=True):
+    """
+    Share of boxes and voters of both elections that enter the transfer fit.
+
+    Returns:
+        dict with the number of ballot-level matches and venue units and,
+        for each level, the matched share of boxes and of voters (מצביעים)
+        in the earlier and later election
+    """
+    df_from, _ = load_election_frame(election_from, use_disk=use_disk)
+    df_to, _ = load_election_frame(election_to, use_disk=use_disk)
+    voters_from = df_from['מצביעים'].to_numpy(dtype=float)
+    voters_to = df_to['מצביעים'].to_numpy(dtype=float)
+
+    matches = build_match_index(election_from, election_to, use_disk=use_disk)
+    units = build_venue_units(election_from, election_to, use_disk=use_disk)
+    ballot_from = np.zeros(len(df_from), dtype=bool)
+    ballot_from[matches['from_pos'].to_numpy()] = True
+    ballot_to = np.zeros(len(df_to), dtype=bool)
+    ballot_to[matches['to_pos'].to_numpy()] = True
+
+    def shares(from_mask, to_mask):
+        return {
+            'boxes_from': round(float(from_mask.mean()), 4),
+            'boxes_to': round(float(to_mask.mean()), 4),
+            'voters_from': round(float(voters_from[from_mask].sum() / voters_from.sum()), 4),
+            'voters_to': round(float(voters_to[to_mask].sum() / voters_to.sum()), 4),
+        }
+
+    unit_sizes = np.bincount(units['to_unit'][units['to_unit'] >= 0])
+    return {
+        'transition': f"{election_from}_to_{election_to}",
+        'boxes_from': len(df_from),
+        'boxes_to': len(df_to),
+        'ballot_matches': len(matches),
+        'venue_units': len(units['unit_id']),
+        'max_unit_boxes': int(unit_sizes.max()) if len(unit_sizes) else 0,
+        'ballot': shares(ballot_from, ballot_to),
+        'venue': shares(units['from_unit'] >= 0, units['to_unit'] >= 0),
+    }
+
+
+def format_markdown(report):
+    """Render coverage rows as a Markdown table."""
+    lines = [
+        f"# Ballot vs venue match coverage ({report['generated_at']})",
+        '',
+        '| Transition | Ballot matches | Venue units | Boxes (ballot) | Boxes (venue) '
+        '| Voters (ballot) | Voters (venue) |',
+        '|---|---:|---:|---:|---:|---:|---:|',
+    ]
+    for row in report['results']:
+        lines.append(
+            f"| {row['transition']} | {row['ballot_matches']} | {row['venue_units']} "
+            f"| {row['ballot']['boxes_to']:.1%} | {row['venue']['boxes_to']:.1%} "
+            f"| {row['ballot']['voters_to']:.1%} | {row['venue']['voters_to']:.1%} |"
+        )
+    lines += ['', 'Box and voter shares are of the later election.']
+    return '\n'.join(lines) + '\n'
+
+
+def save_coverage_report(rows, output=COVERAGE_OUTPUT):
+    """Write the coverage rows as <output>.json and <output>.md."""
+    report = {'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': rows}
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(output.with_suffix('.md'), 'w', encoding='utf-8') as f:
+        f.write(format_markdown(report))
+    logger.info(f"Saved {output.with_suffix('.json')} and {output.with_suffix('.md')}")
+
+
+def main():
+    """Report ballot- and venue-level match coverage of every consecutive transition."""
+    import argparse
+    from generate_transfer_data import select_pairs
+    parser = argparse.ArgumentParser(description='Ballot vs venue match coverage per transition')
+    parser.add_argument('--transitions', nargs='+',
+                        help='Only report specific transitions, e.g. --transitions 24_to_25')
+    parser.add_argument('--output', default=str(COVERAGE_OUTPUT),
+                        help=f'Output prefix for .json/.md (default: {COVERAGE_OUTPUT})')
+    args = parser.parse_args()
+
+    rows = []
+    for from_id, to_id in select_pairs(args.transitions):
+        missing = [ELECTIONS[e]['file'] for e in (from_id, to_id) if not Path(ELECTIONS[e]['file']).exists()]
+        if missing:
+            logger.warning(f"Skipping {from_id} → {to_id}: missing {', '.join(missing)}")
+            continue
+        row = match_coverage(from_id, to_id)
+        logger.info(f"{from_id} → {to_id}: later-election voters matched {row['ballot']['voters_to']:.1%} "
+                    f"by ballot, {row['venue']['voters_to']:.1%} by venue ({row['venue_units']} units)")
+        rows.append(row)
+    save_coverage_report(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
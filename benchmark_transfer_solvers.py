@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Benchmark the transfer matrix solvers of VoteTransferAnalyzer.
+
+Runs every method in generate_transfer_data.METHODS on the real transitions
+(with and without abstention) and on synthetic transitions, where the later
+election is simulated from real precinct votes of the earlier one with a
+known transfer matrix plus Dirichlet noise (as in simulate_election_26.py).
+
+For each run it reports wall time, peak traced memory, the least-squares
+objective ||XM - Y||², R², the maximum row-sum violation, the minimum matrix
+entry and, for synthetic transitions, the error against the ground truth.
+Results are written as JSON and Markdown so they can be tracked over time:
+
+    python benchmark_transfer_solvers.py --methods projected_gradient nnls
+"""
+
+import json
+import logging
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from generate_transfer_data import METHODS, TRANSITION_PAIRS, VoteTransferAnalyzer, transfer_r_squared
+from party_config import ELECTIONS
+from transfer_solvers import lstsq_objective
+
+logger = logging.getLogger(__name__)
+
+# Default output prefix (.json and .md are appended)
+BENCHMARK_OUTPUT = Path('data/benchmarks/solver_benchmark')
+
+# Dirichlet concentration of the synthetic precinct noise (higher = less noise)
+SYNTHETIC_ALPHA = 55
+
+# Weight of the "stay with the same party" cell in synthetic ground truths
+SYNTHETIC_LOYALTY = 0.6
+
+
+def ground_truth_matrix(k_from, k_to, rng):
+    """Random row-stochastic matrix with a loyal diagonal-like component."""
+    M = (1 - SYNTHETIC_LOYALTY) * rng.dirichlet(np.full(k_to, 0.5), size=k_from)
+    M[np.arange(k_from), np.arange(k_from) % k_to] += SYNTHETIC_LOYALTY
+    return M
+
+
+def simulate_votes(X, M_true, rng, alpha=SYNTHETIC_ALPHA):
+    """
+    Simulate later-election precinct votes from earlier votes.
+
+    Each precinct's expected votes X_i M_true are perturbed with Dirichlet
+    noise of concentration alpha and rounded to whole votes, vectorized
+    over precincts.
+    """
+    expected = X @ M_true
+    totals = expected.sum(axis=1, keepdims=True)
+    proportions = np.divide(expected, totals, out=np.full_like(expected, 1.0 / expected.shape[1]),
+                            where=totals > 0)
+    noisy = rng.gamma(np.maximum(alpha * proportions, 0.01))
+    noisy /= noisy.sum(axis=1, keepdims=True)
+    return np.round(noisy * totals)
+
+
+def synthetic_stats(stats, seed=0):
+    """
+    Build a synthetic transition from a real one's precinct data.
+
+    Keeps the real earlier-election precinct votes X, replaces Y with
+    votes simulated from a known matrix, and recomputes the statistics.
+
+    Returns:
+        (stats, M_true)
+    """
+    rng = np.random.default_rng(seed)
+    X = stats['x']
+    M_true = ground_truth_matrix(X.shape[1], stats['y'].shape[1], rng)
+    Y = simulate_votes(X, M_true, rng)
+    return {
+        **stats,
+        'y': Y,
+        'xty': X.T @ Y,
+        'yty': Y.T @ Y,
+        'y_sum': Y.sum(axis=0),
+    }, M_true
+
+
+def run_method(method, stats, include_abstention, M_true=None):
+    """Solve one transition with one method and measure it."""
+    analyzer = VoteTransferAnalyzer(method=method, include_abstention=include_abstention)
+
+    def solve():
+        return analyzer.solve_transfer_matrix(stats)[0]
+
+    # Timed and memory-traced separately: tracing slows down small allocations
+    start = time.perf_counter()
+    M = solve()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    solve()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    M = np.asarray(M, dtype=float)
+    result = {
+        'seconds': seconds,
+        'peak_memory_mb': peak / 2**20,
+        'objective': lstsq_objective(stats['xtx'], stats['xty'], M, np.trace(stats['yty'])),
+        'r_squared': transfer_r_squared(stats, M),
+        'max_row_sum_violation': float(np.abs(M.sum(axis=1) - 1).max()),
+        'min_entry': float(M.min()),
+        'truth_max_abs_error': None,
+        'truth_mean_abs_error': None,
+    }
+    if M_true is not None:
+        result['truth_max_abs_error'] = float(np.abs(M - M_true).max())
+        result['truth_mean_abs_error'] = float(np.abs(M - M_true).mean())
+    return result
+
+
+def run_benchmark(methods=METHODS, only_transitions=None, synthetic=True, seed=0):
+    """
+    Benchmark methods on real (and synthetic) transitions.
+
+    Args:
+        methods: Solver methods to run
+        only_transitions: Optional list of "X_to_Y" strings
+        synthetic: Whether to add a synthetic twin of every real transition
+        seed: Seed of the synthetic ground truths and noise
+
+    Returns:
+        List of result rows
+    """
+    rows = []
+    for from_id, to_id in TRANSITION_PAIRS:
+        name = f"{from_id}_to_{to_id}"
+        if only_transitions and name not in only_transitions:
+            continue
+        missing = [ELECTIONS[e]['file'] for e in (from_id, to_id) if not Path(ELECTIONS[e]['file']).exists()]
+        if missing:
+            logger.warning(f"Skipping {name}: missing {', '.join(missing)}")
+            continue
+
+        for include_abstention in (False, True):
+            analyzer = VoteTransferAnalyzer(include_abstention=include_abstention)
+            stats = analyzer.select_transition_stats(analyzer.load_transition_stats(from_id, to_id))
+            cases = [('real', stats, None)]
+            if synthetic:
+                cases.append(('synthetic', *synthetic_stats(stats, seed=seed)))
+
+            for kind, case_stats, M_true in cases:
+                for method in methods:
+                    label = f"{name}{' +abstention' if include_abstention else ''} [{kind}] {method}"
+                    logger.info(f"Benchmarking {label}")
+                    rows.append({
+                        'transition': name,
+                        'abstention': include_abstention,
+                        'kind': kind,
+                        'method': method,
+                        **run_method(method, case_stats, include_abstention, M_true),
+                    })
+    return rows
+
+
+def _git_commit():
+    """Current git commit hash, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _fmt(value, spec):
+    """Format an optional number for the Markdown table."""
+    return '–' if value is None else format(value, spec)
+
+
+def format_markdown(report):
+    """Render benchmark rows as a Markdown table plus per-method medians."""
+    lines = [
+        f"# Transfer solver benchmark ({report['generated_at']}, commit {report['git_commit'] or 'unknown'})",
+        '',
+        '| Transition | Abst. | Kind | Method | Time (s) | Peak MB | Objective | R² '
+        '| Row-sum viol. | Min entry | Truth max err | Truth mean err |',
+        '|---|---|---|---|---:|---:|---:|---:|---:|---:|---:|---:|',
+    ]
+    for row in report['results']:
+        lines.append(
+            f"| {row['transition']} | {'yes' if row['abstention'] else 'no'} | {row['kind']} | {row['method']} "
+            f"| {row['seconds']:.4f} | {row['peak_memory_mb']:.2f} | {row['objective']:.6g} "
+            f"| {row['r_squared']:.4f} | {row['max_row_sum_violation']:.1e} | {row['min_entry']:.1e} "
+            f"| {_fmt(row['truth_max_abs_error'], '.4f')} | {_fmt(row['truth_mean_abs_error'], '.4f')} |"
+        )
+
+    lines += ['', '## Medians per method', '',
+              '| Method | Time (s) | Peak MB | Row-sum viol. | Truth mean err |',
+              '|---|---:|---:|---:|---:|']
+    for method in dict.fromkeys(row['method'] for row in report['results']):
+        rows = [row for row in report['results'] if row['method'] == method]
+        truth = [row['truth_mean_abs_error'] for row in rows if row['truth_mean_abs_error'] is not None]
+        lines.append(
+            f"| {method} | {np.median([r['seconds'] for r in rows]):.4f} "
+            f"| {np.median([r['peak_memory_mb'] for r in rows]):.2f} "
+            f"| {np.median([r['max_row_sum_violation'] for r in rows]):.1e} "
+            f"| {_fmt(float(np.median(truth)) if truth else None, '.4f')} |"
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def save_report(rows, output=BENCHMARK_OUTPUT):
+    """Write the benchmark rows as <output>.json and <output>.md."""
+    report = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git_commit': _git_commit(),
+        'results': rows,
+    }
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(output.with_suffix('.md'), 'w', encoding='utf-8') as f:
+        f.write(format_markdown(report))
+    logger.info(f"Saved {output.with_suffix('.json')} and {output.with_suffix('.md')}")
+
+
+def main():
+    """Benchmark all solver methods on real and synthetic transitions."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark transfer matrix solvers')
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS,
+                        help='Methods to benchmark (default: all)')
+    parser.add_argument('--transitions', nargs='+',
+                        help='Only benchmark specific transitions, e.g. --transitions 24_to_25')
+    parser.add_argument('--no-synthetic', action='store_true',
+                        help='Skip the synthetic ground-truth transitions')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic data seed (default: 0)')
+    parser.add_argument('--output', default=str(BENCHMARK_OUTPUT),
+                        help=f'Output prefix for .json/.md (default: {BENCHMARK_OUTPUT})')
+    args = parser.parse_args()
+
+    rows = run_benchmark(methods=args.methods, only_transitions=args.transitions,
+                         synthetic=not args.no_synthetic, seed=args.seed)
+    save_report(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Out-of-sample comparison of transfer solvers and fitting options.
+
+The R² stored with every transfer is in-sample. This script splits the
+matched precincts of each transition into folds by settlement (so that
+neighbouring boxes of one town never sit on both sides of a split), fits
+every configuration on the training folds and scores it on the held-out
+precincts (RMSE and R² of the vote counts, and Poisson deviance, which
+judges each error relative to the precinct's expected count):
+
+    python cross_validate_transfers.py --folds 10 --jobs 4
+
+Training statistics are the cached full-transition Gram matrices minus the
+held-out block, so unweighted folds cost one k x k solve each; weighted
+and robust configurations re-form their Gram matrices and the Poisson
+estimator runs its EM from the cached per-precinct votes. Every
+(transition, abstention, fold) job runs in a process pool and evaluates
+all configurations.
+
+Results are written as data/benchmarks/cross_validation.{json,md}.
+"""
+
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from generate_transfer_data import METHODS, VoteTransferAnalyzer, select_pairs
+from party_config import ELECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Default output prefix (.json and .md are appended)
+CV_OUTPUT = Path('data/benchmarks/cross_validation')
+
+# Default number of settlement folds
+DEFAULT_FOLDS = 10
+
+# Floor on predicted counts in the held-out Poisson deviance: least-squares
+# matrices can predict exactly zero votes for a party that got some
+DEVIANCE_MIN_MEAN = 0.5
+
+# Evaluated configurations: every solver, plus weighted and robust fits
+CV_CONFIGS = [{'name': method, 'method': method} for method in METHODS] + [
+    {'name': 'weighted_eligible', 'method': 'projected_gradient', 'weighting': 'eligible'},
+    {'name': 'weighted_inverse_variance', 'method': 'projected_gradient', 'weighting': 'inverse_variance'},
+    {'name': 'robust', 'method': 'projected_gradient', 'robust': True},
+]
+
+
+def settlement_folds(settlements, n_folds, seed=0):
+    """
+    Assign precincts to folds so that every settlement is in one fold.
+
+    Settlements are placed largest first into the currently smallest fold
+    (ties broken by a seeded shuffle), which balances fold sizes even with
+    Jerusalem's hundreds of boxes.
+
+    Returns:
+        int array of fold indices, one per precinct
+    """
+    codes = np.unique(np.asarray(settlements), return_inverse=True)[1]
+    counts = np.bincount(codes)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(counts))
+    order = order[np.argsort(-counts[order], kind='stable')]
+
+    sizes = np.zeros(n_folds, dtype=int)
+    fold_of = np.empty(len(counts), dtype=int)
+    for g in order:
+        fold_of[g] = np.argmin(sizes)
+        sizes[fold_of[g]] += counts[g]
+    return fold_of[codes]
+
+
+def poisson_deviance(Y, mu):
+    """Poisson deviance 2 * sum(y log(y / mu) - (y - mu)), with mu floored at DEVIANCE_MIN_MEAN."""
+    mu = np.maximum(mu, DEVIANCE_MIN_MEAN)
+    log_ratio = np.log(np.where(Y > 0, Y, 1.0) / mu)
+    return float(2 * (np.where(Y > 0, Y * log_ratio, 0.0) - (Y - mu)).sum())
+
+
+def evaluate_fold(stats, test, configs):
+    """
+    Fit every configuration without the test precincts and score it on them.
+
+    Module-level so it can run in a worker process.
+
+    Args:
+        stats: Statistics from select_transition_stats (with per-precinct x, y)
+        test: Boolean mask of the held-out precincts
+        configs: Entries of CV_CONFIGS
+
+    Returns:
+        dict of config name -> held-out sums (ss_res, ss_tot, deviance,
+        cells, precincts, seconds)
+    """
+    X, Y = stats['x'], stats['y']
+    X_test, Y_test = X[test], Y[test]
+    train = {
+        'symbols_from': stats['symbols_from'],
+        'symbols_to': stats['symbols_to'],
+        'x': X[~test],
+        'y': Y[~test],
+        'eligible': stats['eligible'][~test],
+        'xtx': stats['xtx'] - X_test.T @ X_test,
+        'xty': stats['xty'] - X_test.T @ Y_test,
+        'yty': stats['yty'] - Y_test.T @ Y_test,
+    }
+    ss_tot = float(((Y_test - Y_test.mean(axis=0)) ** 2).sum())
+
+    scores = {}
+    for config in configs:
+        analyzer = VoteTransferAnalyzer(method=config['method'], include_abstention=False,
+                                        weighting=config.get('weighting', 'none'),
+                                        robust=config.get('robust', False))
+        start = time.perf_counter()
+        M, _ = analyzer.solve_transfer_matrix(train)
+        seconds = time.perf_counter() - start
+        predicted = X_test @ np.asarray(M, dtype=float)
+        residual = Y_test - predicted
+        scores[config['name']] = {
+            'ss_res': float((residual ** 2).sum()),
+            'ss_tot': ss_tot,
+            'deviance': poisson_deviance(Y_test, predicted),
+            'cells': residual.size,
+            'precincts': len(residual),
+            'seconds': seconds,
+        }
+    return scores
+
+
+def cross_validate(only_transitions=None, n_folds=DEFAULT_FOLDS, configs=CV_CONFIGS, seed=0, jobs=1,
+                   abstention_modes=(False, True)):
+    """
+    Settlement-grouped k-fold cross-validation over transitions.
+
+    Returns:
+        List of result rows, one per (transition, abstention, config), with
+        pooled held-out RMSE (votes per precinct and party), R², Poisson
+        deviance per precinct, and the per-fold R² values
+    """
+    cases = []
+    for from_id, to_id in select_pairs(only_transitions):
+        missing = [ELECTIONS[e]['file'] for e in (from_id, to_id) if not Path(ELECTIONS[e]['file']).exists()]
+        if missing:
+            logger.warning(f"Skipping {from_id} → {to_id}: missing {', '.join(missing)}")
+            continue
+        for include_abstention in abstention_modes:
+            analyzer = VoteTransferAnalyzer(include_abstention=include_abstention)
+            stats = analyzer.select_transition_stats(analyzer.load_transition_stats(from_id, to_id))
+            # ballot_id is "<settlement code>__<ballot number>"
+            settlements = np.char.partition(stats['ballot_id'], b'__')[:, 0]
+            folds = settlement_folds(settlements, n_folds, seed=seed)
+            cases.append((f"{from_id}_to_{to_id}", include_abstention, stats, folds))
+
+    job_args = [(stats, folds == fold, configs)
+                for _, _, stats, folds in cases for fold in range(n_folds)]
+    start = time.perf_counter()
+    if jobs > 1:
+        logger.info(f"Running {len(job_args)} fold jobs on {jobs} worker processes")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            outcomes = list(executor.map(evaluate_fold, *zip(*job_args)))
+    else:
+        outcomes = [evaluate_fold(*args) for args in job_args]
+    logger.info(f"Cross-validation: {len(job_args)} folds in {time.perf_counter() - start:.2f}s")
+
+    rows = []
+    for c, (transition, include_abstention, _, _) in enumerate(cases):
+        fold_scores = outcomes[c * n_folds:(c + 1) * n_folds]
+        for config in configs:
+            scores = [fold[config['name']] for fold in fold_scores]
+            ss_res = sum(s['ss_res'] for s in scores)
+            ss_tot = sum(s['ss_tot'] for s in scores)
+            rows.append({
+                'transition': transition,
+                'abstention': include_abstention,
+                'config': config['name'],
+                'folds': n_folds,
+                'rmse': float(np.sqrt(ss_res / sum(s['cells'] for s in scores))),
+                'r_squared': float(1 - ss_res / ss_tot),
+                'deviance': sum(s['deviance'] for s in scores) / sum(s['precincts'] for s in scores),
+                'fold_r_squared': [round(1 - s['ss_res'] / s['ss_tot'], 4) for s in scores],
+                'seconds': sum(s['seconds'] for s in scores),
+            })
+    return rows
+
+
+def format_markdown(report):
+    """Render cross-validation rows as a Markdown table plus per-config means."""
+    lines = [
+        f"# Transfer cross-validation ({report['generated_at']}, {report['folds']} settlement folds)",
+        '',
+        '| Transition | Abst. | Config | Held-out RMSE | Held-out R² | Deviance / precinct | Fit time (s) |',
+        '|---|---|---|---:|---:|---:|---:|',
+    ]
+    for row in report['results']:
+        lines.append(
+            f"| {row['transition']} | {'yes' if row['abstention'] else 'no'} | {row['config']} "
+            f"| {row['rmse']:.2f} | {row['r_squared']:.4f} | {row['deviance']:.1f} | {row['seconds']:.3f} |"
+        )
+
+    lines += ['', '## Means per configuration', '',
+              '| Config | Held-out RMSE | Held-out R² | Deviance / precinct | Fit time (s) |',
+              '|---|---:|---:|---:|---:|']
+    for config in dict.fromkeys(row['config'] for row in report['results']):
+        rows = [row for row in report['results'] if row['config'] == config]
+        lines.append(f"| {config} | {np.mean([r['rmse'] for r in rows]):.2f} "
+                     f"| {np.mean([r['r_squared'] for r in rows]):.4f} "
+                     f"| {np.mean([r['deviance'] for r in rows]):.1f} "
+                     f"| {np.mean([r['seconds'] for r in rows]):.3f} |")
+    return '\n'.join(lines) + '\n'
+
+
+def save_report(rows, n_folds, output=CV_OUTPUT):
+    """Write the cross-validation rows as <output>.json and <output>.md."""
+    report = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'folds': n_folds,
+        'results': rows,
+    }
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(output.with_suffix('.md'), 'w', encoding='utf-8') as f:
+        f.write(format_markdown(report))
+    logger.info(f"Saved {output.with_suffix('.json')} and {output.with_suffix('.md')}")
+
+
+def main():
+    """Cross-validate all solver configurations on all transitions."""
+    import argparse
+    names = [config['name'] for config in CV_CONFIGS]
+    parser = argparse.ArgumentParser(description='Settlement-grouped cross-validation of transfer solvers')
+    parser.add_argument('--transitions', nargs='+',
+                        help='Only use specific transitions, e.g. --transitions 24_to_25')
+    parser.add_argument('--configs', nargs='+', default=names, choices=names,
+                        help='Configurations to evaluate (default: all)')
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS,
+                        help=f'Number of settlement folds (default: {DEFAULT_FOLDS})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for the fold jobs (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Fold assignment tie-break seed (default: 0)')
+    parser.add_argument('--output', default=str(CV_OUTPUT),
+                        help=f'Output prefix for .json/.md (default: {CV_OUTPUT})')
+    args = parser.parse_args()
+
+    configs = [config for config in CV_CONFIGS if config['name'] in args.configs]
+    rows = cross_validate(only_transitions=args.transitions, n_folds=args.folds, configs=configs,
+                          seed=args.seed, jobs=args.jobs)
+    save_report(rows, args.folds, args.output)
+
+
+if __name__ == '__main__':
+    main()
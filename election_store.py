@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Canonical columnar store of the election ballot data.
+
+Parsing a ballot CSV (~10k rows) dominates the cost of every generator
+that reads it, and each CSV has its own encoding (utf-8-sig or iso8859_8),
+ballot number column (קלפי or מספר קלפי) and, for K16/K17, x10 ballot
+numbering. This module is the one place that knows about those
+differences. It parses each election once and keeps:
+
+1. An in-process LRU of the normalized, ballot_id-indexed DataFrames.
+2. An on-disk copy under data/cache/elections/<id>/ as plain .npy arrays
+   that are memory-mapped on load, keyed by the CSV's size/mtime and the
+   relevant ELECTIONS fields: the party votes as one int32 matrix with its
+   symbol array, the metadata columns grouped by type, and the normalized
+   ballot IDs. The manifest also records the raw rows that normalization
+   dropped (frame.attrs['dropped']) and the blank party cells it filled
+   (frame.attrs['missing_party_cells']), for validate_elections.py.
+3. The raw rows of every CSV, duplicates and city 9999 included, in the
+   same .npy layout under data/cache/elections_raw/<id>/ with the CSV's
+   own dtypes (blank cells stay NaN), for the few tools that must see
+   every row (load_raw_frame).
+
+Generators load elections through load_election_frame (or
+load_election_votes / election_symbols); the store is filled lazily, or
+for all elections at once with the ingest step:
+
+    python election_store.py
+
+Frames returned from the cache are shared; treat them as read-only.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ballot_matching import make_ballot_ids, match_ballot_ids
+from party_config import ELECTIONS
+
+logger = logging.getLogger(__name__)
+
+# On-disk cache of normalized election frames
+ELECTION_CACHE_DIR = Path('data/cache/elections')
+
+# On-disk cache of the raw CSV rows
+RAW_CACHE_DIR = Path('data/cache/elections_raw')
+
+# Bump when the normalization or the on-disk layout changes
+ELECTION_CACHE_VERSION = 5
+
+# ELECTIONS fields that affect the normalized frame
+FRAME_CONFIG_KEYS = ('file', 'encoding', 'ballot_field', 'ballot_number_divisor')
+
+# Number of parsed elections kept in memory
+LRU_SIZE = 12
+
+# Number of raw election frames kept in memory (their generators read each once)
+RAW_LRU_SIZE = 2
+
+# Number of precinct match indexes kept in memory (all 55 pairs of K16-K26)
+MATCH_LRU_SIZE = 64
+
+# Disk cache counters (the in-memory LRUs keep their own via cache_info())
+_disk_stats = {'hits': 0, 'misses': 0}
+
+
+def available_elections():
+    """Election IDs in chronological order whose ballot file exists."""
+    ids = sorted(ELECTIONS, key=int)
+    missing = [e for e in ids if not Path(ELECTIONS[e]['file']).exists()]
+    if missing:
+        logger.info(f"Skipping elections without ballot files: {', '.join(missing)}")
+    return [e for e in ids if e not in missing]
+
+
+def party_columns(df):
+    """All party vote columns of a frame (everything after כשרים)."""
+    columns = list(df.columns)
+    return [c for c in columns[columns.index('כשרים') + 1:]
+            if not str(c).startswith('Unnamed') and pd.api.types.is_numeric_dtype(df[c])]
+
+
+def read_raw_csv(election_id):
+    """
+    Parse an election CSV as is, with the election's encoding.
+
+    The parser behind the store; tools that must reproduce every raw row
+    (e.g. city 9999) load it through load_raw_frame, all other code through
+    load_election_frame.
+    """
+    config = ELECTIONS[election_id]
+    logger.info(f"Loading {config['name']} from {config['file']}")
+    df = pd.read_csv(config['file'], encoding=config['encoding'])
+    logger.info(f"Loaded {len(df)} precincts")
+    return df
+
+
+def read_election_csv(election_id):
+    """
+    Parse an election CSV into a frame indexed by normalized ballot_id.
+
+    ballot_id is "<settlement code>__<ballot number>" with trailing ".0"
+    removed and K16/K17 x10 numbering divided out. City 9999 (aggregated
+    data) and duplicate ballot IDs are dropped, and party votes are
+    integers (missing counts are 0). What was dropped is kept in
+    df.attrs['dropped'], and the number of blank party cells of every
+    affected row in df.attrs['missing_party_cells'] (ballot_id -> count).
+    """
+    config = ELECTIONS[election_id]
+    df = read_raw_csv(election_id)
+    symbols = party_columns(df)
+    missing_cells = df[symbols].isna().sum(axis=1).to_numpy()
+    df[symbols] = df[symbols].fillna(0).astype(np.int32)
+
+    # Create unique ballot ID
+    ballot_field = config.get('ballot_field', 'קלפי')
+    divisor = config.get('ballot_number_divisor', 1)
+    df['ballot_id'] = make_ballot_ids(df['סמל ישוב'], df[ballot_field], divisor)
+
+    # Filter out city 9999 (aggregated/invalid data)
+    aggregated = (df['סמל ישוב'] == 9999).to_numpy()
+    dropped = {
+        'city_9999_rows': int(aggregated.sum()),
+        'city_9999_valid_votes': int(df.loc[aggregated, 'כשרים'].fillna(0).sum()),
+    }
+    df = df[~aggregated]
+    missing_cells = missing_cells[~aggregated]
+    df = df.set_index('ballot_id')
+
+    # Remove duplicate ballot IDs (can happen with historical data from CKAN API)
+    dupes = df.index.duplicated(keep='first')
+    dropped['duplicate_ids'] = df.index[dupes].tolist()
+    if dupes.any():
+        logger.warning(f"Removing {dupes.sum()} duplicate ballot IDs")
+        df = df[~dupes]
+        missing_cells = missing_cells[~dupes]
+    df.attrs['dropped'] = dropped
+    df.attrs['missing_party_cells'] = {ballot_id: int(n) for ballot_id, n in zip(df.index, missing_cells) if n}
+
+    logger.info(f"{len(df)} precincts after filtering")
+
+    return df
+
+
+def frame_cache_key(election_id):
+    """Cache key for an election frame: CSV size/mtime plus relevant config."""
+    config = ELECTIONS[election_id]
+    st = os.stat(config['file'])
+    return {
+        'version': ELECTION_CACHE_VERSION,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'config': {key: config.get(key) for key in FRAME_CONFIG_KEYS},
+    }
+
+
+def _write_frame(cache_dir, df, key, votes=True):
+    """
+    Write a frame as .npy arrays plus a JSON manifest.
+
+    With votes, the party columns form one int32 matrix (normalized frames);
+    otherwise every column keeps its own dtype group (raw frames, whose
+    party columns may hold blanks).
+    """
+    symbols = set(party_columns(df)) if votes else set()
+    columns = []
+    for col in df.columns:
+        kind = df[col].dtype.kind
+        group = 'votes' if col in symbols else 'int' if kind in 'iub' else 'float' if kind == 'f' else 'str'
+        columns.append({'name': col, 'group': group})
+
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=cache_dir.parent, prefix=f'.{cache_dir.name}.'))
+    for group, dtype in (('votes', np.int32), ('int', np.int64), ('float', np.float64)):
+        cols = [c['name'] for c in columns if c['group'] == group]
+        values = df[cols].to_numpy(dtype=dtype) if cols else np.empty((len(df), 0), dtype=dtype)
+        np.save(tmp_dir / f'{group}_values.npy', values)
+    for i, c in enumerate(columns):
+        if c['group'] == 'str':
+            c['file'] = f'str_{i}.npy'
+            np.save(tmp_dir / c['file'], df[c['name']].astype(str).to_numpy(dtype=str))
+            c['na'] = df[c['name']].isna().to_numpy().nonzero()[0].tolist()
+    np.save(tmp_dir / 'index.npy', df.index.to_numpy(dtype=str if df.index.name == 'ballot_id' else None))
+    with open(tmp_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump({'key': key, 'columns': columns, 'index_name': df.index.name, 'attrs': df.attrs},
+                  f, ensure_ascii=False)
+
+    # Replace any stale entry; another process may have won the race
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _read_frame(cache_dir, key):
+    """Memory-map a cached frame; returns None if missing or stale."""
+    manifest_file = cache_dir / 'manifest.json'
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['key'] != key:
+        return None
+
+    index = pd.Index(np.load(cache_dir / 'index.npy'), name=manifest['index_name'])
+    parts = []
+    for group in ('votes', 'int', 'float'):
+        cols = [c['name'] for c in manifest['columns'] if c['group'] == group]
+        if cols:
+            values = np.load(cache_dir / f'{group}_values.npy', mmap_mode='r')
+            parts.append(pd.DataFrame(values, index=index, columns=cols, copy=False))
+    for c in manifest['columns']:
+        if c['group'] == 'str':
+            values = pd.Series(np.load(cache_dir / c['file']), index=index, name=c['name'])
+            if c['na']:
+                values.iloc[c['na']] = np.nan
+            parts.append(values.to_frame())
+    df = pd.concat(parts, axis=1, copy=False)
+    df = df[[c['name'] for c in manifest['columns']]]
+    df.attrs.update(manifest['attrs'])
+    return df
+
+
+@lru_cache(maxsize=LRU_SIZE)
+def _load_frame(election_id, use_disk):
+    """Load a normalized frame from the disk cache or the CSV (memoized)."""
+    cache_dir = ELECTION_CACHE_DIR / election_id
+    key = frame_cache_key(election_id) if use_disk else None
+
+    if use_disk:
+        df = _read_frame(cache_dir, key)
+        if df is not None:
+            _disk_stats['hits'] += 1
+            logger.info(f"Loaded {ELECTIONS[election_id]['name']} from {cache_dir} "
+                        f"({len(df)} precincts)")
+            return df
+        _disk_stats['misses'] += 1
+
+    df = read_election_csv(election_id)
+    if use_disk:
+        _write_frame(cache_dir, df, key)
+        logger.info(f"Cached normalized frame to {cache_dir}")
+    return df
+
+
+@lru_cache(maxsize=RAW_LRU_SIZE)
+def _load_raw_frame(election_id, use_disk):
+    """Load an election's raw rows from the disk cache or the CSV (memoized)."""
+    cache_dir = RAW_CACHE_DIR / election_id
+    key = frame_cache_key(election_id) if use_disk else None
+
+    if use_disk:
+        df = _read_frame(cache_dir, key)
+        if df is not None:
+            _disk_stats['hits'] += 1
+            logger.info(f"Loaded {ELECTIONS[election_id]['name']} raw rows from {cache_dir} ({len(df)} rows)")
+            return df
+        _disk_stats['misses'] += 1
+
+    df = read_raw_csv(election_id)
+    if use_disk:
+        _write_frame(cache_dir, df, key, votes=False)
+        logger.info(f"Cached raw rows to {cache_dir}")
+    return df
+
+
+def load_raw_frame(election_id, use_disk=True):
+    """
+    Load every raw row of an election's CSV, as read_raw_csv parses it.
+
+    Duplicate ballot IDs and city 9999 rows are kept and blank cells stay
+    NaN; the index is the CSV row position. For tools that must see every
+    row (irregularity scoring, t-SNE stations, the K26 simulation); all
+    other code should use load_election_frame.
+
+    Args:
+        election_id: Key into ELECTIONS
+        use_disk: Whether to use the on-disk .npy cache
+
+    Returns:
+        DataFrame shared between callers and read-only
+    """
+    return _load_raw_frame(election_id, use_disk)
+
+
+def load_election_frame(election_id, use_disk=True):
+    """
+    Load the normalized, ballot_id-indexed frame for an election.
+
+    Args:
+        election_id: Key into ELECTIONS
+        use_disk: Whether to use the on-disk .npy cache
+
+    Returns:
+        (df, config) tuple; df is shared between callers and read-only
+    """
+    df = _load_frame(election_id, use_disk)
+    return df, ELECTIONS[election_id]
+
+
+def election_symbols(election_id, use_disk=True):
+    """Party symbols (ballot columns) of an election, in CSV order."""
+    df, _ = load_election_frame(election_id, use_disk=use_disk)
+    return party_columns(df)
+
+
+def load_election_votes(election_id, use_disk=True):
+    """
+    Party votes of an election as an integer matrix.
+
+    Returns:
+        (votes, symbols) with votes an int32 (n_precincts, n_lists) array
+        aligned with the rows of load_election_frame
+    """
+    df, _ = load_election_frame(election_id, use_disk=use_disk)
+    symbols = party_columns(df)
+    return df[symbols].to_numpy(dtype=np.int32), symbols
+
+
+@lru_cache(maxsize=MATCH_LRU_SIZE)
+def build_match_index(election_from, election_to, use_disk=True):
+    """
+    Match the precincts of two elections (memoized).
+
+    The elections need not be consecutive: the same rules match precincts
+    across a multi-election gap. With use_disk the positions are the
+    integer joins of the two elections' (cached) ballot registry; without
+    it the ballot ID strings are matched directly (same result).
+
+    Returns:
+        DataFrame of matched (from_id, to_id) pairs with their row positions
+        in the normalized frames (see ballot_matching.match_ballot_ids);
+        shared between callers and read-only
+    """
+    df_from, _ = load_election_frame(election_from, use_disk=use_disk)
+    df_to, _ = load_election_frame(election_to, use_disk=use_disk)
+    if not use_disk:
+        return match_ballot_ids(df_from.index, df_to.index)
+
+    # Imported here: ballot_registry loads its elections through this module
+    from ballot_registry import load_registry
+    registry = load_registry((election_from, election_to))
+    from_pos, to_pos, fallback = registry.join(election_from, election_to)
+    return pd.DataFrame({
+        'from_id': df_from.index[from_pos],
+        'to_id': df_to.index[to_pos],
+        'from_pos': from_pos,
+        'to_pos': to_pos,
+        'fallback': fallback,
+    })
+
+
+def cache_stats():
+    """Hit/miss counts of the in-memory LRUs and the on-disk cache."""
+    infos = (_load_frame.cache_info(), _load_raw_frame.cache_info())
+    return {
+        'memory_hits': sum(info.hits for info in infos),
+        'memory_misses': sum(info.misses for info in infos),
+        'disk_hits': _disk_stats['hits'],
+        'disk_misses': _disk_stats['misses'],
+    }
+
+
+def log_cache_stats():
+    """Log the election cache hit/miss counts."""
+    stats = cache_stats()
+    logger.info(f"Election cache: memory {stats['memory_hits']} hits / {stats['memory_misses']} misses, "
+                f"disk {stats['disk_hits']} hits / {stats['disk_misses']} misses")
+
+
+def clear_memory_cache():
+    """Drop all in-memory frames and match indexes (the on-disk cache is kept)."""
+    _load_frame.cache_clear()
+    _load_raw_frame.cache_clear()
+    build_match_index.cache_clear()
+
+
+def ingest(election_ids=None, force=False):
+    """
+    Build the on-disk store (normalized and raw frames) for every election
+    whose ballot file exists.
+
+    Args:
+        election_ids: Elections to ingest (default: all in ELECTIONS)
+        force: Rebuild entries even if they are up to date
+
+    Returns:
+        List of (election_id, precincts, lists, load_ms) rows, where load_ms
+        is the time to load the election from the store
+    """
+    rows = []
+    for election_id in election_ids or sorted(ELECTIONS, key=int):
+        if not Path(ELECTIONS[election_id]['file']).exists():
+            logger.warning(f"Skipping {election_id}: missing {ELECTIONS[election_id]['file']}")
+            continue
+        if force:
+            shutil.rmtree(ELECTION_CACHE_DIR / election_id, ignore_errors=True)
+            shutil.rmtree(RAW_CACHE_DIR / election_id, ignore_errors=True)
+        load_election_frame(election_id)
+        load_raw_frame(election_id)
+        clear_memory_cache()
+        start = time.perf_counter()
+        df, _ = load_election_frame(election_id)
+        load_ms = (time.perf_counter() - start) * 1000
+        rows.append((election_id, len(df), len(party_columns(df)), load_ms))
+    return rows
+
+
+def main():
+    """Convert all ballot CSVs into the canonical columnar store."""
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Ingest ballot CSVs into data/cache/elections')
+    parser.add_argument('--elections', nargs='+', help='Only ingest specific elections, e.g. --elections 24 25')
+    parser.add_argument('--force', action='store_true', help='Rebuild entries that are up to date')
+    args = parser.parse_args()
+
+    rows = ingest(args.elections, force=args.force)
+    logger.info(f"\n{'Election':<10} {'Precincts':>10} {'Lists':>6} {'Load':>10}")
+    for election_id, precincts, lists, load_ms in rows:
+        logger.info(f"{election_id:<10} {precincts:>10} {lists:>6} {load_ms:>8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
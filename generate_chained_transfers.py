@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Generate vote transfer matrices for any pair of elections.
+
+generate_transfer_data.py only estimates consecutive transitions. For a
+non-consecutive pair (e.g. 20 → 25) this module produces two estimates:
+
+1. Direct: precincts of the two elections are matched across the gap with
+   the usual ballot matching rules and the matrix is solved from their
+   statistics, exactly like a consecutive transition.
+2. Chained: the consecutive matrices in between are multiplied,
+   M_20→25 = M_20→21 · M_21→22 · ... · M_24→25, so every intermediate
+   election's precincts contribute.
+
+Frames and match indexes are loaded once (election_store) and the
+per-pair statistics go through the regular cache, so all 55 pairs among
+K16-K26 are generated in one run. The export holds the direct estimate in
+the sankey.html schema plus the chained matrix and a comparison of both:
+
+    python generate_chained_transfers.py --transitions 20_to_25
+
+Exports data/all_pair_transfers[_abstention].json.
+"""
+
+import json
+import logging
+import time
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+
+from election_store import available_elections, log_cache_stats
+from generate_transfer_data import METHODS, VoteTransferAnalyzer, transfer_r_squared
+
+logger = logging.getLogger(__name__)
+
+
+def all_pairs(election_ids, only_transitions=None):
+    """All (earlier, later) pairs, optionally filtered to "X_to_Y" strings."""
+    pairs = list(combinations(election_ids, 2))
+    if only_transitions:
+        requested = set(only_transitions)
+        pairs = [(f, t) for f, t in pairs if f"{f}_to_{t}" in requested]
+    return pairs
+
+
+def _percent_matrix(M):
+    """Matrix as nested lists of percentages with one decimal."""
+    return np.round(M * 100, 1).tolist()
+
+
+class ChainedTransferEngine:
+    """Direct and chained transfer estimates for arbitrary election pairs."""
+
+    def __init__(self, method='projected_gradient', include_abstention=False, use_cache=True):
+        """
+        Initialize the engine.
+
+        Args:
+            method: Solver method passed to VoteTransferAnalyzer
+            include_abstention: Whether to include "did not vote" pseudo-party
+            use_cache: Whether to use the statistics and election caches
+        """
+        self.analyzer = VoteTransferAnalyzer(method=method, include_abstention=include_abstention,
+                                             use_cache=use_cache)
+        self.election_ids = available_elections()
+        self._solved = {}
+
+    def solve_pair(self, election_from, election_to):
+        """Statistics and matrix of a directly matched pair (memoized)."""
+        key = (election_from, election_to)
+        if key not in self._solved:
+            stats = self.analyzer.select_transition_stats(
+                self.analyzer.load_transition_stats(election_from, election_to)
+            )
+            M, _ = self.analyzer.solve_transfer_matrix(stats)
+            self._solved[key] = (stats, M)
+        return self._solved[key]
+
+    def chained_matrix(self, election_from, election_to):
+        """
+        Product of the consecutive matrices between two elections.
+
+        Raises:
+            ValueError: If the party columns of consecutive matrices differ
+        """
+        ids = self.election_ids
+        path = ids[ids.index(election_from):ids.index(election_to) + 1]
+        M = None
+        symbols = None
+        for a, b in zip(path[:-1], path[1:]):
+            stats, M_step = self.solve_pair(a, b)
+            if symbols is not None and list(stats['symbols_from']) != symbols:
+                raise ValueError(f"Cannot chain through {a}: party columns differ")
+            M = M_step if M is None else M @ M_step
+            symbols = list(stats['symbols_to'])
+        return M
+
+    def compute_pair(self, election_from, election_to):
+        """
+        Direct estimate, chained estimate and their comparison for one pair.
+
+        Returns:
+            dict in the generate_transfer_data schema with an added
+            'chained' entry
+        """
+        stats, M_direct = self.solve_pair(election_from, election_to)
+        data = self.analyzer.build_transfer_data(election_from, election_to, stats, M_direct)
+
+        steps = self.election_ids.index(election_to) - self.election_ids.index(election_from)
+        M_chained = M_direct if steps == 1 else self.chained_matrix(election_from, election_to)
+        diff = np.abs(M_chained - M_direct) * 100
+        # Largest disagreements weighted by the source party's votes
+        weights = stats['national_from'] / stats['national_from'].sum()
+
+        data['chained'] = {
+            'steps': steps,
+            'matrix': _percent_matrix(M_chained),
+            'direct_matrix': _percent_matrix(M_direct),
+            'r_squared': round(transfer_r_squared(stats, M_chained), 4),
+            'max_abs_diff_pp': round(float(diff.max()), 1),
+            'mean_abs_diff_pp': round(float(diff.mean()), 2),
+            'vote_weighted_abs_diff_pp': round(float(weights @ diff.mean(axis=1)), 2),
+        }
+        return data
+
+
+def save_pair_transfers(results, include_abstention=False, only_transitions=None):
+    """Write data/all_pair_transfers[_abstention].json (merged when running a subset)."""
+    suffix = '_abstention' if include_abstention else ''
+    Path('data').mkdir(exist_ok=True)
+    output_file = Path(f'data/all_pair_transfers{suffix}.json')
+
+    all_data = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'transitions': {f"{f}_to_{t}": data for (f, t), data in results},
+    }
+    if only_transitions and output_file.exists():
+        with open(output_file, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+        existing['transitions'].update(all_data['transitions'])
+        existing['generated_at'] = all_data['generated_at']
+        all_data = existing
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(all_data, f, ensure_ascii=False, separators=(',', ':'))
+    logger.info(f"Saved {output_file} ({output_file.stat().st_size / 1024:.0f} KB)")
+
+
+def run_pair_analysis(only_transitions=None, abstention_modes=(False, True), method='projected_gradient',
+                      use_cache=True):
+    """Compute and save direct and chained matrices for all (or selected) pairs."""
+    for include_abstention in abstention_modes:
+        label = ' (with abstention)' if include_abstention else ''
+        engine = ChainedTransferEngine(method=method, include_abstention=include_abstention,
+                                       use_cache=use_cache)
+        pairs = all_pairs(engine.election_ids, only_transitions)
+        if not pairs:
+            logger.warning(f"No matching pairs found for: {only_transitions}")
+            return
+
+        start = time.perf_counter()
+        results = []
+        for from_id, to_id in pairs:
+            logger.info(f"Pair {from_id} → {to_id}{label}")
+            data = engine.compute_pair(from_id, to_id)
+            chained = data['chained']
+            logger.info(f"{from_id} → {to_id}: R² direct {data['stats']['r_squared']:.4f}, "
+                        f"chained {chained['r_squared']:.4f}, "
+                        f"max diff {chained['max_abs_diff_pp']:.1f}pp")
+            results.append(((from_id, to_id), data))
+        logger.info(f"{len(pairs)} pairs{label} in {time.perf_counter() - start:.2f}s")
+        log_cache_stats()
+        save_pair_transfers(results, include_abstention=include_abstention, only_transitions=only_transitions)
+
+
+def main():
+    """Generate direct and chained transfer matrices for all election pairs."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate direct and chained transfer matrices for any pair')
+    parser.add_argument('--transitions', nargs='+',
+                        help='Only compute specific pairs, e.g. --transitions 20_to_25 16_to_25')
+    parser.add_argument('--method', default='projected_gradient', choices=METHODS,
+                        help='Transfer matrix solver (default: projected_gradient)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Recompute statistics from the CSVs instead of data/cache')
+    args = parser.parse_args()
+
+    run_pair_analysis(only_transitions=args.transitions, method=args.method, use_cache=not args.no_cache)
+
+    logger.info("\nDone!")
+
+
+if __name__ == '__main__':
+    main()
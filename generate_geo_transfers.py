@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Generate geographically weighted vote transfer matrices.
+
+Instead of fixed regions, every settlement centroid is an anchor with its
+own local matrix, fitted to the nearby matched precincts with a bisquare
+kernel weight w = (1 - (d / h)²)² that falls to zero at the bandwidth h.
+Sparse anchors get a wider, adaptive bandwidth covering at least
+MIN_NEIGHBOURS precincts. Like the regional matrices, each local problem
+is shrunk toward the national matrix:
+
+    min sum_i w_i ||x_i M - y_i||² + tau · tr((M - M_nat)ᵀ Ḡ (M - M_nat))
+
+Neighbourhoods come from a KD-tree over the precinct locations, and the
+local Gram matrices are one sparse product of the anchor x precinct kernel
+weights with the per-precinct outer products (k² work per neighbour), so
+all anchors of a transition are solved as one batched projected gradient
+problem.
+
+Precincts are located from site/data/station_coordinates.json by station
+("<settlement>|<ballot>", the later election's then the earlier one's),
+falling back to their settlement's mean station location; without the
+coordinates file nothing can be located and the transition is skipped.
+
+Exports data/transfer_geo_X_to_Y[_abstention].json, keyed by settlement
+code: matrices[i][a][b] is the share of party a's voters near settlement i
+that moved to party b, so the map can colour settlements by any one cell.
+"""
+
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+from ballot_venues import load_stations, station_keys
+from election_store import build_match_index, load_election_frame
+from generate_regional_transfers import SHRINKAGE_PRECINCTS, solve_groups
+from generate_transfer_data import VoteTransferAnalyzer, select_pairs
+from party_config import ELECTIONS
+from transfer_solvers import precinct_outer_products
+
+logger = logging.getLogger(__name__)
+
+# Default kernel bandwidth, in km
+DEFAULT_BANDWIDTH_KM = 10.0
+
+# Minimum precincts inside an anchor's (widened) bandwidth
+MIN_NEIGHBOURS = 50
+
+# Equirectangular projection around Israel's mean latitude (~31.5°N), km per degree
+KM_PER_DEG_LAT = 110.9
+KM_PER_DEG_LNG = 111.3 * np.cos(np.radians(31.5))
+
+
+def load_station_coordinates():
+    """
+    Coordinates of the geocoded ballot stations.
+
+    Returns:
+        dict mapping "<normalized settlement>|<ballot>" to (lat, lng);
+        empty if site/data/station_coordinates.json is missing
+    """
+    return {key: (float(station['lat']), float(station['lng'])) for key, station in load_stations().items()}
+
+
+def station_locations(df, coordinates):
+    """
+    Projected location (km) of every precinct of a normalized frame.
+
+    Returns:
+        (n, 2) float array of (east, north) km, NaN where the station is
+        not in the coordinates file
+    """
+    lat_lng = np.array([coordinates.get(key, (np.nan, np.nan)) for key in station_keys(df)],
+                       dtype=float).reshape(-1, 2)
+    return np.column_stack([lat_lng[:, 1] * KM_PER_DEG_LNG, lat_lng[:, 0] * KM_PER_DEG_LAT])
+
+
+def precinct_locations(election_from, election_to, n_matched, coordinates):
+    """
+    Locations and settlements of the matched precincts of a transition.
+
+    Stations missing from the later election's key fall back to the earlier
+    election's, then to the mean location of their settlement's stations.
+
+    Returns:
+        (locations, codes, settlements) where locations is (n, 2) km (NaN
+        rows = unlocated), codes indexes every precinct into settlements,
+        a DataFrame with 'code' and 'name' per settlement
+    """
+    matches = build_match_index(election_from, election_to)
+    if len(matches) != n_matched:
+        raise ValueError(f"Match index has {len(matches)} precincts, statistics have {n_matched}")
+
+    df_from, _ = load_election_frame(election_from)
+    df_to, _ = load_election_frame(election_to)
+    rows_to = df_to.iloc[matches['to_pos'].to_numpy()]
+    rows_from = df_from.iloc[matches['from_pos'].to_numpy()]
+
+    locations = station_locations(rows_to, coordinates)
+    missing = np.isnan(locations[:, 0])
+    locations[missing] = station_locations(rows_from, coordinates)[missing]
+
+    codes, uniques = pd.factorize(rows_to['סמל ישוב'].to_numpy())
+    names = rows_to['שם ישוב'].astype(str).str.strip().to_numpy()
+    first = pd.Series(np.arange(len(codes))).groupby(codes).first().to_numpy()
+    settlements = pd.DataFrame({'code': [str(int(c)) for c in uniques], 'name': names[first]})
+
+    # Settlement mean of the located stations for the remaining precincts
+    located = ~np.isnan(locations[:, 0])
+    counts = np.bincount(codes[located], minlength=len(uniques))
+    centroids = np.column_stack([
+        np.bincount(codes[located], weights=locations[located, axis], minlength=len(uniques))
+        for axis in (0, 1)
+    ]) / np.where(counts > 0, counts, np.nan)[:, None]
+    locations[~located] = centroids[codes[~located]]
+
+    logger.info(f"Located {located.mean():.1%} of matched precincts by station, "
+                f"{(~np.isnan(locations[:, 0])).mean():.1%} including settlement fallback")
+    return locations, codes, settlements
+
+
+def kernel_weights(points, anchors, bandwidth):
+    """
+    Sparse bisquare kernel weights of precincts around each anchor.
+
+    The bandwidth of an anchor is widened to its MIN_NEIGHBOURS-th nearest
+    precinct where that is further away.
+
+    Args:
+        points: (n, 2) precinct locations in km
+        anchors: (m, 2) anchor locations in km
+        bandwidth: Kernel bandwidth in km
+
+    Returns:
+        (W, radius) with W an (m, n) CSR matrix and radius (m,) in km
+    """
+    tree = cKDTree(points)
+    k = min(MIN_NEIGHBOURS, len(points))
+    nearest = tree.query(anchors, k=k)[0].reshape(len(anchors), k)[:, -1]
+    radius = np.maximum(bandwidth, nearest * (1 + 1e-9))
+
+    neighbours = tree.query_ball_point(anchors, r=radius)
+    counts = np.array([len(idx) for idx in neighbours])
+    cols = np.concatenate(neighbours).astype(int)
+    rows = np.repeat(np.arange(len(anchors)), counts)
+    dist = np.hypot(*(points[cols] - anchors[rows]).T)
+    weights = (1 - (dist / radius[rows]) ** 2) ** 2
+    return csr_matrix((weights, (rows, cols)), shape=(len(anchors), len(points))), radius
+
+
+def _percent_matrix(M):
+    """Matrix as nested lists of percentages with one decimal."""
+    return np.round(M * 100, 1).tolist()
+
+
+def compute_geo_transfers(election_from, election_to, include_abstention=False, bandwidth=DEFAULT_BANDWIDTH_KM,
+                          shrinkage=SHRINKAGE_PRECINCTS, coordinates=None, executor=None, jobs=1):
+    """
+    Compute geographically weighted transfer matrices for one transition.
+
+    Args:
+        election_from: Earlier election ID
+        election_to: Later election ID
+        include_abstention: Whether to include the "did not vote" pseudo-party
+        bandwidth: Kernel bandwidth in km
+        shrinkage: Weight of the national prior, in precincts
+        coordinates: Result of load_station_coordinates()
+        executor: Optional process pool for the batched anchor solve
+        jobs: Number of chunks to split the anchor batch into
+
+    Returns:
+        dict suitable for JSON export, or None if no precinct can be located
+    """
+    analyzer = VoteTransferAnalyzer(method='projected_gradient', include_abstention=include_abstention)
+    stats = analyzer.select_transition_stats(
+        analyzer.load_transition_stats(election_from, election_to)
+    )
+    X, Y = stats['x'], stats['y']
+    n = len(X)
+
+    if coordinates is None:
+        coordinates = load_station_coordinates()
+    locations, codes, settlements = precinct_locations(election_from, election_to, n, coordinates)
+    located = np.flatnonzero(~np.isnan(locations[:, 0]))
+    if len(located) == 0:
+        logger.warning(f"No located precincts for {election_from} → {election_to}, skipping")
+        return None
+
+    M_nat = analyzer.solve_transfer_matrix_from_stats(stats['xtx'], stats['xty'], stats['yty'])
+    G_bar = stats['xtx'] / n
+    prior_C = G_bar @ M_nat
+
+    # Anchors: vote-weighted centroids of the located settlements
+    votes = X[located].sum(axis=1)
+    n_settlements = len(settlements)
+    weight_sums = np.bincount(codes[located], weights=votes, minlength=n_settlements)
+    anchor_ids = np.flatnonzero(weight_sums > 0)
+    anchors = np.column_stack([
+        np.bincount(codes[located], weights=votes * locations[located, axis], minlength=n_settlements)
+        for axis in (0, 1)
+    ])[anchor_ids] / weight_sums[anchor_ids, None]
+
+    start = time.perf_counter()
+    W, radius = kernel_weights(locations[located], anchors, bandwidth)
+
+    # Weighted Gram matrices: one sparse product with the per-precinct outer products
+    XX, XY = precinct_outer_products(X[located], Y[located])
+    k_from, k_to = X.shape[1], Y.shape[1]
+    G = (W @ XX).reshape(-1, k_from, k_from) + shrinkage * G_bar
+    C = (W @ XY).reshape(-1, k_from, k_to) + shrinkage * prior_C
+    M0 = np.broadcast_to(M_nat, C.shape).copy()
+    M_all = solve_groups(G, C, M0, executor=executor, jobs=jobs)
+    logger.info(f"Solved {len(M_all)} local matrices ({W.nnz} kernel weights) "
+                f"in {time.perf_counter() - start:.2f}s")
+
+    effective = np.asarray(W.sum(axis=1)).ravel()
+    anchor_settlements = settlements.iloc[anchor_ids]
+    return {
+        'from_election': election_from,
+        'to_election': election_to,
+        'symbols_from': stats['symbols_from'],
+        'symbols_to': stats['symbols_to'],
+        'bandwidth_km': bandwidth,
+        'shrinkage_precincts': shrinkage,
+        'common_precincts': n,
+        'located_precincts': len(located),
+        'national': _percent_matrix(M_nat),
+        # Columnar: anchors[column][i] describes the anchor of settlement i
+        'anchors': {
+            'code': anchor_settlements['code'].tolist(),
+            'name': anchor_settlements['name'].tolist(),
+            'lat': np.round(anchors[:, 1] / KM_PER_DEG_LAT, 5).tolist(),
+            'lng': np.round(anchors[:, 0] / KM_PER_DEG_LNG, 5).tolist(),
+            'radius_km': np.round(radius, 1).tolist(),
+            'effective_precincts': np.round(effective, 1).tolist(),
+            'prior_weight': np.round(shrinkage / (effective + shrinkage), 3).tolist(),
+        },
+        'matrices': _percent_matrix(M_all),
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def save_geo_transfers(data, include_abstention=False):
+    """Write one compact transfer_geo_X_to_Y[_abstention].json file."""
+    suffix = '_abstention' if include_abstention else ''
+    Path('data').mkdir(exist_ok=True)
+    output_file = f"data/transfer_geo_{data['from_election']}_to_{data['to_election']}{suffix}.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    logger.info(f"Saved {output_file} ({Path(output_file).stat().st_size / 1024:.0f} KB)")
+
+
+def run_geo_analysis(only_transitions=None, abstention_modes=(False, True), bandwidth=DEFAULT_BANDWIDTH_KM,
+                     shrinkage=SHRINKAGE_PRECINCTS, jobs=1):
+    """Compute and save geographically weighted matrices for all (or selected) transitions."""
+    coordinates = load_station_coordinates()
+    if not coordinates:
+        return
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        for from_id, to_id in select_pairs(only_transitions):
+            missing = [ELECTIONS[e]['file'] for e in (from_id, to_id) if not Path(ELECTIONS[e]['file']).exists()]
+            if missing:
+                logger.warning(f"Skipping {from_id} → {to_id}: missing {', '.join(missing)}")
+                continue
+            for include_abstention in abstention_modes:
+                label = ' (with abstention)' if include_abstention else ''
+                logger.info(f"Geographic transfers {from_id} → {to_id}{label}")
+                start = time.perf_counter()
+                data = compute_geo_transfers(
+                    from_id, to_id, include_abstention=include_abstention, bandwidth=bandwidth,
+                    shrinkage=shrinkage, coordinates=coordinates, executor=executor, jobs=jobs
+                )
+                if data is not None:
+                    save_geo_transfers(data, include_abstention=include_abstention)
+                logger.info(f"{from_id} → {to_id}{label}: {time.perf_counter() - start:.2f}s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main():
+    """Generate geographically weighted transfer matrices for all consecutive election pairs."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate geographically weighted vote transfer matrices')
+    parser.add_argument('--transitions', nargs='+',
+                        help='Only compute specific transitions, e.g. --transitions 24_to_25')
+    parser.add_argument('--bandwidth', type=float, default=DEFAULT_BANDWIDTH_KM,
+                        help=f'Kernel bandwidth in km (default: {DEFAULT_BANDWIDTH_KM})')
+    parser.add_argument('--shrinkage', type=float, default=SHRINKAGE_PRECINCTS,
+                        help=f'Weight of the national prior in precincts (default: {SHRINKAGE_PRECINCTS})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for the batched anchor solve (default: 1)')
+    args = parser.parse_args()
+
+    run_geo_analysis(only_transitions=args.transitions, bandwidth=args.bandwidth,
+                     shrinkage=args.shrinkage, jobs=args.jobs)
+
+    logger.info("\nDone!")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ from collections import defaultdict
 from scipy import stats
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
+from election_store import load_raw_frame, party_columns
 from party_config import ELECTIONS, get_party_info, get_party_name
 
 # URLs for official election results
@@ -42,23 +43,21 @@ MIN_IRREGULARITY_SCORE = 8
 
 
 def load_ballot_data(election_id):
-    """Load ballot data for an election."""
-    election = ELECTIONS[election_id]
-    encoding = election.get('encoding', 'utf-8-sig')
-    df = pd.read_csv(election['file'], encoding=encoding)
-    # Fill NaN with 0 for numeric columns
+    """
+    Load ballot data for an election.
+
+    Every raw row is scored, including city 9999 and duplicate ballot IDs,
+    which the normalized election store frames drop (see load_raw_frame).
+    """
+    df = load_raw_frame(election_id)
+    # Fill NaN with 0 for numeric columns (a copy: the store's frame is shared)
     numeric_cols = df.select_dtypes(include=[np.number]).columns
-    df[numeric_cols] = df[numeric_cols].fillna(0)
-    return df
+    return df.fillna({col: 0 for col in numeric_cols})
 
 
 def get_party_columns(df, election_id):
-    """Get all party symbol columns (everything after the standard columns)."""
-    standard_cols = ['סמל ועדה', 'ברזל', 'שם ישוב', 'סמל ישוב', 'קלפי', 'ריכוז', 'שופט', 'בזב', 'מצביעים', 'פסולים', 'כשרים']
-    # Also handle alternate column names
-    alt_cols = ['סמל_ועדה', 'מספר קלפי']
-    exclude = set(standard_cols + alt_cols)
-    return [col for col in df.columns if col not in exclude and df[col].dtype in ['int64', 'float64', 'int32', 'float32']]
+    """Get all party symbol columns (everything after כשרים)."""
+    return party_columns(df)
 
 
 def safe_int(val):
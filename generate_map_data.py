@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """
 Generate map data files from T-SNE JSON files.
-Aggregates ballot data by settlement, merges with coordinates and socioeconomic clusters.
+Aggregates ballot data by settlement (CBS code from settlement_registry), with the
+registry's coordinates, socioeconomic clusters, English names and wiki keys (the
+site looks those up by the entry rather than by its canonical name).
 Output: site/data/map_*.json (one per election)
 """
 
@@ -9,137 +11,23 @@ import json
 import os
 from collections import defaultdict
 
+from election_store import election_symbols
+from settlement_registry import load_settlement_registry
+
 # Paths
 DATA_DIR = 'data'
 SITE_DATA_DIR = 'site/data'
-COORDINATES_FILE = os.path.join(SITE_DATA_DIR, 'station_coordinates.json')
-SOCIOECONOMIC_FILE = os.path.join(SITE_DATA_DIR, 'socioeconomic_clusters.json')
 
 ELECTIONS = ['16', '17', '18', '19', '20', '21', '22', '23', '24', '25', '26']
 
-# CSV files and encodings per election (for counting total lists)
-ELECTION_CSV = {
-    '16': ('ballot16.csv', 'utf-8-sig'),
-    '17': ('ballot17.csv', 'utf-8-sig'),
-    '18': ('ballot18.csv', 'utf-8-sig'),
-    '19': ('ballot19.csv', 'utf-8-sig'),
-    '20': ('ballot20.csv', 'utf-8-sig'),
-    '21': ('ballot21.csv', 'iso8859_8'),
-    '22': ('ballot22.csv', 'iso8859_8'),
-    '23': ('ballot23.csv', 'iso8859_8'),
-    '24': ('ballot24.csv', 'iso8859_8'),
-    '25': ('ballot25.csv', 'utf-8-sig'),
-    '26': ('ballot26.csv', 'utf-8-sig'),
-}
-
-
-# Post-normalization name corrections (CEC misspellings → canonical names)
-NAME_OVERRIDES = {
-    'גולס': "ג'וליס",
-    'גוליס': "ג'וליס",
-}
-
-
-def normalize_name(name):
-    """Normalize settlement name for matching.
-
-    The CEC changed formatting between elections 22→23, stripping hyphens,
-    geresh/gershayim, and parentheses. This ensures consistent names across all elections.
-    """
-    if not name:
-        return name
-    # Remove dashes
-    normalized = name.replace('-', ' ').replace('–', ' ')
-    # Remove geresh (ASCII apostrophe and Hebrew geresh)
-    normalized = normalized.replace("'", '').replace('\u05f3', '')
-    # Remove gershayim (ASCII double-quote and Hebrew gershayim)
-    normalized = normalized.replace('"', '').replace('\u05f4', '')
-    # Remove parentheses
-    normalized = normalized.replace('(', ' ').replace(')', ' ')
-    # Collapse multiple spaces
-    normalized = ' '.join(normalized.split())
-    # Normalize double-yod to single (קריית -> קרית)
-    normalized = normalized.replace('יי', 'י')
-    # Apply name overrides
-    normalized = NAME_OVERRIDES.get(normalized, normalized)
-    return normalized
-
-
 def count_lists(election_id):
-    """Count total party lists from CSV header."""
-    csv_info = ELECTION_CSV.get(election_id)
-    if not csv_info:
-        return 0
-    filepath, encoding = csv_info
-    if not os.path.exists(filepath):
-        return 0
-    with open(filepath, encoding=encoding) as f:
-        header = f.readline().strip().split(',')
+    """Count total party lists (ballot columns) from the election store."""
     try:
-        idx = header.index('\u05db\u05e9\u05e8\u05d9\u05dd')  # כשרים
-        return len(header) - idx - 1
-    except ValueError:
+        return len(election_symbols(election_id))
+    except (KeyError, FileNotFoundError):
         return 0
 
 
-def load_coordinates():
-    """Load settlement coordinates from station_coordinates.json.
-
-    The file has station-level data keyed by 'settlement|ballot'.
-    We extract unique settlement coordinates (using first station per settlement).
-    """
-    if not os.path.exists(COORDINATES_FILE):
-        print(f"Warning: Coordinates file not found: {COORDINATES_FILE}")
-        return {}, []
-
-    with open(COORDINATES_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    stations = data.get('stations', {})
-
-    # Extract unique settlement coordinates from station-level data
-    lookup = {}
-    not_found = []
-    for key, station in stations.items():
-        settlement = station.get('settlement', '')
-        lat = station.get('lat')
-        lng = station.get('lng')
-        source = station.get('source', '')
-
-        if not settlement or source == 'not_found' or lat is None or lng is None:
-            continue
-
-        if settlement not in lookup:
-            lookup[settlement] = {'lat': lat, 'lng': lng}
-            normalized = normalize_name(settlement)
-            if normalized != settlement:
-                lookup[normalized] = {'lat': lat, 'lng': lng}
-
-    return lookup, not_found
-
-
-def load_socioeconomic():
-    """Load socioeconomic cluster data."""
-    if not os.path.exists(SOCIOECONOMIC_FILE):
-        print(f"Warning: Socioeconomic file not found: {SOCIOECONOMIC_FILE}")
-        return {}
-
-    with open(SOCIOECONOMIC_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # Build lookup with both original and normalized names
-    lookup = {}
-    for item in data:
-        name = item['name']
-        cluster = item['cluster']
-        lookup[name] = cluster
-        normalized = normalize_name(name)
-        if normalized != name:
-            lookup[normalized] = cluster
-
-    return lookup
-
-
 def load_tsne_data(election_id):
     """Load T-SNE data for an election."""
     tsne_file = os.path.join(SITE_DATA_DIR, f'tsne_{election_id}.json')
@@ -151,8 +39,8 @@ def load_tsne_data(election_id):
         return json.load(f)
 
 
-def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
-    """Aggregate ballot data by settlement."""
+def aggregate_by_settlement(tsne_data, registry, election_id=None):
+    """Aggregate ballot data by settlement code."""
     settlements = defaultdict(lambda: {
         'voters': 0,
         'eligible': 0,
@@ -161,11 +49,19 @@ def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
         'ballots': []  # Store individual ballot data for expansion
     })
 
+    # Station names repeat across a settlement's ballots; resolve each name once
+    codes = {}
+    unknown = set()
     for station in tsne_data.get('stations', []):
         name = station.get('n') or station.get('settlement_name')
         if not name:
             continue
-        name = normalize_name(name)
+        if name not in codes:
+            codes[name] = registry.lookup(name, election_id)
+        code = codes[name]
+        if code is None:
+            unknown.add(name)
+            continue
 
         ballot_num = station.get('b') or station.get('ballot_number')
         voters = station.get('v') or station.get('total_voters', 0)
@@ -174,16 +70,16 @@ def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
         turnout = station.get('t') or station.get('turnout', 0)
         location = station.get('l') or ''
 
-        settlements[name]['voters'] += voters
-        settlements[name]['eligible'] += eligible
-        settlements[name]['ballotCount'] += 1
+        settlements[code]['voters'] += voters
+        settlements[code]['eligible'] += eligible
+        settlements[code]['ballotCount'] += 1
 
         # Accumulate party votes weighted by voter count
         for party, pct in proportions.items():
-            settlements[name]['partyVotes'][party] += pct * voters
+            settlements[code]['partyVotes'][party] += pct * voters
 
         # Store individual ballot for expansion view
-        settlements[name]['ballots'].append({
+        settlements[code]['ballots'].append({
             'b': ballot_num,
             'v': voters,
             'e': eligible,
@@ -192,13 +88,16 @@ def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
             'p': proportions
         })
 
+    if unknown:
+        print(f"  Warning: {len(unknown)} settlement names not in the registry: {', '.join(sorted(unknown))}")
+
     # Convert to final format
     result = []
     missing_coords = []
 
-    for name, data in settlements.items():
-        # Get coordinates
-        coords = coordinates.get(name) or coordinates.get(normalize_name(name))
+    for code, data in settlements.items():
+        name = registry.names[code]
+        coords = registry.coordinates.get(code)
 
         if not coords:
             missing_coords.append(name)
@@ -215,12 +114,13 @@ def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
         winning_party = max(proportions, key=proportions.get) if proportions else None
 
         # Get socioeconomic cluster
-        cluster = socioeconomic.get(name) or socioeconomic.get(normalize_name(name))
+        cluster = registry.cluster.get(code)
 
         # Calculate overall turnout
         turnout = round(100 * data['voters'] / data['eligible'], 1) if data['eligible'] > 0 else 0
 
         settlement_data = {
+            'id': code,
             'name': name,
             'lat': coords.get('lat'),
             'lng': coords.get('lng'),
@@ -234,6 +134,10 @@ def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
 
         if cluster:
             settlement_data['cluster'] = cluster
+        if code in registry.name_en:
+            settlement_data['name_en'] = registry.name_en[code]
+        if code in registry.wiki:
+            settlement_data['wiki'] = registry.wiki[code]
 
         # Include individual ballots for click-to-expand
         settlement_data['ballots'] = data['ballots']
@@ -245,15 +149,10 @@ def aggregate_by_settlement(tsne_data, coordinates, socioeconomic):
 
 def generate_map_data():
     """Generate map data files for all elections."""
-    print("Loading coordinates...")
-    coordinates, coord_unmatched = load_coordinates()
-    print(f"  Loaded {len(coordinates)} settlement coordinates")
-    if coord_unmatched:
-        print(f"  {len(coord_unmatched)} settlements without coordinates")
-
-    print("Loading socioeconomic data...")
-    socioeconomic = load_socioeconomic()
-    print(f"  Loaded {len(socioeconomic)} socioeconomic entries")
+    print("Loading settlement registry...")
+    registry = load_settlement_registry()
+    print(f"  {len(registry.coordinates)} settlements with coordinates, "
+          f"{len(registry.cluster)} with socioeconomic clusters")
 
     all_missing = set()
 
@@ -264,7 +163,7 @@ def generate_map_data():
         if not tsne_data:
             continue
 
-        settlements, missing = aggregate_by_settlement(tsne_data, coordinates, socioeconomic)
+        settlements, missing = aggregate_by_settlement(tsne_data, registry, election_id)
         all_missing.update(missing)
 
         # Build output structure
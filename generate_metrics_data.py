@@ -11,48 +11,28 @@ import numpy as np
 from collections import defaultdict
 from pathlib import Path
 
+from settlement_registry import load_settlement_registry
+
 
 def load_json(filepath):
     with open(filepath, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 
-# ── Settlement name normalization ──
-# The CEC changed settlement name formatting between elections 22→23,
-# removing some spaces. Map variant names to canonical (spaced) form.
-SETTLEMENT_NAME_OVERRIDES = {
-    'אום אלפחם': 'אום אל פחם',
-    'באקה אלגרביה': 'באקה אל גרביה',
-    'בועינהנוגידאת': 'בועינה נוגידאת',
-    'ביר אלמכסור': 'ביר אל מכסור',
-    'בנימינהגבעת עדה': 'בנימינה גבעת עדה',
-    'גדידהמכר': 'גדידה מכר',
-    'גסר אזרקא': 'גסר א זרקא',
-    'דאלית אלכרמל': 'דאלית אל כרמל',
-    'דיר אלאסד': 'דיר אל אסד',
-    'חפציבה': 'חפצי בה',
-    'טובאזנגריה': 'טובא זנגריה',
-    'יאנוחגת': 'יאנוח גת',
-    'יהודמונוסון': 'יהוד מונוסון',
-    'כאוכב אבו אלהיגא': 'כאוכב אבו אל היגא',
-    'כסראסמיע': 'כסרא סמיע',
-    'כעביהטבאשחגאגרה': 'כעביה טבאש חגאגרה',
-    'מגד אלכרום': 'מגד אל כרום',
-    'מודיעיןמכביםרעות': 'מודיעין מכבים רעות',
-    'מסעודין אלעזאזמה': 'מסעודין אל עזאזמה',
-    'מעלותתרשיחא': 'מעלות תרשיחא',
-    'ערערהבנגב': 'ערערה בנגב',
-    'פרדס חנהכרכור': 'פרדס חנה כרכור',
-    'קדימהצורן': 'קדימה צורן',
-    'רםאון': 'רם און',
-    'שגבשלום': 'שגב שלום',
-    'שריגים ליאון': 'שריגים לי און',
-}
+# ── Settlement identity ──
+# Map files carry the CBS settlement code ('id'); older files are resolved
+# by name through the settlement registry's variant table.
+def settlement_key(settlement, registry):
+    """CBS code of a map settlement entry (its name if the registry does not know it)."""
+    code = settlement.get('id')
+    if code is None:
+        code = registry.lookup(settlement['name'])
+    return settlement['name'] if code is None else code
 
 
-def normalize_settlement(name):
-    """Normalize settlement name to canonical form."""
-    return SETTLEMENT_NAME_OVERRIDES.get(name, name)
+def settlement_name(key, registry):
+    """Canonical name of a settlement key from settlement_key."""
+    return registry.names.get(key, key)
 
 
 # ── Party family merge groups for Pedersen index ──
@@ -142,7 +122,7 @@ PARTY_FAMILIES = {
 }
 
 
-def compute_hhi_for_election(all_maps, eid):
+def compute_hhi_for_election(all_maps, eid, registry):
     """Compute HHI, effective settlements, and concentration for one election.
 
     Returns dict: party_name → {hhi, effective_settlements, s50, s90}
@@ -150,12 +130,12 @@ def compute_hhi_for_election(all_maps, eid):
     settlements_data = {}
     voter_counts = {}
     for s in all_maps[eid]['settlements']:
-        name = normalize_settlement(s['name'])
+        name = settlement_key(s, registry)
         # If duplicate (shouldn't happen within single election), keep last
         settlements_data[name] = s.get('proportions', {})
         voter_counts[name] = s.get('voters', 0)
 
-    settlement_names = sorted(settlements_data.keys())
+    settlement_names = sorted(settlements_data.keys(), key=str)
     party_names = [p['name'] for p in all_maps[eid]['parties']]
 
     result = {}
@@ -201,6 +181,8 @@ def compute_hhi_for_election(all_maps, eid):
 
 
 def main():
+    registry = load_settlement_registry()
+
     # Load all map data
     all_maps = {}
     for eid in [21, 22, 23, 24, 25]:
@@ -213,7 +195,7 @@ def main():
     settlement_voters = {}
     for eid in [21, 22, 23, 24, 25]:
         for s in all_maps[eid]['settlements']:
-            name = normalize_settlement(s['name'])
+            name = settlement_key(s, registry)
             if name not in settlement_props:
                 settlement_props[name] = {}
                 settlement_voters[name] = {}
@@ -238,7 +220,7 @@ def main():
         # Only include settlements with all 4 transitions
         if len(per_transition) == 4:
             avg = round(np.mean(list(per_transition.values())), 1)
-            settlement_pedersen[name] = {
+            settlement_pedersen[settlement_name(name, registry)] = {
                 'transitions': per_transition,
                 'average': avg,
                 'voters': latest_voters,
@@ -261,7 +243,7 @@ def main():
     # Compute HHI per election
     hhi_per_election = {}
     for eid in [21, 22, 23, 24, 25]:
-        hhi_per_election[eid] = compute_hhi_for_election(all_maps, eid)
+        hhi_per_election[eid] = compute_hhi_for_election(all_maps, eid, registry)
 
     # Average HHI across elections per party family
     party_hhi = {}
@@ -415,7 +397,7 @@ def main():
             sett_data = {}
             voter_data = {}
             for s in all_maps[latest_eid]['settlements']:
-                sn = normalize_settlement(s['name'])
+                sn = settlement_name(settlement_key(s, registry), registry)
                 sett_data[sn] = s.get('proportions', {})
                 voter_data[sn] = s.get('voters', 0)
             snames = sorted(sett_data.keys())
@@ -470,11 +452,11 @@ def main():
     print(f"  National median Pedersen: {national_median}%")
     print(f"  National mean Pedersen: {national_mean}%")
 
-    # Show some before/after comparisons
-    print(f"\nSettlement name dedup: {len(SETTLEMENT_NAME_OVERRIDES)} variants normalized")
+    # Show some settlements whose names changed between elections
+    print(f"\nSettlements joined by CBS code ({len(registry.by_variant)} known name variants)")
     sample_names = ['אום אל פחם', 'ירושלים', 'תל אביב יפו']
     for name in sample_names:
-        p = settlement_pedersen.get(name)
+        p = settlement_pedersen.get(settlement_name(registry.lookup(name), registry))
         if p:
             print(f"  {name}: avg={p['average']}%, transitions={p['transitions']}")
 
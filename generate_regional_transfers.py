@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Generate regional vote transfer matrices.
+
+Splits the matched precincts of each transition by regional committee
+(סמל ועדה), by large settlement and by CBS socioeconomic cluster, and
+estimates one transfer matrix per group. Small groups are shrunk toward the
+national matrix by adding SHRINKAGE_PRECINCTS pseudo-precincts that follow
+the national matrix exactly:
+
+    min ||X_g M - Y_g||² + tau · tr((M - M_nat)ᵀ Ḡ (M - M_nat))
+
+where Ḡ = XᵀX / n is the national per-precinct Gram matrix. In Gram form
+this is the regular problem with G_g + tau·Ḡ and C_g + tau·Ḡ·M_nat, so all
+groups of a transition are solved together as one batched projected
+gradient problem (chunks run in a worker pool with --jobs).
+
+Exports data/transfer_regional_X_to_Y[_abstention].json.
+"""
+
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ballot_matching import station_ballots
+from election_store import build_match_index, load_election_frame
+from generate_transfer_data import VoteTransferAnalyzer, select_pairs
+from party_config import ELECTIONS
+from settlement_registry import load_settlement_registry
+from transfer_solvers import fista, precinct_outer_products, project_rows_to_simplex
+
+logger = logging.getLogger(__name__)
+
+# Weight of the national prior, in precincts
+SHRINKAGE_PRECINCTS = 25
+
+# Minimum matched precincts for a settlement to get its own matrix
+MIN_SETTLEMENT_PRECINCTS = 30
+
+# Stopping tolerance of the batched group solve
+GROUP_TOL = 1e-8
+
+# Per-station CBS socioeconomic clusters (settlement clusters come from settlement_registry)
+STATION_SOCIOECONOMIC_FILE = Path('site/data/station_socioeconomic.json')
+
+
+def load_socioeconomic_clusters():
+    """
+    Load station- and settlement-level socioeconomic clusters.
+
+    Returns:
+        (stations, settlements) dicts mapping "name|ballot" and settlement
+        code to a CBS cluster (1-10); stations is empty if its file is missing
+    """
+    stations = {}
+    if STATION_SOCIOECONOMIC_FILE.exists():
+        with open(STATION_SOCIOECONOMIC_FILE, 'r', encoding='utf-8') as f:
+            stations = {key: entry['cluster'] for key, entry in json.load(f).items()
+                        if entry.get('cluster')}
+    else:
+        logger.warning(f"{STATION_SOCIOECONOMIC_FILE} not found, using settlement clusters only")
+    return stations, load_settlement_registry().cluster
+
+
+def station_clusters(df, stations, settlements):
+    """
+    Socioeconomic cluster of every precinct of a normalized frame.
+
+    Station keys are "<settlement name>|<ballot number>" with whole ballot
+    numbers written as "14.0"; precincts without a station entry fall back
+    to their settlement code's cluster.
+
+    Returns:
+        float array of clusters (NaN where unknown)
+    """
+    names = df['שם ישוב'].astype(str).str.strip().to_numpy(dtype=str)
+    keys = np.char.add(np.char.add(names, '|'), station_ballots(df))
+    codes = pd.to_numeric(df['סמל ישוב'], errors='coerce').tolist()
+    return np.array([stations.get(key, settlements.get(code, np.nan))
+                     for key, code in zip(keys.tolist(), codes)], dtype=float)
+
+
+def precinct_groups(election_from, election_to, n_matched, socioeconomic):
+    """
+    Group labels of the matched precincts of a transition.
+
+    Labels come from the later election's precinct (the earlier one for
+    clusters it lacks). Committees are only available from K22 on.
+
+    Returns:
+        dict of grouping name -> (codes, labels) where codes assigns every
+        matched precinct a group index (-1 = not grouped) and labels holds
+        one dict of metadata per group
+    """
+    matches = build_match_index(election_from, election_to)
+    if len(matches) != n_matched:
+        raise ValueError(f"Match index has {len(matches)} precincts, statistics have {n_matched}")
+
+    df_from, _ = load_election_frame(election_from)
+    df_to, _ = load_election_frame(election_to)
+    rows_to = df_to.iloc[matches['to_pos'].to_numpy()]
+    rows_from = df_from.iloc[matches['from_pos'].to_numpy()]
+
+    groups = {}
+
+    if 'סמל ועדה' in rows_to.columns:
+        committee = pd.to_numeric(rows_to['סמל ועדה'], errors='coerce').to_numpy()
+        codes, uniques = pd.factorize(committee, use_na_sentinel=True)
+        groups['committee'] = (codes, [{'id': str(int(c))} for c in uniques])
+    else:
+        logger.info(f"No סמל ועדה column in {ELECTIONS[election_to]['file']}, skipping committees")
+
+    settlement = rows_to['סמל ישוב'].to_numpy()
+    codes, uniques = pd.factorize(settlement)
+    counts = np.bincount(codes, minlength=len(uniques))
+    large = counts >= MIN_SETTLEMENT_PRECINCTS
+    remap = np.where(large, np.cumsum(large) - 1, -1)
+    names = rows_to['שם ישוב'].astype(str).str.strip().to_numpy()
+    first = pd.Series(np.arange(len(codes))).groupby(codes).first().to_numpy()
+    registry_names = load_settlement_registry().names
+    groups['settlement'] = (remap[codes], [{'id': str(int(uniques[g])),
+                                            'name': registry_names.get(int(uniques[g]), names[first[g]])}
+                                           for g in np.flatnonzero(large)])
+
+    stations, settlements = socioeconomic
+    cluster = station_clusters(rows_to, stations, settlements)
+    missing = np.isnan(cluster)
+    cluster[missing] = station_clusters(rows_from, stations, settlements)[missing]
+    codes, uniques = pd.factorize(cluster, sort=True, use_na_sentinel=True)
+    groups['cluster'] = (codes, [{'id': str(int(c))} for c in uniques])
+    logger.info(f"Socioeconomic cluster known for {(codes >= 0).mean():.1%} of matched precincts")
+
+    return groups
+
+
+def group_gram_matrices(X, XX, XY, codes, n_groups, k_to):
+    """
+    Sum per-precinct outer products into per-group X^T X and X^T Y.
+
+    Returns:
+        (G, C, counts, x_sums) with one entry per group
+    """
+    k_from = X.shape[1]
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[np.argsort(codes[rows], kind='stable')]
+    starts = np.searchsorted(codes[rows], np.arange(n_groups))
+    G = np.add.reduceat(XX[rows], starts, axis=0).reshape(n_groups, k_from, k_from)
+    C = np.add.reduceat(XY[rows], starts, axis=0).reshape(n_groups, k_from, k_to)
+    x_sums = np.add.reduceat(X[rows], starts, axis=0)
+    return G, C, np.bincount(codes[rows], minlength=n_groups), x_sums
+
+
+def solve_group_chunk(G, C, M0):
+    """Solve a batch of regional problems (module-level for the worker pool)."""
+    M, _ = fista(G, C, project_rows_to_simplex, M0=M0, tol=GROUP_TOL)
+    return M
+
+
+def solve_groups(G, C, M0, executor=None, jobs=1):
+    """Solve a batch of problems, split into chunks across a worker pool."""
+    if executor is None or jobs <= 1 or len(G) < 2 * jobs:
+        return solve_group_chunk(G, C, M0)
+    chunks = np.array_split(np.arange(len(G)), jobs)
+    futures = [executor.submit(solve_group_chunk, G[idx], C[idx], M0[idx]) for idx in chunks]
+    return np.concatenate([future.result() for future in futures])
+
+
+def _percent_matrix(M):
+    """Matrix as nested lists of percentages with one decimal."""
+    return np.round(M * 100, 1).tolist()
+
+
+def compute_regional_transfers(election_from, election_to, include_abstention=False,
+                               shrinkage=SHRINKAGE_PRECINCTS, socioeconomic=None,
+                               executor=None, jobs=1):
+    """
+    Compute regional transfer matrices for one transition.
+
+    Args:
+        election_from: Earlier election ID
+        election_to: Later election ID
+        include_abstention: Whether to include the "did not vote" pseudo-party
+        shrinkage: Weight of the national prior, in precincts
+        socioeconomic: Result of load_socioeconomic_clusters()
+        executor: Optional process pool for the batched group solve
+        jobs: Number of chunks to split the group batch into
+
+    Returns:
+        dict suitable for JSON export
+    """
+    analyzer = VoteTransferAnalyzer(method='projected_gradient', include_abstention=include_abstention)
+    stats = analyzer.select_transition_stats(
+        analyzer.load_transition_stats(election_from, election_to)
+    )
+    X, Y = stats['x'], stats['y']
+    n, k_from = X.shape
+    k_to = Y.shape[1]
+
+    M_nat = analyzer.solve_transfer_matrix_from_stats(stats['xtx'], stats['xty'], stats['yty'])
+    G_bar = stats['xtx'] / n
+    prior_C = G_bar @ M_nat
+
+    if socioeconomic is None:
+        socioeconomic = load_socioeconomic_clusters()
+    groups = precinct_groups(election_from, election_to, n, socioeconomic)
+
+    # Per-group Gram matrices from per-precinct outer products, then one batch
+    XX, XY = precinct_outer_products(X, Y)
+    batches = []
+    for name, (codes, labels) in groups.items():
+        G, C, counts, x_sums = group_gram_matrices(X, XX, XY, codes, len(labels), k_to)
+        batches.append((name, labels, counts, x_sums, G, C))
+
+    G_all = np.concatenate([batch[4] for batch in batches]) + shrinkage * G_bar
+    C_all = np.concatenate([batch[5] for batch in batches]) + shrinkage * prior_C
+    M0 = np.broadcast_to(M_nat, C_all.shape).copy()
+
+    start = time.perf_counter()
+    M_all = solve_groups(G_all, C_all, M0, executor=executor, jobs=jobs)
+    logger.info(f"Solved {len(M_all)} regional matrices in {time.perf_counter() - start:.2f}s")
+
+    groupings = {}
+    offset = 0
+    for name, labels, counts, x_sums, _, _ in batches:
+        groupings[name] = [{
+            **label,
+            'precincts': int(counts[g]),
+            'votes_from': int(x_sums[g].sum()),
+            'prior_weight': round(shrinkage / (counts[g] + shrinkage), 3),
+            'matrix': _percent_matrix(M_all[offset + g]),
+        } for g, label in enumerate(labels)]
+        offset += len(labels)
+
+    symbols_from = stats['symbols_from']
+    symbols_to = stats['symbols_to']
+    return {
+        'from_election': election_from,
+        'to_election': election_to,
+        'symbols_from': symbols_from,
+        'symbols_to': symbols_to,
+        'shrinkage_precincts': shrinkage,
+        'common_precincts': n,
+        'national': _percent_matrix(M_nat),
+        'groupings': groupings,
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def save_regional_transfers(data, include_abstention=False):
+    """Write one compact transfer_regional_X_to_Y[_abstention].json file."""
+    suffix = '_abstention' if include_abstention else ''
+    Path('data').mkdir(exist_ok=True)
+    output_file = f"data/transfer_regional_{data['from_election']}_to_{data['to_election']}{suffix}.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    logger.info(f"Saved {output_file} ({Path(output_file).stat().st_size / 1024:.0f} KB)")
+
+
+def run_regional_analysis(only_transitions=None, abstention_modes=(False, True),
+                          shrinkage=SHRINKAGE_PRECINCTS, jobs=1):
+    """Compute and save regional matrices for all (or selected) transitions."""
+    pairs = select_pairs(only_transitions)
+    socioeconomic = load_socioeconomic_clusters()
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        for from_id, to_id in pairs:
+            missing = [ELECTIONS[e]['file'] for e in (from_id, to_id) if not Path(ELECTIONS[e]['file']).exists()]
+            if missing:
+                logger.warning(f"Skipping {from_id} → {to_id}: missing {', '.join(missing)}")
+                continue
+            for include_abstention in abstention_modes:
+                label = ' (with abstention)' if include_abstention else ''
+                logger.info(f"\n{'='*60}")
+                logger.info(f"Regional transfers {from_id} → {to_id}{label}")
+                logger.info('='*60)
+                start = time.perf_counter()
+                data = compute_regional_transfers(
+                    from_id, to_id, include_abstention=include_abstention, shrinkage=shrinkage,
+                    socioeconomic=socioeconomic, executor=executor, jobs=jobs
+                )
+                save_regional_transfers(data, include_abstention=include_abstention)
+                logger.info(f"{from_id} → {to_id}{label}: {time.perf_counter() - start:.2f}s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main():
+    """Generate regional transfer matrices for all consecutive election pairs."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate regional vote transfer matrices')
+    parser.add_argument('--transitions', nargs='+',
+                        help='Only compute specific transitions, e.g. --transitions 24_to_25')
+    parser.add_argument('--shrinkage', type=float, default=SHRINKAGE_PRECINCTS,
+                        help=f'Weight of the national prior in precincts (default: {SHRINKAGE_PRECINCTS})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for the batched group solve (default: 1)')
+    args = parser.parse_args()
+
+    run_regional_analysis(only_transitions=args.transitions, shrinkage=args.shrinkage, jobs=args.jobs)
+
+    logger.info("\nDone!")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,17 +7,27 @@ and exports data as JSON for web visualization.
 Written by Harel Cain, 2019-2024
 """
 
+import hashlib
 import json
 import logging
+import os
+import tempfile
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import cvxpy as cvx
 import numpy as np
 import pandas as pd
-from scipy.optimize import nnls
-
-from party_config import ELECTIONS, get_party_info, get_party_color
+from ballot_venues import STATION_COORDINATES_FILE, ballot_locations_file, build_venue_units
+from election_store import build_match_index, load_election_frame, log_cache_stats, party_columns
+from party_config import ELECTIONS, get_party_info, get_party_color, get_party_name
+from settlement_registry import load_settlement_registry, normalize_name, registry_inputs
+from transfer_solvers import (BOOTSTRAP_TOL, bootstrap_counts, bootstrap_simplex_lstsq, gram_factor, gram_matrices, irls_simplex_lstsq,
+                              poisson_simplex_em, solve_joint_simplex_lstsq, solve_nnls, solve_simplex_lstsq,
+                              weighted_gram_matrices)
+from transfer_bounds import bound_totals, group_sum, rate_bounds
+from transfer_residuals import save_residuals, settlement_index
 
 # Configure logging
 logging.basicConfig(
@@ -28,68 +38,166 @@ logger = logging.getLogger(__name__)
 
 pd.options.mode.chained_assignment = None
 
+# On-disk cache of per-transition sufficient statistics
+STATS_CACHE_DIR = Path('data/cache')
+
+# Bump when the content or layout of cached statistics changes
+STATS_CACHE_VERSION = 6
+
+# Per-precinct and lookup entries of the statistics that are passed through
+# unchanged by select_transition_stats and pool_transition_stats
+PRECINCT_KEYS = ('eligible', 'eligible_to', 'valid_from', 'valid_to', 'ballot_id', 'from_ballot_id',
+                 'settlement_codes', 'settlement_names')
+
+# Transfer matrix solvers supported by VoteTransferAnalyzer ('poisson' is a
+# count likelihood and needs the per-precinct votes, not just XᵀX/XᵀY)
+METHODS = ('convex', 'projected_gradient', 'nnls', 'nnls_row_sum', 'closed_form', 'poisson')
+
+# Precinct weightings of the least-squares fit: equal, proportional to
+# eligible voters, or inverse expected variance (count variance grows with
+# precinct size)
+WEIGHTINGS = ('none', 'eligible', 'inverse_variance')
+
+# Pseudo-parties added to the party columns
+ABSTENTION_SYMBOL = 'abstain'
+OTHER_SYMBOL = 'other'
+ABSTENTION_INFO = {
+    'name': 'לא הצביעו',
+    'name_en': 'Did not vote',
+    'color': '#9ca3af'
+}
+OTHER_INFO = {
+    'name': 'אחרים',
+    'name_en': 'Other lists',
+    'color': '#6b7280'
+}
+
+# Bootstrap percentiles reported per transfer cell
+BOOTSTRAP_PERCENTILES = (5, 50, 95)
+
+# ELECTIONS fields that affect the statistics (names, seats and dates only
+# affect the JSON export, so changing them does not invalidate the cache)
+STATS_CONFIG_KEYS = ('file', 'encoding', 'ballot_field', 'ballot_number_divisor', 'eligible_voters')
+
+
+def _file_sha256(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transition_stats_key(election_from, election_to, all_lists=False, venues=False):
+    """
+    Cache key for a transition: input CSV hashes plus the relevant config.
+
+    The cached settlement_names are the registry's canonical names, so the
+    registry inputs are part of the key (adding K26 renames settlements).
+    """
+    parts = {'version': STATS_CACHE_VERSION, 'all_lists': all_lists, 'venues': venues,
+             'settlement_registry': registry_inputs()}
+    for election_id in (election_from, election_to):
+        config = ELECTIONS[election_id]
+        parts[election_id] = {
+            'sha256': _file_sha256(config['file']),
+            'config': {key: config.get(key) for key in STATS_CONFIG_KEYS},
+            'symbols': config['major_parties']['symbols'],
+        }
+        if venues:
+            locations = ballot_locations_file(election_id)
+            parts[election_id]['locations_sha256'] = _file_sha256(locations) if locations.exists() else None
+    if venues:
+        parts['stations_sha256'] = (_file_sha256(STATION_COORDINATES_FILE)
+                                    if STATION_COORDINATES_FILE.exists() else None)
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def pooling_matrix(symbols, totals, threshold):
+    """
+    Aggregation matrix that pools small lists into an "other" column.
+
+    Columns whose national total is below threshold are summed into one
+    OTHER_SYMBOL column placed before the abstention column (which is
+    never pooled). Since pooled votes are X A, the pooled statistics are
+    Aᵀ XᵀX A etc.
+
+    Returns:
+        (A, pooled_symbols); A is None when nothing is pooled
+    """
+    small = [i for i, s in enumerate(symbols) if s != ABSTENTION_SYMBOL and totals[i] < threshold]
+    if len(small) < 2:
+        return None, list(symbols)
+    kept = [i for i, s in enumerate(symbols) if i not in small and s != ABSTENTION_SYMBOL]
+    tail = [i for i, s in enumerate(symbols) if s == ABSTENTION_SYMBOL]
+    pooled_symbols = [symbols[i] for i in kept] + [OTHER_SYMBOL] + [symbols[i] for i in tail]
+    A = np.zeros((len(symbols), len(pooled_symbols)))
+    A[kept, np.arange(len(kept))] = 1
+    A[small, len(kept)] = 1
+    A[tail, len(kept) + 1 + np.arange(len(tail))] = 1
+    return A, pooled_symbols
+
+
+def transfer_r_squared(stats, M):
+    """
+    R² of a transfer matrix computed from the Gram matrices.
+
+    ||Y - XM||² = tr(YᵀY) - 2 tr(MᵀXᵀY) + tr(MᵀXᵀXM)
+    """
+    G, C, YtY = stats['xtx'], stats['xty'], stats['yty']
+    ss_res = np.trace(YtY) - 2 * np.sum(M * C) + np.sum(M * (G @ M))
+    ss_tot = np.trace(YtY) - (stats['y_sum'] ** 2).sum() / stats['n_matched']
+    return float(1 - ss_res / ss_tot)
+
 
 class VoteTransferAnalyzer:
     """Analyzes vote transfers between consecutive elections."""
 
-    def __init__(self, method='convex', min_flow_threshold=5000, verbose=False, include_abstention=False):
+    def __init__(self, method='convex', min_flow_threshold=5000, verbose=False, include_abstention=False,
+                 use_cache=True, bootstrap=0, bootstrap_seed=0, all_lists=False, other_threshold=0,
+                 weighting='none', robust=False, residuals=False, venues=False):
         """
         Initialize the analyzer.
 
         Args:
-            method: Optimization method ('convex', 'nnls', or 'closed_form')
+            method: Optimization method (one of METHODS)
             min_flow_threshold: Minimum vote flow to include in output
             verbose: Whether to print detailed output
             include_abstention: Whether to include "did not vote" pseudo-party
+            use_cache: Whether to read/write per-transition statistics and
+                normalized election frames in data/cache
+            bootstrap: Number of precinct bootstrap replicates for confidence
+                intervals (0 disables the bootstrap)
+            bootstrap_seed: Seed of the bootstrap resampling
+            all_lists: Model every party column instead of major_parties only
+            other_threshold: Pool lists with fewer national votes than this
+                into a single "other" pseudo-party (0 disables pooling)
+            weighting: Precinct weighting of the fit (one of WEIGHTINGS)
+            robust: Whether to downweight outlying precincts with Huber IRLS
+            residuals: Whether compute_transfer writes the per-precinct and
+                per-settlement residual files (see transfer_residuals)
+            venues: Fit polling venue units instead of matched ballot boxes
+                (see ballot_venues); every "precinct" is then a venue unit
         """
         self.method = method
         self.min_flow_threshold = min_flow_threshold
         self.verbose = verbose
         self.include_abstention = include_abstention
+        self.use_cache = use_cache
+        self.bootstrap = bootstrap
+        self.bootstrap_seed = bootstrap_seed
+        self.all_lists = all_lists
+        self.other_threshold = other_threshold
+        self.weighting = weighting
+        self.robust = robust
+        self.residuals = residuals
+        self.venues = venues
 
     def load_election_data(self, election_id):
-        """Load and prepare election data from CSV."""
-        config = ELECTIONS[election_id]
-
-        logger.info(f"Loading {config['name']} from {config['file']}")
-
-        df = pd.read_csv(
-            config['file'],
-            encoding=config['encoding']
-        )
-
-        logger.info(f"Loaded {len(df)} precincts")
-
-        # Create unique ballot ID
-        ballot_field = config.get('ballot_field', 'קלפי')
-        divisor = config.get('ballot_number_divisor', 1)
-        def normalize_ballot(b):
-            b = str(b)
-            if b.endswith('.0'):
-                b = b[:-2]
-            if divisor > 1:
-                try:
-                    n = int(b)
-                    if n % divisor == 0:
-                        b = str(n // divisor)
-                except ValueError:
-                    pass
-            return b
-        df['ballot_id'] = df['סמל ישוב'].astype(str) + '__' + df[ballot_field].apply(normalize_ballot)
-
-        # Filter out city 9999 (aggregated/invalid data)
-        df = df[df['סמל ישוב'] != 9999]
-        df = df.set_index('ballot_id')
-
-        # Remove duplicate ballot IDs (can happen with historical data from CKAN API)
-        dupes = df.index.duplicated(keep='first')
-        if dupes.any():
-            logger.warning(f"Removing {dupes.sum()} duplicate ballot IDs")
-            df = df[~dupes]
-
-        logger.info(f"{len(df)} precincts after filtering")
-
-        return df, config
+        """Load and prepare election data (ballot_id-indexed, via election_store)."""
+        return load_election_frame(election_id, use_disk=self.use_cache)
 
     def extract_party_votes(self, df, symbols, names):
         """Extract vote columns for specified parties."""
@@ -106,6 +214,52 @@ class VoteTransferAnalyzer:
 
         return party_df, existing_symbols, existing_names
 
+    def list_symbols(self, df, config):
+        """Modelled party symbols and names: major_parties, or every list with all_lists."""
+        parties = config['major_parties']
+        if not self.all_lists:
+            return parties['symbols'], parties['names']
+        symbols = party_columns(df)
+        return symbols, symbols
+
+    def list_names(self, symbols, election_id):
+        """Display names of modelled symbols, made unique for the Sankey nodes."""
+        parties = ELECTIONS[election_id]['major_parties']
+        names = []
+        for symbol in symbols:
+            if symbol == ABSTENTION_SYMBOL:
+                name = ABSTENTION_INFO['name']
+            elif symbol == OTHER_SYMBOL:
+                name = OTHER_INFO['name']
+            elif symbol in parties['symbols']:
+                name = parties['names'][parties['symbols'].index(symbol)]
+            else:
+                name = get_party_name(symbol, election_id)
+            names.append(f"{name} ({symbol})" if name in names else name)
+        return names
+
+    def build_nodes(self, symbols, names, totals, election_id):
+        """Sankey node entries (votes, seats, color and party info) for one side."""
+        parties = ELECTIONS[election_id]['major_parties']
+        seats = dict(zip(parties['symbols'], parties.get('seats', [])))
+        nodes = []
+        for symbol, name, votes in zip(symbols, names, totals):
+            if symbol == ABSTENTION_SYMBOL:
+                info = ABSTENTION_INFO
+            elif symbol == OTHER_SYMBOL:
+                info = OTHER_INFO
+            else:
+                info = get_party_info(symbol, election_id)
+            nodes.append({
+                'name': name,
+                'symbol': symbol,
+                'votes': int(votes),
+                'seats': seats.get(symbol),
+                'color': info['color'],
+                'info': info
+            })
+        return nodes
+
     def solve_transfer_matrix_convex(self, X, Y):
         """
         Solve for transfer matrix using convex optimization.
@@ -137,20 +291,54 @@ class VoteTransferAnalyzer:
 
         return M.value
 
+    def solve_transfer_matrix_projected_gradient(self, X, Y):
+        """
+        Solve the same problem as solve_transfer_matrix_convex without cvxpy.
+
+        Runs accelerated projected gradient (FISTA) on the k x k Gram
+        matrices X^T X and X^T Y with an exact projection of each row onto
+        the probability simplex, then polishes the result on its support.
+        Agrees with a high-accuracy interior-point solve (Clarabel at 1e-12
+        tolerances) to within 1e-9 per cell and satisfies the constraints
+        exactly, in milliseconds. The convex method (SCS on the reduced
+        gram_factor problem) agrees with it to within 1e-3 per cell on every
+        transition, with entries down to -4e-4 and row sums off by up to
+        1e-6.
+        """
+        return self._solve_projected_gradient(*gram_matrices(X, Y))
+
+    def _solve_projected_gradient(self, G, C):
+        """Projected gradient solve from the Gram matrices X^T X, X^T Y."""
+        M, info = solve_simplex_lstsq(G, C)
+        if self.verbose:
+            logger.info(f"Projected gradient: {info['iterations']} iterations, "
+                        f"polished={info['polished']}")
+        return M
+
     def solve_transfer_matrix_nnls(self, X, Y):
-        """Solve using non-negative least squares (per destination party)."""
-        M = np.zeros((X.shape[1], Y.shape[1]))
+        """Solve using non-negative least squares (all destination parties at once)."""
+        return self._solve_nnls(*gram_matrices(X, Y))
+
+    def _solve_nnls(self, G, C, **options):
+        """
+        NNLS from the Gram matrices X^T X, X^T Y (or batches of them).
 
-        for i in range(Y.shape[1]):
-            sol, _ = nnls(X, Y[:, i])
-            M[:, i] = sol
+        'nnls' normalizes the rows of the unconstrained-sum solution
+        afterwards; 'nnls_row_sum' instead enforces the row sums exactly,
+        starting from the normalized solution, so its objective is never
+        worse. options are passed on to solve_nnls.
+        """
+        row_sum = self.method == 'nnls_row_sum'
+        M, info = solve_nnls(G, C, row_sum=row_sum, **options)
+        if self.verbose:
+            logger.info(f"Batched NNLS: {info['iterations']} iterations, polished={info['polished']}")
+        if row_sum:
+            return M
 
         # Normalize rows to sum to 1
-        row_sums = M.sum(axis=1, keepdims=True)
+        row_sums = M.sum(axis=-1, keepdims=True)
         row_sums[row_sums == 0] = 1  # Avoid division by zero
-        M = M / row_sums
-
-        return M
+        return M / row_sums
 
     def solve_transfer_matrix_closed(self, X, Y):
         """Solve using closed-form least squares (may have negative values)."""
@@ -173,119 +361,459 @@ class VoteTransferAnalyzer:
         logger.warning("No eligible voter data available, abstention will be 0")
         return pd.Series(0, index=df.index)
 
-    def compute_transfer(self, election_from, election_to):
+    def compute_transition_stats(self, election_from, election_to):
         """
-        Compute vote transfer between two elections.
+        Compute sufficient statistics for a transition from the ballot CSVs.
+
+        All matrices include the "did not vote" pseudo-party as their last
+        row/column; the statistics without abstention are the leading
+        sub-blocks (see select_transition_stats).
 
         Returns:
-            dict with transfer data suitable for JSON export
+            dict of numpy arrays (per-precinct X and Y, X^T X, X^T Y, Y^T Y,
+            column sums, matched precinct count, national totals, eligible
+            voters and valid votes of both elections and ballot_ids of the
+            matched precincts, the later
+            election's settlement names and the party symbols used); with
+            venues, every precinct is a venue unit named "<settlement>__v<ballot>"
         """
         # Load data
         df_from, config_from = self.load_election_data(election_from)
         df_to, config_to = self.load_election_data(election_to)
 
-        # Get party configurations
-        parties_from = config_from['major_parties']
-        parties_to = config_to['major_parties']
-
-        # Extract party votes
+        # Extract party votes (major parties, or every list with all_lists)
         votes_from, symbols_from, names_from = self.extract_party_votes(
-            df_from, parties_from['symbols'], parties_from['names']
+            df_from, *self.list_symbols(df_from, config_from)
         )
         votes_to, symbols_to, names_to = self.extract_party_votes(
-            df_to, parties_to['symbols'], parties_to['names']
+            df_to, *self.list_symbols(df_to, config_to)
         )
+        votes_from = votes_from.fillna(0)
+        votes_to = votes_to.fillna(0)
+
+        # "Did not vote" pseudo-party column, always kept as the last column
+        dnv_from = self._compute_dnv(df_from, config_from)
+        dnv_to = self._compute_dnv(df_to, config_to)
+
+        X_all = np.hstack([votes_from.values.astype(float), dnv_from.values.astype(float).reshape(-1, 1)])
+        Y_all = np.hstack([votes_to.values.astype(float), dnv_to.values.astype(float).reshape(-1, 1)])
+        eligible_all = (df_from['מצביעים'].values + dnv_from.values).astype(float)
+        eligible_to_all = (df_to['מצביעים'].values + dnv_to.values).astype(float)
+        valid_from_all = df_from['כשרים'].fillna(0).to_numpy(dtype=float)
+        valid_to_all = df_to['כשרים'].fillna(0).to_numpy(dtype=float)
+
+        if self.venues:
+            # Sum both elections' boxes per venue unit (see ballot_venues)
+            units = build_venue_units(election_from, election_to, use_disk=self.use_cache)
+            n_units = len(units['unit_id'])
+            if not n_units:
+                raise ValueError("No matching venues found")
+            in_from = np.flatnonzero(units['from_unit'] >= 0)
+            in_to = np.flatnonzero(units['to_unit'] >= 0)
+            logger.info(f"Aggregated {len(in_from)} + {len(in_to)} boxes into {n_units} venue units")
+
+            X = group_sum(units['from_unit'][in_from], X_all[in_from], n_units)
+            Y = group_sum(units['to_unit'][in_to], Y_all[in_to], n_units)
+            eligible = np.bincount(units['from_unit'][in_from], weights=eligible_all[in_from], minlength=n_units)
+            eligible_to = np.bincount(units['to_unit'][in_to], weights=eligible_to_all[in_to], minlength=n_units)
+            valid_from = np.bincount(units['from_unit'][in_from], weights=valid_from_all[in_from], minlength=n_units)
+            valid_to = np.bincount(units['to_unit'][in_to], weights=valid_to_all[in_to], minlength=n_units)
+            to_ids = units['unit_id'].astype(bytes)
+            from_ids = units['from_unit_id'].astype(bytes)
+            to_pos = units['to_first']
+        else:
+            # Find common precincts with fallback matching (see ballot_matching)
+            matches = build_match_index(election_from, election_to, use_disk=self.use_cache)
+
+            logger.info(f"Found {len(matches)} matched precincts (with fallback)")
+
+            if matches.empty:
+                raise ValueError("No matching precincts found")
+
+            from_pos = matches['from_pos'].to_numpy()
+            to_pos = matches['to_pos'].to_numpy()
+            X = X_all[from_pos]
+            Y = Y_all[to_pos]
+            eligible = eligible_all[from_pos]
+            eligible_to = eligible_to_all[to_pos]
+            valid_from = valid_from_all[from_pos]
+            valid_to = valid_to_all[to_pos]
+            # ballot_id is "<settlement code>__<ballot number>" (ASCII, kept as bytes)
+            to_ids = matches['to_id'].to_numpy(dtype=bytes)
+            from_ids = matches['from_id'].to_numpy(dtype=bytes)
+
+        settlement_codes, first_rows = np.unique(np.char.partition(to_ids, b'__')[:, 0], return_index=True)
+        raw_names = df_to['שם ישוב'].to_numpy()[to_pos[first_rows]]
+        registry_names = load_settlement_registry().names
+
+        return {
+            'symbols_from': np.array(symbols_from),
+            'symbols_to': np.array(symbols_to),
+            'x': X,
+            'y': Y,
+            'xtx': X.T @ X,
+            'xty': X.T @ Y,
+            'yty': Y.T @ Y,
+            'x_sum': X.sum(axis=0),
+            'y_sum': Y.sum(axis=0),
+            'n_matched': np.array(len(X)),
+            # Use national totals (all precincts, not just matched)
+            'national_from': np.append(votes_from.sum().values, dnv_from.sum()).astype(float),
+            'national_to': np.append(votes_to.sum().values, dnv_to.sum()).astype(float),
+            'eligible': eligible,
+            'eligible_to': eligible_to,
+            'valid_from': valid_from,
+            'valid_to': valid_to,
+            'ballot_id': to_ids,
+            'from_ballot_id': from_ids,
+            'settlement_codes': settlement_codes,
+            # Registry names by CBS code, as in map_NN.json (residuals join on them)
+            'settlement_names': np.array([registry_names.get(code, normalize_name(str(name).strip()))
+                                          for code, name in zip(pd.to_numeric(settlement_codes.astype(str),
+                                                                              errors='coerce'), raw_names)]),
+        }
+
+    def load_transition_stats(self, election_from, election_to):
+        """
+        Load sufficient statistics for a transition, using the on-disk cache.
 
-        # Find common precincts with fallback matching
-        # Matching logic:
-        # - Exact match first (including .0 which normalizes to base)
-        # - Only .1 can fall back to base, and only if no .0 sibling exists in "to" data
-
-        def get_base_ballot_id(ballot_id):
-            parts = ballot_id.split('__')
-            if len(parts) == 2 and '.' in parts[1]:
-                return parts[0] + '__' + parts[1].split('.')[0]
-            return ballot_id
-
-        def is_dot_one(ballot_id):
-            parts = ballot_id.split('__')
-            return len(parts) == 2 and parts[1].endswith('.1')
-
-        # Track which base IDs have a .0 variant in "to" data
-        to_bases_with_zero = set()
-        for to_id in votes_to.index:
-            parts = to_id.split('__')
-            if len(parts) == 2 and parts[1].endswith('.0'):
-                # This is a .0 ballot, record its base
-                base = parts[0] + '__' + parts[1][:-2]
-                to_bases_with_zero.add(base)
-
-        # Build mapping: for each "to" ballot, find matching "from" ballot
-        from_ids = set(votes_from.index)
-        matched_pairs = []  # (from_id, to_id)
-
-        for to_id in votes_to.index:
-            if to_id in from_ids:
-                # Exact match
-                matched_pairs.append((to_id, to_id))
-            elif is_dot_one(to_id):
-                # Only .1 can fall back (not .2, .3, etc.)
-                base_id = get_base_ballot_id(to_id)
-                if base_id not in to_bases_with_zero and base_id in from_ids:
-                    matched_pairs.append((base_id, to_id))
-
-        logger.info(f"Found {len(matched_pairs)} matched precincts (with fallback)")
-
-        if not matched_pairs:
-            raise ValueError("No matching precincts found")
-
-        from_matched_ids = [p[0] for p in matched_pairs]
-        to_matched_ids = [p[1] for p in matched_pairs]
-        common_idx = None  # Not used anymore
-
-        X = votes_from.loc[from_matched_ids].values.astype(float)
-        Y = votes_to.loc[to_matched_ids].values.astype(float)
-
-        # Optionally add "did not vote" pseudo-party column
+        The cache entry is keyed by the hashes of both ballot CSVs and the
+        data-relevant fields of both ELECTIONS entries, so it is rebuilt
+        whenever the inputs change and reused otherwise.
+        """
+        key = transition_stats_key(election_from, election_to, all_lists=self.all_lists, venues=self.venues)
+        variant = ('_all_lists' if self.all_lists else '') + ('_venues' if self.venues else '')
+        cache_file = STATS_CACHE_DIR / f"transfer_stats_{election_from}_to_{election_to}{variant}.npz"
+
+        if self.use_cache and cache_file.exists():
+            with np.load(cache_file) as npz:
+                if str(npz['cache_key']) == key:
+                    logger.info(f"Using cached statistics from {cache_file}")
+                    return {name: npz[name] for name in npz.files if name != 'cache_key'}
+            logger.info(f"Stale statistics cache {cache_file}, recomputing")
+
+        stats = self.compute_transition_stats(election_from, election_to)
+
+        if self.use_cache:
+            STATS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # Write atomically: parallel jobs may build the same transition
+            fd, tmp_path = tempfile.mkstemp(dir=STATS_CACHE_DIR, suffix='.npz.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, cache_key=np.array(key), **stats)
+            os.replace(tmp_path, cache_file)
+            logger.info(f"Cached statistics to {cache_file}")
+
+        return stats
+
+    def select_transition_stats(self, stats):
+        """Slice cached statistics with or without the abstention column."""
+        symbols_from = list(stats['symbols_from'])
+        symbols_to = list(stats['symbols_to'])
+        k_from = len(symbols_from) + (1 if self.include_abstention else 0)
+        k_to = len(symbols_to) + (1 if self.include_abstention else 0)
         if self.include_abstention:
-            dnv_from = self._compute_dnv(df_from, config_from)
-            dnv_to = self._compute_dnv(df_to, config_to)
+            symbols_from.append(ABSTENTION_SYMBOL)
+            symbols_to.append(ABSTENTION_SYMBOL)
+        selected = {
+            'symbols_from': symbols_from,
+            'symbols_to': symbols_to,
+            'xtx': stats['xtx'][:k_from, :k_from],
+            'xty': stats['xty'][:k_from, :k_to],
+            'yty': stats['yty'][:k_to, :k_to],
+            'x_sum': stats['x_sum'][:k_from],
+            'y_sum': stats['y_sum'][:k_to],
+            'n_matched': int(stats['n_matched']),
+            'national_from': stats['national_from'][:k_from],
+            'national_to': stats['national_to'][:k_to],
+        }
+        # Per-precinct matrices are absent from incrementally built statistics
+        if 'x' in stats:
+            selected['x'] = stats['x'][:, :k_from]
+            selected['y'] = stats['y'][:, :k_to]
+            selected.update({name: stats[name] for name in PRECINCT_KEYS})
+        if self.other_threshold:
+            selected = self.pool_transition_stats(selected)
+        return selected
+
+    def pool_transition_stats(self, stats):
+        """Pool lists below other_threshold national votes into OTHER_SYMBOL on both sides."""
+        A, symbols_from = pooling_matrix(stats['symbols_from'], stats['national_from'], self.other_threshold)
+        B, symbols_to = pooling_matrix(stats['symbols_to'], stats['national_to'], self.other_threshold)
+        if A is None and B is None:
+            return stats
+        A = np.eye(len(symbols_from)) if A is None else A
+        B = np.eye(len(symbols_to)) if B is None else B
+        logger.info(f"Pooled small lists: {len(stats['symbols_from'])} → {len(symbols_from)} sources, "
+                    f"{len(stats['symbols_to'])} → {len(symbols_to)} targets")
+        pooled = {
+            'symbols_from': symbols_from,
+            'symbols_to': symbols_to,
+            'xtx': A.T @ stats['xtx'] @ A,
+            'xty': A.T @ stats['xty'] @ B,
+            'yty': B.T @ stats['yty'] @ B,
+            'x_sum': stats['x_sum'] @ A,
+            'y_sum': stats['y_sum'] @ B,
+            'n_matched': stats['n_matched'],
+            'national_from': stats['national_from'] @ A,
+            'national_to': stats['national_to'] @ B,
+        }
+        if 'x' in stats:
+            pooled['x'] = stats['x'] @ A
+            pooled['y'] = stats['y'] @ B
+            pooled.update({name: stats[name] for name in PRECINCT_KEYS})
+        return pooled
 
-            dnv_from_matched = dnv_from.loc[from_matched_ids].values.astype(float).reshape(-1, 1)
-            dnv_to_matched = dnv_to.loc[to_matched_ids].values.astype(float).reshape(-1, 1)
+    def solve_transfer_matrix_from_stats(self, G, C, YtY):
+        """
+        Solve for the transfer matrix from sufficient statistics.
 
-            X = np.hstack([X, dnv_from_matched])
-            Y = np.hstack([Y, dnv_to_matched])
+        cvxpy is given the equivalent k-row problem from gram_factor, which
+        has the same minimizer as the full precinct matrices.
+        """
+        if self.method == 'poisson':
+            raise ValueError("The poisson method needs per-precinct votes; use solve_transfer_matrix(stats)")
+        if self.method == 'projected_gradient':
+            return self._solve_projected_gradient(G, C)
+        if self.method in ('nnls', 'nnls_row_sum'):
+            return self._solve_nnls(G, C)
+        if self.method == 'closed_form':
+            return C @ np.linalg.pinv(YtY)
+
+        Xr, Yr = gram_factor(G, C)
+        return self.solve_transfer_matrix_convex(Xr, Yr)
+
+    def bootstrap_transfer_matrix(self, stats, M):
+        """
+        Bootstrap percentiles of the transfer matrix under the configured fit.
+
+        Resamples matched precincts self.bootstrap times; a replicate weights
+        every precinct by its base weight (precinct_weights) times the number
+        of times it was drawn, and is re-solved with the configured estimator.
+        Plain and weighted least squares (convex, projected_gradient, nnls,
+        nnls_row_sum) are solved in batches warm-started from M, convex by
+        projected gradient, which has the same minimizer (cvxpy would take
+        minutes per replicate). Robust, poisson and closed_form fits re-run
+        their own solver on every replicate (about 0.2s per IRLS and 0.4s per
+        EM replicate on K24->K25).
 
-            abstention_name = 'לא הצביעו'
-            names_from = list(names_from) + [abstention_name]
-            names_to = list(names_to) + [abstention_name]
-            symbols_from = list(symbols_from) + ['abstain']
-            symbols_to = list(symbols_to) + ['abstain']
+        Returns:
+            Array of shape (len(BOOTSTRAP_PERCENTILES), k_from, k_to)
+        """
+        start = time.perf_counter()
+        w = self.precinct_weights(stats)
+        if self.robust or self.method in ('poisson', 'closed_form'):
+            samples = self._bootstrap_replicates(stats, M, w)
+            logger.info(f"Bootstrap: {self.bootstrap} {self.method} replicates in "
+                        f"{time.perf_counter() - start:.2f}s")
+            return np.percentile(samples, BOOTSTRAP_PERCENTILES, axis=0)
+
+        if self.method in ('nnls', 'nnls_row_sum'):
+            samples, _ = bootstrap_simplex_lstsq(
+                stats['x'], stats['y'], M, self.bootstrap, seed=self.bootstrap_seed, weights=w,
+                solve=lambda G, C, M0: self._solve_nnls(G, C, M0=M0, tol=BOOTSTRAP_TOL, polish=False))
+            logger.info(f"Bootstrap: {self.bootstrap} {self.method} replicates in "
+                        f"{time.perf_counter() - start:.2f}s")
+            return np.percentile(samples, BOOTSTRAP_PERCENTILES, axis=0)
+
+        samples, info = bootstrap_simplex_lstsq(stats['x'], stats['y'], M, self.bootstrap,
+                                                seed=self.bootstrap_seed, weights=w)
+        logger.info(f"Bootstrap: {self.bootstrap} replicates in {time.perf_counter() - start:.2f}s "
+                    f"({info['iterations']} batched iterations)")
+        return np.percentile(samples, BOOTSTRAP_PERCENTILES, axis=0)
+
+    def _bootstrap_replicates(self, stats, M, w):
+        """
+        Re-solve every bootstrap replicate of a robust, poisson or closed_form fit.
 
-        # Compute transfer matrix
+        Uses the same draws as bootstrap_simplex_lstsq. Poisson EM has no
+        precinct weights, so its replicates repeat each drawn precinct.
+
+        Returns:
+            Array of shape (self.bootstrap, k_from, k_to)
+        """
+        x, y = stats['x'], stats['y']
+        samples = np.empty((self.bootstrap, *np.shape(M)))
+        i = 0
+        for W in bootstrap_counts(len(x), self.bootstrap, seed=self.bootstrap_seed):
+            for counts in W:
+                if self.method == 'poisson':
+                    rows = np.repeat(np.arange(len(x)), counts.astype(int))
+                    samples[i], _ = poisson_simplex_em(x[rows], y[rows], M0=M)
+                elif self.robust:
+                    samples[i], _, _ = irls_simplex_lstsq(x, y, weights=w * counts,
+                                                          scale=np.sqrt(stats['eligible']), M0=M)
+                else:
+                    _, C = weighted_gram_matrices(x, y, w * counts)
+                    samples[i] = C @ np.linalg.pinv(y.T @ (y * (w * counts)[:, np.newaxis]))
+                i += 1
+        return samples
+
+    def precinct_weights(self, stats):
+        """Base precinct weights of the fit (mean 1) for self.weighting."""
+        eligible = np.maximum(stats['eligible'], 1.0)
+        if self.weighting == 'eligible':
+            w = eligible
+        elif self.weighting == 'inverse_variance':
+            w = 1.0 / eligible
+        else:
+            w = np.ones_like(eligible)
+        return w / w.mean()
+
+    def solve_weighted(self, stats):
+        """
+        Weighted and/or Huber-robust fit from the per-precinct statistics.
+
+        The weighted Gram matrices are formed directly (O(n k^2)); the robust
+        mode iterates them with warm-started projected gradient solves and
+        standardizes residuals by sqrt(eligible voters).
+
+        Returns:
+            (M, fit_info) where fit_info is merged into the exported stats
+        """
+        if 'x' not in stats:
+            raise ValueError("Weighted and robust fits need per-precinct statistics")
+        w = self.precinct_weights(stats)
+        fit_info = {'weighting': self.weighting}
+        if not self.robust:
+            G, C = weighted_gram_matrices(stats['x'], stats['y'], w)
+            YtY = stats['y'].T @ (stats['y'] * w[:, np.newaxis])
+            return self.solve_transfer_matrix_from_stats(G, C, YtY), fit_info
+
+        start = time.perf_counter()
+        M, huber, info = irls_simplex_lstsq(stats['x'], stats['y'], weights=w,
+                                            scale=np.sqrt(stats['eligible']))
+        downweighted = int((huber < 1).sum())
+        logger.info(f"Huber IRLS: {info['iterations']} iterations in {time.perf_counter() - start:.2f}s, "
+                    f"{downweighted} precincts downweighted")
+        fit_info.update({
+            'robust': True,
+            'irls_iterations': info['iterations'],
+            'downweighted_precincts': downweighted,
+            'strongly_downweighted_precincts': int((huber < 0.5).sum()),
+        })
+        return M, fit_info
+
+    def solve_poisson(self, stats):
+        """
+        Poisson maximum-likelihood fit from the per-precinct votes.
+
+        Warm-started from the least-squares matrix, which costs milliseconds
+        and saves most of the EM iterations.
+
+        Returns:
+            (M, fit_info) where fit_info is merged into the exported stats
+        """
+        if 'x' not in stats:
+            raise ValueError("The poisson method needs per-precinct statistics")
+        start = time.perf_counter()
+        M0 = self._solve_projected_gradient(stats['xtx'], stats['xty'])
+        M, info = poisson_simplex_em(stats['x'], stats['y'], M0=M0)
+        logger.info(f"Poisson EM: {info['iterations']} iterations in {time.perf_counter() - start:.2f}s")
+        return M, {'likelihood': 'poisson', 'em_iterations': info['iterations']}
+
+    def solve_transfer_matrix(self, stats):
+        """
+        Solve selected statistics with the configured method and options.
+
+        Returns:
+            (M, fit_info) where fit_info is None for plain least squares
+        """
+        if self.method == 'poisson':
+            if self.weighting != 'none' or self.robust:
+                raise ValueError("The poisson method cannot be combined with weighting or robust fits")
+            logger.info("Computing transfer matrix by Poisson maximum likelihood...")
+            return self.solve_poisson(stats)
+        if self.weighting != 'none' or self.robust:
+            logger.info(f"Computing transfer matrix with {self.weighting} weighting"
+                        f"{' (robust)' if self.robust else ''}...")
+            return self.solve_weighted(stats)
         logger.info(f"Computing transfer matrix using {self.method} method...")
+        return self.solve_transfer_matrix_from_stats(stats['xtx'], stats['xty'], stats['yty']), None
+
+    def compute_transfer(self, election_from, election_to):
+        """
+        Compute vote transfer between two elections.
+
+        Returns:
+            dict with transfer data suitable for JSON export
+        """
+        stats = self.select_transition_stats(
+            self.load_transition_stats(election_from, election_to)
+        )
+
+        # Compute transfer matrix
+        M, fit_info = self.solve_transfer_matrix(stats)
+
+        ci = self.bootstrap_transfer_matrix(stats, M) if self.bootstrap else None
+        bounds = self.transfer_bounds(stats) if 'x' in stats else None
+        if self.residuals:
+            self.save_residuals(election_from, election_to, stats, M, bounds=bounds)
+        return self.build_transfer_data(election_from, election_to, stats, M, ci=ci, fit_info=fit_info,
+                                        bounds=bounds)
+
+    def transfer_bounds(self, stats):
+        """
+        Duncan-Davis bounds on the transfer rates, per settlement and national.
+
+        The precinct bounds are summed per settlement in one vectorized pass;
+        the national range is the sum over settlements. Precinct totals are
+        the valid votes, or the eligible voters with the abstention column.
 
-        if self.method == 'convex':
-            M = self.solve_transfer_matrix_convex(X, Y)
-        elif self.method == 'nnls':
-            M = self.solve_transfer_matrix_nnls(X, Y)
+        Returns:
+            dict of rate bounds: 'lower'/'upper' (k_from, k_to) and
+            'settlement_lower'/'settlement_upper' (n_settlements, k_from, k_to)
+        """
+        start = time.perf_counter()
+        if self.include_abstention:
+            totals = stats['eligible'], stats['eligible_to']
         else:
-            M = self.solve_transfer_matrix_closed(X, Y)
+            totals = stats['valid_from'], stats['valid_to']
+        lower, upper, x = bound_totals(stats['x'], stats['y'], *totals, settlement_index(stats),
+                                       len(stats['settlement_codes']))
+        bounds = dict(zip(('lower', 'upper'), rate_bounds(lower.sum(axis=0), upper.sum(axis=0), x.sum(axis=0))))
+        bounds['settlement_lower'], bounds['settlement_upper'] = rate_bounds(lower, upper, x)
+        logger.info(f"Duncan-Davis bounds: mean width {np.mean(bounds['upper'] - bounds['lower']) * 100:.1f}pp "
+                    f"in {time.perf_counter() - start:.3f}s")
+        return bounds
+
+    def save_residuals(self, election_from, election_to, stats, M, joint=False, bounds=None):
+        """Write the residual files of a solved transition (suffix as its transfer files)."""
+        suffix = output_suffix(self.include_abstention, all_lists=self.all_lists, joint=joint, venues=self.venues)
+        save_residuals(election_from, election_to, stats, M, self.list_names(stats['symbols_to'], election_to),
+                       suffix=suffix, bounds=bounds)
+
+    def build_transfer_data(self, election_from, election_to, stats, M, ci=None, fit_info=None, bounds=None):
+        """
+        Build the exported transfer data for a solved transition.
 
-        # Compute R² score
-        Y_pred = X @ M
-        ss_res = ((Y - Y_pred) ** 2).sum()
-        ss_tot = ((Y - Y.mean(axis=0)) ** 2).sum()
-        r_squared = 1 - ss_res / ss_tot
+        Args:
+            election_from: Earlier election ID
+            election_to: Later election ID
+            stats: Statistics from select_transition_stats
+            M: Transfer matrix (k_from, k_to)
+            ci: Optional bootstrap percentiles (see bootstrap_transfer_matrix)
+            fit_info: Optional weighting/robustness details (see solve_weighted)
+            bounds: Optional Duncan-Davis rate bounds (see transfer_bounds)
+
+        Returns:
+            dict with transfer data suitable for JSON export
+        """
+        config_from = ELECTIONS[election_from]
+        config_to = ELECTIONS[election_to]
+
+        symbols_from = stats['symbols_from']
+        symbols_to = stats['symbols_to']
+        names_from = self.list_names(symbols_from, election_from)
+        names_to = self.list_names(symbols_to, election_to)
+
+        n_matched = stats['n_matched']
+
+        r_squared = transfer_r_squared(stats, M)
         logger.info(f"R² = {r_squared:.4f}")
 
         # Compute vote movements
         # Use national totals (all precincts, not just matched)
-        total_votes_from = votes_from.sum().values
-        if self.include_abstention:
-            national_dnv_from = self._compute_dnv(df_from, config_from).sum()
-            total_votes_from = np.append(total_votes_from, national_dnv_from)
+        total_votes_from = stats['national_from']
         vote_movements = M * total_votes_from[:, np.newaxis]
 
         # Build transfer data for JSON
@@ -298,72 +826,56 @@ class VoteTransferAnalyzer:
                 percentage = float(M[i, j] * 100)
 
                 if votes >= self.min_flow_threshold:
-                    transfers.append({
+                    transfer = {
                         'source': source_name,
                         'source_symbol': source_symbol,
                         'target': target_name,
                         'target_symbol': target_symbol,
                         'votes': int(votes),
                         'percentage': round(percentage, 1)
-                    })
+                    }
+                    if ci is not None:
+                        transfer['ci'] = {
+                            f"p{q}": round(float(ci[c, i, j] * 100), 1)
+                            for c, q in enumerate(BOOTSTRAP_PERCENTILES)
+                        }
+                    if bounds is not None:
+                        lower, upper = bounds['lower'][i, j] * 100, bounds['upper'][i, j] * 100
+                        transfer['bounds'] = {
+                            'lower': round(float(lower), 1),
+                            'upper': round(float(upper), 1),
+                            'width': round(float(upper - lower), 1),
+                        }
+                    transfers.append(transfer)
 
         # Build node data
-        seats_from = parties_from.get('seats', [None] * len(names_from))
-        abstention_info = {
-            'name': 'לא הצביעו',
-            'name_en': 'Did not vote',
-            'color': '#9ca3af'
+        nodes_from = self.build_nodes(symbols_from, names_from, total_votes_from, election_from)
+        total_votes_to = stats['national_to']
+        nodes_to = self.build_nodes(symbols_to, names_to, total_votes_to, election_to)
+
+        transfer_stats = {
+            'common_precincts': n_matched,
+            'r_squared': round(float(r_squared), 4),
+            'total_votes_from': int(total_votes_from.sum()),
+            'total_votes_to': int(total_votes_to.sum()),
+            'generated_at': time.strftime('%Y-%m-%d %H:%M:%S')
         }
-        nodes_from = []
-        for i, name in enumerate(names_from):
-            symbol = symbols_from[i]
-            if symbol == 'abstain':
-                nodes_from.append({
-                    'name': name,
-                    'symbol': symbol,
-                    'votes': int(total_votes_from[i]),
-                    'seats': None,
-                    'color': '#9ca3af',
-                    'info': abstention_info
-                })
-            else:
-                info = get_party_info(symbol, election_from)
-                nodes_from.append({
-                    'name': name,
-                    'symbol': symbol,
-                    'votes': int(total_votes_from[i]),
-                    'seats': seats_from[i] if i < len(seats_from) else None,
-                    'color': info['color'],
-                    'info': info
-                })
-
-        total_votes_to = votes_to.sum().values
-        if self.include_abstention:
-            national_dnv_to = self._compute_dnv(df_to, config_to).sum()
-            total_votes_to = np.append(total_votes_to, national_dnv_to)
-        seats_to = parties_to.get('seats', [None] * len(names_to))
-        nodes_to = []
-        for i, name in enumerate(names_to):
-            symbol = symbols_to[i]
-            if symbol == 'abstain':
-                nodes_to.append({
-                    'name': name,
-                    'symbol': symbol,
-                    'votes': int(total_votes_to[i]),
-                    'seats': None,
-                    'color': '#9ca3af',
-                    'info': abstention_info
-                })
-            else:
-                info = get_party_info(symbol, election_to)
-                nodes_to.append({
-                    'name': name,
-                    'symbol': symbol,
-                    'votes': int(total_votes_to[i]),
-                    'seats': seats_to[i] if i < len(seats_to) else None,
-                    'color': info['color'],
-                    'info': info
-                })
+        if self.bootstrap:
+            transfer_stats['bootstrap_replicates'] = self.bootstrap
+        if self.all_lists:
+            transfer_stats['all_lists'] = True
+        if self.venues:
+            transfer_stats['units'] = 'venue'
+        if self.other_threshold:
+            transfer_stats['other_threshold'] = self.other_threshold
+        if fit_info:
+            transfer_stats.update(fit_info)
+        if bounds is not None:
+            # Width of the deterministic ranges, weighted by the estimated flows
+            widths = (bounds['upper'] - bounds['lower']) * 100
+            transfer_stats['bound_width_pp'] = round(float((widths * vote_movements).sum() / vote_movements.sum()), 1)
+            transfer_stats['flows_within_bounds'] = round(
+                float(((M >= bounds['lower'] - 1e-6) & (M <= bounds['upper'] + 1e-6)).mean()), 3)
 
         return {
             'from_election': {
@@ -389,79 +901,180 @@ class VoteTransferAnalyzer:
             'nodes_from': nodes_from,
             'nodes_to': nodes_to,
             'transfers': transfers,
-            'stats': {
-                'common_precincts': len(matched_pairs),
-                'r_squared': round(r_squared, 4),
-                'total_votes_from': int(total_votes_from.sum()),
-                'total_votes_to': int(total_votes_to.sum()),
-                'generated_at': time.strftime('%Y-%m-%d %H:%M:%S')
-            }
+            'stats': transfer_stats
         }
 
 
-def run_analysis(include_abstention=False, only_transitions=None):
-    """Run transfer analysis for all election pairs.
+# Election pairs to analyze
+TRANSITION_PAIRS = [
+    ('16', '17'),
+    ('17', '18'),
+    ('18', '19'),
+    ('19', '20'),
+    ('20', '21'),
+    ('21', '22'),
+    ('22', '23'),
+    ('23', '24'),
+    ('24', '25'),
+    ('25', '26'),
+]
 
-    Args:
-        include_abstention: Whether to include "did not vote" pseudo-party
-        only_transitions: Optional list of "X_to_Y" strings to filter pairs
+
+def select_pairs(only_transitions=None):
+    """Return TRANSITION_PAIRS, optionally filtered to "X_to_Y" strings."""
+    if not only_transitions:
+        return list(TRANSITION_PAIRS)
+    requested = set(only_transitions)
+    return [(f, t) for f, t in TRANSITION_PAIRS if f"{f}_to_{t}" in requested]
+
+
+def compute_transfer_job(from_id, to_id, include_abstention, method='convex', use_cache=True, bootstrap=0,
+                         all_lists=False, other_threshold=0, weighting='none', robust=False, residuals=False,
+                         venues=False):
+    """Compute one (pair, abstention) job; returns (data, wall_time_seconds).
+
+    Module-level so it can run in a worker process.
     """
-    suffix = '_abstention' if include_abstention else ''
     label = ' (with abstention)' if include_abstention else ''
+    logger.info(f"\n{'='*60}")
+    logger.info(f"Analyzing {from_id} → {to_id}{label}")
+    logger.info('='*60)
 
     analyzer = VoteTransferAnalyzer(
-        method='convex',
+        method=method,
         min_flow_threshold=5000,
         verbose=False,
-        include_abstention=include_abstention
+        include_abstention=include_abstention,
+        use_cache=use_cache,
+        bootstrap=bootstrap,
+        all_lists=all_lists,
+        other_threshold=other_threshold,
+        weighting=weighting,
+        robust=robust,
+        residuals=residuals,
+        venues=venues
     )
 
-    # Election pairs to analyze
-    pairs = [
-        ('16', '17'),
-        ('17', '18'),
-        ('18', '19'),
-        ('19', '20'),
-        ('20', '21'),
-        ('21', '22'),
-        ('22', '23'),
-        ('23', '24'),
-        ('24', '25'),
-        ('25', '26'),
-    ]
-
-    if only_transitions:
-        requested = set(only_transitions)
-        pairs = [(f, t) for f, t in pairs if f"{f}_to_{t}" in requested]
-        if not pairs:
-            logger.warning(f"No matching transitions found for: {only_transitions}")
-            return
+    start = time.perf_counter()
+    try:
+        data = analyzer.compute_transfer(from_id, to_id)
+    except Exception as e:
+        logger.error(f"Failed to analyze {from_id} → {to_id}{label}: {e}")
+        raise
+    elapsed = time.perf_counter() - start
+    log_cache_stats()
+    return data, elapsed
+
+
+def joint_links(pairs, stats_list, smoothness):
+    """
+    Smoothness links between the matrices of adjacent transitions.
+
+    A party family is identified by its ballot symbol (plus the abstention
+    and "other" pseudo-parties): the cell family_a → family_b of one
+    transition is pulled toward the same cell of the next transition when
+    both families appear on both sides. The weight is smoothness times the
+    mean per-precinct diagonal of XᵀX, so smoothness is measured in
+    precincts like the regional shrinkage.
+
+    Returns:
+        List of (t, t + 1, weight, cells_t, cells_t+1) for solve_joint_simplex_lstsq
+    """
+    if smoothness <= 0:
+        return []
+
+    def precinct_scale(stats):
+        return np.trace(stats['xtx']) / (len(stats['symbols_from']) * stats['n_matched'])
+
+    links = []
+    for t in range(len(pairs) - 1):
+        a, b = stats_list[t], stats_list[t + 1]
+        rows = [(i, list(b['symbols_from']).index(s)) for i, s in enumerate(a['symbols_from'])
+                if s in b['symbols_from']]
+        cols = [(j, list(b['symbols_to']).index(s)) for j, s in enumerate(a['symbols_to'])
+                if s in b['symbols_to']]
+        if not rows or not cols:
+            continue
+        (rows_a, rows_b), (cols_a, cols_b) = np.array(rows).T, np.array(cols).T
+        cells_a = (np.repeat(rows_a, len(cols_a)), np.tile(cols_a, len(rows_a)))
+        cells_b = (np.repeat(rows_b, len(cols_b)), np.tile(cols_b, len(rows_b)))
+        weight = smoothness * (precinct_scale(a) + precinct_scale(b)) / 2
+        links.append((t, t + 1, weight, cells_a, cells_b))
+    return links
+
+
+def compute_joint_transfers(pairs, include_abstention=False, smoothness=0.0, use_cache=True,
+                            all_lists=False, other_threshold=0, residuals=False, venues=False):
+    """
+    Estimate all transitions in one structured problem.
+
+    Every transition keeps its own matched precincts (a precinct present in
+    three consecutive elections is in both transitions' statistics) and
+    cached Gram matrices; recurring party families are tied together across
+    adjacent transitions by joint_links. The block solver re-solves one
+    transition at a time, so the cost is a few projected gradient solves
+    per transition rather than one large cvxpy problem.
+
+    Returns:
+        List of ((from_id, to_id), data) in pairs order
+    """
+    analyzer = VoteTransferAnalyzer(method='projected_gradient', include_abstention=include_abstention,
+                                    use_cache=use_cache, all_lists=all_lists, other_threshold=other_threshold,
+                                    venues=venues)
+    stats_list = [analyzer.select_transition_stats(analyzer.load_transition_stats(f, t)) for f, t in pairs]
+    links = joint_links(pairs, stats_list, smoothness)
+
+    start = time.perf_counter()
+    Ms, info = solve_joint_simplex_lstsq([s['xtx'] for s in stats_list], [s['xty'] for s in stats_list], links)
+    logger.info(f"Joint solve of {len(pairs)} transitions ({len(links)} links): {info['sweeps']} sweeps, "
+                f"{info['iterations']} iterations in {time.perf_counter() - start:.2f}s")
+
+    results = []
+    for (from_id, to_id), stats, M in zip(pairs, stats_list, Ms):
+        bounds = analyzer.transfer_bounds(stats)
+        data = analyzer.build_transfer_data(from_id, to_id, stats, M, bounds=bounds)
+        data['stats']['joint_smoothness'] = smoothness
+        if residuals:
+            analyzer.save_residuals(from_id, to_id, stats, M, joint=True, bounds=bounds)
+        results.append(((from_id, to_id), data))
+    return results
+
+
+def output_suffix(include_abstention=False, all_lists=False, joint=False, venues=False):
+    """File name suffix of a transfer variant, e.g. "_all_lists_abstention"."""
+    return (('_all_lists' if all_lists else '') + ('_venues' if venues else '') + ('_joint' if joint else '')
+            + ('_abstention' if include_abstention else ''))
+
+
+def save_transfer_results(results, include_abstention=False, only_transitions=None, all_lists=False, joint=False,
+                          venues=False):
+    """Write individual transfer files and the combined all_transfers file.
+
+    Args:
+        results: List of ((from_id, to_id), data) in TRANSITION_PAIRS order
+        include_abstention: Selects the "_abstention" file suffix
+        only_transitions: If set, merge into an existing combined file
+        all_lists: Selects the "_all_lists" file suffix
+        joint: Selects the "_joint" file suffix
+        venues: Selects the "_venues" file suffix
+    """
+    suffix = output_suffix(include_abstention, all_lists=all_lists, joint=joint, venues=venues)
 
     all_data = {
         'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
         'transitions': {}
     }
 
-    for from_id, to_id in pairs:
-        logger.info(f"\n{'='*60}")
-        logger.info(f"Analyzing {from_id} → {to_id}{label}")
-        logger.info('='*60)
-
-        try:
-            data = analyzer.compute_transfer(from_id, to_id)
-            key = f"{from_id}_to_{to_id}"
-            all_data['transitions'][key] = data
+    Path('data').mkdir(exist_ok=True)
+    for (from_id, to_id), data in results:
+        key = f"{from_id}_to_{to_id}"
+        all_data['transitions'][key] = data
 
-            # Save individual file
-            output_file = f"data/transfer_{from_id}_to_{to_id}{suffix}.json"
-            Path('data').mkdir(exist_ok=True)
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            logger.info(f"Saved {output_file}")
-
-        except Exception as e:
-            logger.error(f"Failed to analyze {from_id} → {to_id}{label}: {e}")
-            raise
+        # Save individual file
+        output_file = f"data/transfer_{from_id}_to_{to_id}{suffix}.json"
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        logger.info(f"Saved {output_file}")
 
     # Save combined file — merge into existing if running subset
     combined_file = f'data/all_transfers{suffix}.json'
@@ -476,23 +1089,164 @@ def run_analysis(include_abstention=False, only_transitions=None):
     logger.info(f"\nSaved {combined_file}")
 
 
+def log_job_times(job_times, elapsed):
+    """Print a per-job wall-time table and the overall speedup."""
+    logger.info(f"\n{'Job':<28} {'Wall time':>10}")
+    logger.info('-' * 39)
+    for label, seconds in job_times:
+        logger.info(f"{label:<28} {seconds:>9.2f}s")
+    logger.info('-' * 39)
+    total = sum(seconds for _, seconds in job_times)
+    logger.info(f"{'Sum of jobs':<28} {total:>9.2f}s")
+    logger.info(f"{'Elapsed':<28} {elapsed:>9.2f}s")
+    if elapsed > 0:
+        logger.info(f"{'Speedup':<28} {total / elapsed:>9.2f}x")
+
+
+def run_analysis(include_abstention=False, only_transitions=None, method='convex', use_cache=True,
+                 jobs=1, abstention_modes=None, bootstrap=0, all_lists=False, other_threshold=0,
+                 joint=False, smoothness=0.0, weighting='none', robust=False, residuals=False, venues=False):
+    """Run transfer analysis for all election pairs.
+
+    Args:
+        include_abstention: Whether to include "did not vote" pseudo-party
+        only_transitions: Optional list of "X_to_Y" strings to filter pairs
+        method: Solver method passed to VoteTransferAnalyzer
+        use_cache: Whether to reuse cached per-transition statistics
+        jobs: Number of worker processes; 1 runs everything in-process
+        abstention_modes: Optional list of include_abstention values to run
+            together (e.g. [False, True]); overrides include_abstention
+        bootstrap: Number of bootstrap replicates for confidence intervals
+        all_lists: Model every list instead of major_parties only
+        other_threshold: Pool lists below this many national votes into "other"
+        joint: Estimate all selected transitions jointly (projected gradient
+            block solver; method, jobs and bootstrap are ignored, weighting
+            and robust are not supported)
+        smoothness: Weight of the joint temporal smoothness, in precincts
+        weighting: Precinct weighting of the fit (one of WEIGHTINGS)
+        robust: Whether to downweight outlying precincts (Huber IRLS)
+        residuals: Whether to write per-precinct and per-settlement residual
+            files under data/residuals
+        venues: Fit polling venue units instead of matched ballot boxes
+            (writes *_venues files)
+    """
+    modes = list(abstention_modes) if abstention_modes is not None else [include_abstention]
+
+    pairs = select_pairs(only_transitions)
+    if not pairs:
+        logger.warning(f"No matching transitions found for: {only_transitions}")
+        return
+
+    if joint:
+        if weighting != 'none' or robust:
+            raise ValueError("Joint estimation does not support weighting or robust fits")
+        available = []
+        for from_id, to_id in pairs:
+            missing = [ELECTIONS[e]['file'] for e in (from_id, to_id) if not Path(ELECTIONS[e]['file']).exists()]
+            if missing:
+                logger.warning(f"Skipping {from_id} → {to_id}: missing {', '.join(missing)}")
+            else:
+                available.append((from_id, to_id))
+        for mode in modes:
+            start = time.perf_counter()
+            results = compute_joint_transfers(available, include_abstention=mode, smoothness=smoothness,
+                                              use_cache=use_cache, all_lists=all_lists,
+                                              other_threshold=other_threshold, residuals=residuals,
+                                              venues=venues)
+            logger.info(f"Joint estimation{' (abstention)' if mode else ''}: {time.perf_counter() - start:.2f}s")
+            save_transfer_results(results, include_abstention=mode, only_transitions=only_transitions,
+                                  all_lists=all_lists, joint=True, venues=venues)
+        return
+
+    # One job per (pair, abstention mode), in deterministic order
+    job_args = [(f, t, mode, method, use_cache, bootstrap, all_lists, other_threshold, weighting, robust,
+                 residuals, venues) for mode in modes for f, t in pairs]
+
+    start = time.perf_counter()
+    if jobs > 1:
+        logger.info(f"Running {len(job_args)} jobs on {jobs} worker processes")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(compute_transfer_job, *args) for args in job_args]
+            outcomes = [future.result() for future in futures]
+    else:
+        outcomes = [compute_transfer_job(*args) for args in job_args]
+    elapsed = time.perf_counter() - start
+
+    job_times = []
+    for mode in modes:
+        results = []
+        for args, (data, seconds) in zip(job_args, outcomes):
+            from_id, to_id, job_mode = args[:3]
+            if job_mode != mode:
+                continue
+            results.append(((from_id, to_id), data))
+            label = ' (abstention)' if mode else ''
+            job_times.append((f"{from_id}_to_{to_id}{label}", seconds))
+        save_transfer_results(results, include_abstention=mode, only_transitions=only_transitions,
+                              all_lists=all_lists, venues=venues)
+
+    log_job_times(job_times, elapsed)
+
+
 def main():
     """Generate transfer data for all consecutive election pairs."""
     import argparse
     parser = argparse.ArgumentParser(description='Generate vote transfer matrices')
     parser.add_argument('--transitions', nargs='+',
                         help='Only compute specific transitions, e.g. --transitions 25_to_26 24_to_25')
+    parser.add_argument('--method', default=None,
+                        choices=METHODS,
+                        help='Transfer matrix solver (default: convex, projected_gradient with --all-lists)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Recompute per-transition statistics from the CSVs instead of data/cache')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for the (pair x abstention) jobs (default: 1)')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='B',
+                        help='Add 5th/50th/95th percentile intervals from B precinct bootstrap '
+                             'replicates, e.g. --bootstrap 1000 (default: off)')
+    parser.add_argument('--all-lists', action='store_true',
+                        help='Model every list, not only major_parties (writes *_all_lists files)')
+    parser.add_argument('--other-threshold', type=int, default=0, metavar='VOTES',
+                        help='Pool lists with fewer national votes into one "other" node, '
+                             'e.g. --other-threshold 20000 (default: off)')
+    parser.add_argument('--joint', action='store_true',
+                        help='Estimate all transitions jointly (writes *_joint files)')
+    parser.add_argument('--smoothness', type=float, default=0.0, metavar='PRECINCTS',
+                        help='With --joint, pull matrix cells of recurring parties in adjacent transitions '
+                             'together, e.g. --smoothness 50 (default: 0)')
+    parser.add_argument('--weighting', default='none', choices=WEIGHTINGS,
+                        help='Precinct weights of the fit: eligible voters or inverse expected variance '
+                             '(default: none)')
+    parser.add_argument('--robust', action='store_true',
+                        help='Downweight outlying precincts by Huber iteratively reweighted least squares')
+    parser.add_argument('--no-residuals', action='store_true',
+                        help='Skip the per-precinct and per-settlement residual files in data/residuals')
+    parser.add_argument('--venues', action='store_true',
+                        help='Fit polling venue units instead of matched ballot boxes (writes *_venues files)')
     args = parser.parse_args()
+    if args.joint and (args.weighting != 'none' or args.robust):
+        parser.error('--joint cannot be combined with --weighting or --robust')
 
     only = args.transitions
-
-    # Regular analysis
-    logger.info("=== Regular transfer analysis ===")
-    run_analysis(include_abstention=False, only_transitions=only)
-
-    # Abstention analysis
-    logger.info("\n=== Abstention transfer analysis ===")
-    run_analysis(include_abstention=True, only_transitions=only)
+    # SCS takes tens of seconds per solve on 40+ lists
+    method = args.method or ('projected_gradient' if args.all_lists else 'convex')
+    options = dict(method=method, use_cache=not args.no_cache, bootstrap=args.bootstrap,
+                   all_lists=args.all_lists, other_threshold=args.other_threshold,
+                   joint=args.joint, smoothness=args.smoothness, weighting=args.weighting,
+                   robust=args.robust, residuals=not args.no_residuals, venues=args.venues)
+
+    if args.jobs > 1:
+        # Regular and abstention analyses share one process pool
+        logger.info("=== Regular + abstention transfer analysis ===")
+        run_analysis(only_transitions=only, jobs=args.jobs, abstention_modes=[False, True], **options)
+    else:
+        # Regular analysis
+        logger.info("=== Regular transfer analysis ===")
+        run_analysis(include_abstention=False, only_transitions=only, **options)
+
+        # Abstention analysis
+        logger.info("\n=== Abstention transfer analysis ===")
+        run_analysis(include_abstention=True, only_transitions=only, **options)
 
     logger.info("\nDone!")
 
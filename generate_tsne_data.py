@@ -20,6 +20,9 @@ try:
 except ImportError:
     HAS_UMAP = False
 
+from ballot_matching import make_ballot_ids
+from ballot_registry import load_registry
+from election_store import load_election_frame, load_raw_frame
 from party_config import ELECTIONS, get_party_info
 
 # Configure logging
@@ -31,17 +34,18 @@ logger = logging.getLogger(__name__)
 
 
 def load_election_data(election_id):
-    """Load election data from CSV."""
-    config = ELECTIONS[election_id]
-
-    logger.info(f"Loading {config['name']} from {config['file']}")
-
-    df = pd.read_csv(
-        config['file'],
-        encoding=config['encoding']
-    )
+    """
+    Load an election's raw rows without aggregated data (city 9999).
 
-    logger.info(f"Loaded {len(df)} precincts")
+    Duplicate ballot IDs are kept (the normalized store frames drop them),
+    so station ids stay the row positions of the CSV minus city 9999. The
+    ballot_id column holds the normalized "<settlement>__<ballot>" ID.
+    """
+    config = ELECTIONS[election_id]
+    df = load_raw_frame(election_id)
+    df = df[df['סמל ישוב'] != 9999].reset_index(drop=True)
+    df['ballot_id'] = make_ballot_ids(df['סמל ישוב'], df[config.get('ballot_field', 'קלפי')],
+                                      config.get('ballot_number_divisor', 1))
     return df, config
 
 
@@ -126,8 +130,6 @@ def compute_tsne_projection(df, config, perplexity=30, random_state=42):
 
     # Build result data
     result = []
-    ballot_field = config.get('ballot_field', 'קלפי')
-    divisor = config.get('ballot_number_divisor', 1)
 
     for i, (idx, row) in enumerate(df_filtered.iterrows()):
         # Calculate turnout
@@ -135,17 +137,8 @@ def compute_tsne_projection(df, config, perplexity=30, random_state=42):
         actual_voters = int(row.get('מצביעים', 0))
         turnout = round((actual_voters / eligible * 100), 1) if eligible > 0 else 0
 
-        # Normalize ballot number (K16-K17 use x10 numbering)
-        raw_ballot = str(row.get(ballot_field, ''))
-        if raw_ballot.endswith('.0'):
-            raw_ballot = raw_ballot[:-2]
-        if divisor > 1:
-            try:
-                n = int(raw_ballot)
-                if n % divisor == 0:
-                    raw_ballot = str(n // divisor)
-            except ValueError:
-                pass
+        # Normalized ballot number ("<settlement>__<ballot>", K16-K17 x10 numbering divided out)
+        ballot_number = row['ballot_id'].partition('__')[2]
 
         # Get station metadata
         station_data = {
@@ -154,11 +147,14 @@ def compute_tsne_projection(df, config, perplexity=30, random_state=42):
             'id': int(idx),
             'settlement_name': str(row.get('שם ישוב', '')),
             'settlement_id': int(row.get('סמל ישוב', 0)),
-            'ballot_number': raw_ballot,
+            'ballot_number': ballot_number,
+            'registry_id': int(row['registry_id']),
             'total_voters': int(total_votes_filtered.iloc[i]),
             'eligible_voters': eligible,
             'turnout': turnout,
         }
+        if row['fallback_id'] >= 0:
+            station_data['fallback_id'] = int(row['fallback_id'])
         if umap_coords is not None:
             station_data['ux'] = float(umap_coords[i, 0])
             station_data['uy'] = float(umap_coords[i, 1])
@@ -189,9 +185,16 @@ def generate_tsne_json(election_id, compact=True):
     """Generate T-SNE data for a single election."""
     df, config = load_election_data(election_id)
 
-    # Filter out aggregated data (city 9999)
-    df = df[df['סמל ישוב'] != 9999].copy()
-    df = df.reset_index(drop=True)
+    # Integer ballot identities for joining stations across elections (scatter.html);
+    # duplicate rows share the registry entry of their ballot ID
+    registry = load_registry()
+    store_ids = load_election_frame(election_id)[0].index
+    identities = pd.DataFrame({
+        'registry_id': registry.ids(election_id),
+        'fallback_id': registry.fallback_ids(election_id),
+    }, index=store_ids).reindex(df['ballot_id'])
+    df['registry_id'] = identities['registry_id'].fillna(-1).to_numpy(dtype=int)
+    df['fallback_id'] = identities['fallback_id'].fillna(-1).to_numpy(dtype=int)
 
     # Compute T-SNE projection
     stations, party_names, party_symbols = compute_tsne_projection(df, config)
@@ -228,7 +231,10 @@ def generate_tsne_json(election_id, compact=True):
                 'e': s['eligible_voters'],   # eligible voters
                 't': s['turnout'],           # turnout percentage
                 'p': s['proportions'],       # keep proportions for coloring
+                'r': s['registry_id'],       # ballot registry ID
             }
+            if 'fallback_id' in s:
+                cs['f'] = s['fallback_id']   # registry ID of the base box a .1 box falls back to
             if 'ux' in s:
                 cs['ux'] = round(s['ux'], 2)
                 cs['uy'] = round(s['uy'], 2)
@@ -7,23 +7,11 @@ When keys collapse, keep the entry with coordinates (prefer google_venue > venue
 
 import json
 
+from settlement_registry import normalize_name
 
 SOURCE_PRIORITY = {'google_venue': 3, 'venue': 2, 'settlement': 1, 'not_found': 0}
 
 
-def normalize_name(name):
-    """Normalize settlement name — must match generate_map_data.py."""
-    if not name:
-        return name
-    normalized = name.replace('-', ' ').replace('–', ' ')
-    normalized = normalized.replace("'", '').replace('\u05f3', '')
-    normalized = normalized.replace('"', '').replace('\u05f4', '')
-    normalized = normalized.replace('(', ' ').replace(')', ' ')
-    normalized = ' '.join(normalized.split())
-    normalized = normalized.replace('יי', 'י')
-    return normalized
-
-
 def main():
     filepath = 'site/data/station_coordinates.json'
     with open(filepath, 'r', encoding='utf-8') as f:
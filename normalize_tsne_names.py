@@ -2,32 +2,14 @@
 """
 One-shot script to normalize settlement names in tsne_*.json files.
 Avoids re-running the expensive t-SNE computation.
-Uses the same normalize_name() logic as generate_map_data.py.
+Uses settlement_registry.normalize_name().
 """
 
 import json
 import glob
 import os
 
-
-NAME_OVERRIDES = {
-    'גולס': "ג'וליס",
-    'גוליס': "ג'וליס",
-}
-
-
-def normalize_name(name):
-    """Normalize settlement name — must match generate_map_data.py."""
-    if not name:
-        return name
-    normalized = name.replace('-', ' ').replace('–', ' ')
-    normalized = normalized.replace("'", '').replace('\u05f3', '')
-    normalized = normalized.replace('"', '').replace('\u05f4', '')
-    normalized = normalized.replace('(', ' ').replace(')', ' ')
-    normalized = ' '.join(normalized.split())
-    normalized = normalized.replace('יי', 'י')
-    normalized = NAME_OVERRIDES.get(normalized, normalized)
-    return normalized
+from settlement_registry import normalize_name
 
 
 def main():
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Incremental vote transfer estimation for election night.
+
+Ballot-level results of the new election arrive in batches. Instead of
+re-running generate_transfer_data.py from scratch for every batch,
+IncrementalTransferEstimator keeps the running sufficient statistics
+X^T X, X^T Y, Y^T Y of the matched precincts (the same layout as the
+per-transition statistics cache), absorbs each batch in O(rows x k^2),
+re-solves warm-started from the previous matrices and rewrites
+data/transfer_X_to_Y[_abstention].json.
+
+Run as a script it replays an existing ballot CSV in random chunks and
+records the latency of every update:
+
+    python online_transfer.py --from 24 --to 25 --csv ballot25.csv
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ballot_matching import make_ballot_ids, match_ballot_ids
+from generate_transfer_data import VoteTransferAnalyzer
+from party_config import ELECTIONS
+from transfer_solvers import solve_simplex_lstsq
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path, data):
+    """Write JSON via a temporary file so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.json.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class IncrementalTransferEstimator:
+    """Running transfer matrix estimate fed with batches of ballot rows."""
+
+    def __init__(self, election_from='25', election_to='26', min_flow_threshold=5000,
+                 output_dir='data'):
+        """
+        Initialize the estimator from the (complete) earlier election.
+
+        Args:
+            election_from: Earlier election ID (must be fully available)
+            election_to: Election whose ballot rows arrive incrementally
+            min_flow_threshold: Minimum vote flow to include in output
+            output_dir: Directory of the rewritten transfer JSON files
+        """
+        self.election_from = election_from
+        self.election_to = election_to
+        self.output_dir = Path(output_dir)
+        self.config_to = ELECTIONS[election_to]
+
+        self.analyzers = {
+            include_abstention: VoteTransferAnalyzer(
+                method='projected_gradient', min_flow_threshold=min_flow_threshold,
+                include_abstention=include_abstention)
+            for include_abstention in (False, True)
+        }
+        analyzer = self.analyzers[False]
+
+        df_from, config_from = analyzer.load_election_data(election_from)
+        parties_from = config_from['major_parties']
+        votes_from, self.symbols_from, _ = analyzer.extract_party_votes(
+            df_from, parties_from['symbols'], parties_from['names']
+        )
+        dnv_from = analyzer._compute_dnv(df_from, config_from)
+        self.from_ids = votes_from.index
+        self.X_from = np.hstack([votes_from.values.astype(float),
+                                 dnv_from.values.astype(float).reshape(-1, 1)])
+
+        self.symbols_to = None
+        k = self.X_from.shape[1]
+        # Party-column statistics of the matched boxes; the abstention
+        # column depends on all received rows and is added in transition_stats
+        self.stats = {
+            'xtx': np.zeros((k, k)),
+            'xty': None,
+            'yty': None,
+            'x_sum': np.zeros(k),
+            'y_sum': None,
+            'n_matched': 0,
+            'national_from': self.X_from.sum(axis=0),
+            'national_to': None,
+        }
+        self.rows = {}               # ballot_id -> (CSV row label, party votes, voters, eligible)
+        self.matched = {}            # ballot_id -> row of X_from it is matched to
+        self.zero_bases = set()      # "<settlement>__<n>" of arrived "<n>.0" boxes
+        self.fallback_ids = {}       # from_id -> ballot_ids matched to it via .1 fallback
+        self.matrices = {}
+
+    @property
+    def n_rows(self):
+        """Number of distinct ballot boxes received so far."""
+        return len(self.rows)
+
+    def _init_to_columns(self, batch):
+        """Fix the later election's party columns from the first batch."""
+        parties_to = self.config_to['major_parties']
+        self.symbols_to = [s for s in parties_to['symbols'] if s in batch.columns]
+        if len(self.symbols_to) < len(parties_to['symbols']):
+            missing = set(parties_to['symbols']) - set(self.symbols_to)
+            logger.warning(f"Missing party columns: {missing}")
+        m = len(self.symbols_to)
+        k = self.X_from.shape[1]
+        self.stats.update({
+            'xty': np.zeros((k, m)),
+            'yty': np.zeros((m, m)),
+            'y_sum': np.zeros(m),
+            'national_to': np.zeros(m),
+        })
+
+    def _add(self, X, Y, sign=1.0):
+        """Add (or with sign=-1 remove) matched rows from the statistics."""
+        self.stats['xtx'] += sign * (X.T @ X)
+        self.stats['xty'] += sign * (X.T @ Y)
+        self.stats['yty'] += sign * (Y.T @ Y)
+        self.stats['x_sum'] += sign * X.sum(axis=0)
+        self.stats['y_sum'] += sign * Y.sum(axis=0)
+        self.stats['n_matched'] += int(sign) * len(X)
+
+    def _add_matched(self, ballot_ids, sign=1.0):
+        """Add (or remove) the statistics of matched ballot IDs."""
+        if ballot_ids:
+            X = self.X_from[[self.matched[i] for i in ballot_ids]]
+            Y = np.array([self.rows[i][1] for i in ballot_ids])
+            self._add(X, Y, sign=sign)
+
+    def absorb(self, batch):
+        """
+        Absorb a batch of raw ballot rows of the later election.
+
+        Rows are normalized and matched like the batch pipeline. Of rows
+        sharing a ballot ID, the one first in the CSV (lowest row label)
+        is kept, as in read_election_csv, even if it arrives later. A .1
+        box that fell back to its undivided base is removed again if the
+        base's .0 box arrives in a later batch. After all rows have arrived
+        the statistics therefore equal those of the full-file computation.
+
+        Args:
+            batch: DataFrame with the later election's CSV columns, indexed
+                by CSV row number
+
+        Returns:
+            Number of newly matched precincts
+        """
+        if self.symbols_to is None:
+            self._init_to_columns(batch)
+
+        divisor = self.config_to.get('ballot_number_divisor', 1)
+        ballot_field = self.config_to.get('ballot_field', 'קלפי')
+        batch = batch[(batch['סמל ישוב'] != 9999).to_numpy()].sort_index(kind='stable')
+        ids = make_ballot_ids(batch['סמל ישוב'], batch[ballot_field], divisor).to_numpy()
+        unique = ~pd.Series(ids).duplicated().to_numpy()
+        batch, ids = batch[unique], ids[unique]
+
+        labels = batch.index.tolist()
+        votes = batch[self.symbols_to].fillna(0).to_numpy(dtype=float)
+        voters = batch['מצביעים'].fillna(0).to_numpy(dtype=np.int64)
+        eligible = batch['בזב'].fillna(0).to_numpy(dtype=np.int64)
+
+        # Rows of known IDs replace the stored row only if they come first in the CSV
+        new = []
+        replaced = []
+        for i, ballot_id in enumerate(ids.tolist()):
+            stored = self.rows.get(ballot_id)
+            if stored is None:
+                new.append(i)
+            elif labels[i] < stored[0]:
+                replaced.append(i)
+        replaced_matched = [ids[i] for i in replaced if ids[i] in self.matched]
+        self._add_matched(replaced_matched, sign=-1.0)
+        for i in new + replaced:
+            stored = self.rows.get(ids[i])
+            if stored is not None:
+                self.stats['national_to'] -= stored[1]
+            self.rows[ids[i]] = (labels[i], votes[i], voters[i], eligible[i])
+            self.stats['national_to'] += votes[i]
+        self._add_matched(replaced_matched)
+        ids = ids[new]
+        if not len(ids):
+            return 0
+
+        # Retract earlier .1 fallbacks whose base now has an explicit .0 box
+        new_zero_bases = {i[:-2] for i in ids.tolist() if i.endswith('.0')}
+        for base in new_zero_bases & self.fallback_ids.keys():
+            retracted = self.fallback_ids.pop(base)
+            self._add_matched(retracted, sign=-1.0)
+            for ballot_id in retracted:
+                del self.matched[ballot_id]
+        self.zero_bases |= new_zero_bases
+
+        matches = match_ballot_ids(self.from_ids, ids)
+        fallback = matches['fallback'].to_numpy()
+        allowed = ~(fallback & matches['from_id'].isin(self.zero_bases).to_numpy())
+        matches = matches[allowed]
+
+        to_ids = matches['to_id'].tolist()
+        self.matched.update(zip(to_ids, matches['from_pos'].tolist()))
+        self._add_matched(to_ids)
+        for from_id, to_id in zip(matches['from_id'][matches['fallback']], matches['to_id'][matches['fallback']]):
+            self.fallback_ids.setdefault(from_id, []).append(to_id)
+        return len(matches)
+
+    def abstention(self):
+        """
+        "Did not vote" of every received box, as in the batch pipeline.
+
+        Uses VoteTransferAnalyzer._compute_dnv on all rows received so far,
+        including its estimate from the national eligible voters when בזב is
+        empty (e.g. K17), so the column is final once all rows have arrived.
+
+        Returns:
+            Series of abstention counts indexed by ballot_id
+        """
+        ids = list(self.rows)
+        received = pd.DataFrame({
+            'בזב': np.array([self.rows[i][3] for i in ids], dtype=np.int64),
+            'מצביעים': np.array([self.rows[i][2] for i in ids], dtype=np.int64),
+        }, index=ids)
+        return self.analyzers[False]._compute_dnv(received, self.config_to)
+
+    def transition_stats(self):
+        """Current statistics in the load_transition_stats layout (abstention last)."""
+        dnv = self.abstention()
+        matched = list(self.matched)
+        X = self.X_from[[self.matched[i] for i in matched]].reshape(-1, self.X_from.shape[1])
+        Y = np.array([self.rows[i][1] for i in matched]).reshape(-1, len(self.symbols_to))
+        d = dnv.loc[matched].to_numpy(dtype=float)
+        ytd = Y.T @ d
+        return {
+            'xtx': self.stats['xtx'].copy(),
+            'xty': np.hstack([self.stats['xty'], (X.T @ d).reshape(-1, 1)]),
+            'yty': np.block([[self.stats['yty'], ytd.reshape(-1, 1)],
+                             [ytd.reshape(1, -1), np.array([[d @ d]])]]),
+            'x_sum': self.stats['x_sum'].copy(),
+            'y_sum': np.append(self.stats['y_sum'], d.sum()),
+            'national_from': self.stats['national_from'],
+            'national_to': np.append(self.stats['national_to'], float(dnv.sum())),
+            'symbols_from': np.array(self.symbols_from),
+            'symbols_to': np.array(self.symbols_to),
+            'n_matched': np.array(self.stats['n_matched']),
+        }
+
+    def solve(self):
+        """
+        Re-solve both variants (with and without abstention).
+
+        Each solve is warm-started from the previous batch's matrix.
+
+        Returns:
+            dict mapping include_abstention to (stats, M)
+        """
+        raw = self.transition_stats()
+        solved = {}
+        for include_abstention, analyzer in self.analyzers.items():
+            stats = analyzer.select_transition_stats(raw)
+            M, _ = solve_simplex_lstsq(stats['xtx'], stats['xty'],
+                                       M0=self.matrices.get(include_abstention))
+            self.matrices[include_abstention] = M
+            solved[include_abstention] = (stats, M)
+        return solved
+
+    def write(self, solved):
+        """Rewrite transfer_X_to_Y.json and transfer_X_to_Y_abstention.json."""
+        written = []
+        for include_abstention, (stats, M) in solved.items():
+            data = self.analyzers[include_abstention].build_transfer_data(
+                self.election_from, self.election_to, stats, M
+            )
+            data['stats']['ballots_received'] = self.n_rows
+            suffix = '_abstention' if include_abstention else ''
+            path = self.output_dir / f"transfer_{self.election_from}_to_{self.election_to}{suffix}.json"
+            write_json_atomic(path, data)
+            written.append(path)
+        return written
+
+    def update(self, batch):
+        """Absorb a batch, re-solve and rewrite the transfer files."""
+        matched = self.absorb(batch)
+        if self.stats['n_matched'] == 0:
+            logger.warning("No matched precincts yet, skipping solve")
+            return matched
+        self.write(self.solve())
+        return matched
+
+
+def replay(csv_path, election_from='24', election_to='25', min_chunk=200, max_chunk=2000,
+           seed=0, output_dir='data/replay'):
+    """
+    Feed an existing ballot CSV to the estimator in random chunks.
+
+    Rows are shuffled and split into chunks of random size between
+    min_chunk and max_chunk; every update's latency (absorb, solve, write)
+    is recorded. The final statistics must equal those of the batch
+    pipeline exactly, and the final matrices are compared to the batch
+    solver.
+
+    Returns:
+        dict with per-update latencies, the statistics that differ from
+        the batch computation (empty if none) and the final deviation from
+        the batch result
+    """
+    rng = np.random.default_rng(seed)
+    config_to = ELECTIONS[election_to]
+    df = pd.read_csv(csv_path, encoding=config_to['encoding'])
+    df = df.iloc[rng.permutation(len(df))]
+
+    sizes = []
+    while sum(sizes) < len(df):
+        sizes.append(int(rng.integers(min_chunk, max_chunk + 1)))
+    bounds = np.cumsum([0] + sizes)
+
+    estimator = IncrementalTransferEstimator(election_from, election_to, output_dir=output_dir)
+    updates = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        batch = df.iloc[start:end]
+        t0 = time.perf_counter()
+        matched = estimator.absorb(batch)
+        t1 = time.perf_counter()
+        solved = estimator.solve()
+        t2 = time.perf_counter()
+        estimator.write(solved)
+        t3 = time.perf_counter()
+        updates.append({
+            'rows': len(batch),
+            'matched': matched,
+            'total_matched': int(estimator.stats['n_matched']),
+            'absorb_ms': round((t1 - t0) * 1000, 2),
+            'solve_ms': round((t2 - t1) * 1000, 2),
+            'write_ms': round((t3 - t2) * 1000, 2),
+            'total_ms': round((t3 - t0) * 1000, 2),
+        })
+        logger.info(f"Update {len(updates)}: {len(batch)} rows, {int(estimator.stats['n_matched'])} matched, "
+                    f"{updates[-1]['total_ms']:.1f} ms")
+
+    # Compare the final state with the from-scratch batch computation
+    batch_stats = VoteTransferAnalyzer().load_transition_stats(election_from, election_to)
+    stream_stats = estimator.transition_stats()
+    mismatched = [key for key, value in stream_stats.items() if not np.array_equal(value, batch_stats[key])]
+    deviation = {}
+    for include_abstention, (_, M) in solved.items():
+        analyzer = VoteTransferAnalyzer(method='projected_gradient', include_abstention=include_abstention)
+        stats = analyzer.select_transition_stats(batch_stats)
+        M_batch = analyzer.solve_transfer_matrix_from_stats(stats['xtx'], stats['xty'], stats['yty'])
+        deviation['abstention' if include_abstention else 'regular'] = float(np.abs(M - M_batch).max())
+
+    totals = np.array([u['total_ms'] for u in updates])
+    return {
+        'csv': str(csv_path),
+        'transition': f"{election_from}_to_{election_to}",
+        'updates': updates,
+        'latency_ms': {
+            'median': round(float(np.median(totals)), 2),
+            'p95': round(float(np.percentile(totals, 95)), 2),
+            'max': round(float(totals.max()), 2),
+        },
+        'stats_mismatch': mismatched,
+        'max_abs_deviation_from_batch': deviation,
+    }
+
+
+def main():
+    """Replay a ballot CSV through the incremental estimator."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay a ballot CSV through the incremental transfer estimator')
+    parser.add_argument('--from', dest='election_from', default='24', help='Earlier election (default: 24)')
+    parser.add_argument('--to', dest='election_to', default='25', help='Replayed election (default: 25)')
+    parser.add_argument('--csv', help="Ballot CSV to replay (default: the later election's file)")
+    parser.add_argument('--min-chunk', type=int, default=200, help='Minimum rows per update (default: 200)')
+    parser.add_argument('--max-chunk', type=int, default=2000, help='Maximum rows per update (default: 2000)')
+    parser.add_argument('--seed', type=int, default=0, help='Shuffle/chunking seed (default: 0)')
+    parser.add_argument('--output-dir', default='data/replay',
+                        help='Where the rewritten transfer files go (default: data/replay)')
+    args = parser.parse_args()
+
+    csv_path = args.csv or ELECTIONS[args.election_to]['file']
+    report = replay(csv_path, args.election_from, args.election_to, min_chunk=args.min_chunk,
+                    max_chunk=args.max_chunk, seed=args.seed, output_dir=args.output_dir)
+
+    report_file = Path(args.output_dir) / f"replay_latency_{args.election_from}_to_{args.election_to}.json"
+    write_json_atomic(report_file, report)
+    logger.info(f"{len(report['updates'])} updates, latency median {report['latency_ms']['median']} ms, "
+                f"p95 {report['latency_ms']['p95']} ms, max {report['latency_ms']['max']} ms")
+    logger.info(f"Max deviation from batch solve: {report['max_abs_deviation_from_batch']}")
+    logger.info(f"Saved {report_file}")
+    if report['stats_mismatch']:
+        logger.error(f"Streamed statistics differ from the batch computation: {report['stats_mismatch']}")
+        sys.exit(1)
+    logger.info("Streamed statistics equal the batch computation")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Canonical settlement registry keyed by CBS settlement code (סמל ישוב).
+
+Settlement names differ between sources and elections: the CEC stripped
+hyphens, geresh and parentheses from K23 on, dropped spaces in some Arab
+localities, and the CBS, Wikipedia and geocoding files each use their own
+spelling. The registry gathers every known name of every settlement code
+once and precomputes a variant -> code hash table, so generators join on
+integer codes and only normalize names they have never seen:
+
+- name: canonical display name (the latest election's name, normalized,
+  in its spaced form where the CEC dropped spaces)
+- variants: every raw and normalized name from the ballot files, the
+  spacing variants below, and the names used by the site data files
+- name_en (settlement_names_en.json), lat/lng (station_coordinates.json),
+  the CBS socioeconomic cluster (socioeconomic_clusters.json) and the key
+  of the settlement's entry in settlement_wiki.json, so data files can
+  carry them by code for pages that look them up by name
+
+    python settlement_registry.py
+
+writes the registry to data/settlement_registry.json.
+"""
+
+import json
+import logging
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from election_store import available_elections, frame_cache_key, load_election_frame
+
+logger = logging.getLogger(__name__)
+
+# Site data files with settlement-level attributes
+SITE_DATA_DIR = Path('site/data')
+SETTLEMENT_NAMES_EN_FILE = SITE_DATA_DIR / 'settlement_names_en.json'
+SETTLEMENT_WIKI_FILE = SITE_DATA_DIR / 'settlement_wiki.json'
+SOCIOECONOMIC_FILE = SITE_DATA_DIR / 'socioeconomic_clusters.json'
+COORDINATES_FILE = SITE_DATA_DIR / 'station_coordinates.json'
+
+# Registry export
+REGISTRY_OUTPUT = Path('data/settlement_registry.json')
+
+# Post-normalization name corrections (CEC misspellings → canonical names)
+NAME_OVERRIDES = {
+    'גולס': "ג'וליס",
+    'גוליס': "ג'וליס",
+}
+
+# The CEC changed settlement name formatting between elections 22→23,
+# removing some spaces. Both forms are merged as variants of one settlement,
+# and the spaced form is its canonical name. Unspaced form → spaced form
+SPACING_VARIANTS = {
+    'אום אלפחם': 'אום אל פחם',
+    'באקה אלגרביה': 'באקה אל גרביה',
+    'בועינהנוגידאת': 'בועינה נוגידאת',
+    'ביר אלמכסור': 'ביר אל מכסור',
+    'בנימינהגבעת עדה': 'בנימינה גבעת עדה',
+    'גדידהמכר': 'גדידה מכר',
+    'גסר אזרקא': 'גסר א זרקא',
+    'דאלית אלכרמל': 'דאלית אל כרמל',
+    'דיר אלאסד': 'דיר אל אסד',
+    'חפציבה': 'חפצי בה',
+    'טובאזנגריה': 'טובא זנגריה',
+    'יאנוחגת': 'יאנוח גת',
+    'יהודמונוסון': 'יהוד מונוסון',
+    'כאוכב אבו אלהיגא': 'כאוכב אבו אל היגא',
+    'כסראסמיע': 'כסרא סמיע',
+    'כעביהטבאשחגאגרה': 'כעביה טבאש חגאגרה',
+    'מגד אלכרום': 'מגד אל כרום',
+    'מודיעיןמכביםרעות': 'מודיעין מכבים רעות',
+    'מסעודין אלעזאזמה': 'מסעודין אל עזאזמה',
+    'מעלותתרשיחא': 'מעלות תרשיחא',
+    'ערערהבנגב': 'ערערה בנגב',
+    'פרדס חנהכרכור': 'פרדס חנה כרכור',
+    'קדימהצורן': 'קדימה צורן',
+    'רםאון': 'רם און',
+    'שגבשלום': 'שגב שלום',
+    'שריגים ליאון': 'שריגים לי און',
+}
+
+
+def normalize_name(name):
+    """Normalize settlement name for matching.
+
+    The CEC changed formatting between elections 22→23, stripping hyphens,
+    geresh/gershayim, and parentheses. This ensures consistent names across all elections.
+    """
+    if not name:
+        return name
+    # Remove dashes
+    normalized = name.replace('-', ' ').replace('–', ' ')
+    # Remove geresh (ASCII apostrophe and Hebrew geresh)
+    normalized = normalized.replace("'", '').replace('\u05f3', '')
+    # Remove gershayim (ASCII double-quote and Hebrew gershayim)
+    normalized = normalized.replace('"', '').replace('\u05f4', '')
+    # Remove parentheses
+    normalized = normalized.replace('(', ' ').replace(')', ' ')
+    # Collapse multiple spaces
+    normalized = ' '.join(normalized.split())
+    # Normalize double-yod to single (קריית -> קרית)
+    normalized = normalized.replace('יי', 'י')
+    # Apply name overrides
+    normalized = NAME_OVERRIDES.get(normalized, normalized)
+    return normalized
+
+
+def election_settlements(election_id):
+    """
+    Settlement codes and raw names of an election's ballot file.
+
+    Rows with a non-numeric code (e.g. a trailing EOF row) are skipped. A
+    code can appear under more than one name (K17 has two such codes).
+
+    Returns:
+        dict of settlement code -> stripped names, most ballots first
+    """
+    df, _ = load_election_frame(election_id)
+    codes = pd.to_numeric(df['סמל ישוב'], errors='coerce')
+    valid = codes.notna().to_numpy()
+    pairs = pd.DataFrame({
+        'code': codes[valid].astype(int).to_numpy(),
+        'name': df['שם ישוב'].fillna('').astype(str).str.strip().to_numpy()[valid],
+    }).value_counts().reset_index().sort_values(['code', 'count'], ascending=[True, False], kind='stable')
+    return {code: group.tolist() for code, group in pairs.groupby('code', sort=True)['name']}
+
+
+def _load_json(path):
+    """Parsed JSON file, or None (with a warning) if it is missing."""
+    if not path.exists():
+        logger.warning(f"{path} not found")
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def settlement_coordinates(stations):
+    """First located station of every settlement in station_coordinates.json (name -> lat/lng)."""
+    coordinates = {}
+    for station in stations.values():
+        settlement = station.get('settlement', '')
+        lat, lng = station.get('lat'), station.get('lng')
+        if not settlement or station.get('source') == 'not_found' or lat is None or lng is None:
+            continue
+        coordinates.setdefault(settlement, {'lat': lat, 'lng': lng})
+    return coordinates
+
+
+def registry_inputs():
+    """
+    Inputs of the canonical settlement names (JSON-ready), for cache keys.
+
+    The names are the latest election's, so they depend on the ballot files
+    of all available elections (by their election store keys) and on the
+    name corrections; this is much cheaper than building the registry.
+    """
+    return {
+        'elections': {election_id: frame_cache_key(election_id) for election_id in available_elections()},
+        'name_overrides': NAME_OVERRIDES,
+        'spacing_variants': SPACING_VARIANTS,
+    }
+
+
+class SettlementRegistry:
+    """Settlements by CBS code with their name variants and site attributes."""
+
+    def __init__(self, election_names):
+        """
+        Build the registry from every election's settlement names.
+
+        Args:
+            election_names: dict of election ID -> {code: raw names}, from
+                election_settlements
+        """
+        self.election_ids = sorted(election_names, key=int)
+        self.names = {}
+        self.variants = {}
+        self.last_election = {}
+        for election_id in self.election_ids:
+            for code, names in election_names[election_id].items():
+                # Later elections overwrite: the canonical name is the latest one
+                name = normalize_name(names[0]) or names[0]
+                self.names[code] = SPACING_VARIANTS.get(name, name)
+                self.last_election[code] = election_id
+                self.variants.setdefault(code, set()).update(
+                    v for name in names for v in (name, normalize_name(name)) if v)
+        for code, variants in self.variants.items():
+            for variant, spaced in SPACING_VARIANTS.items():
+                if variant in variants or spaced in variants:
+                    variants.update((variant, spaced))
+
+        # Variant -> code; a name shared by two codes belongs to the more recent one
+        self.by_variant = {}
+        for code in sorted(self.variants, key=lambda c: int(self.last_election[c])):
+            self.by_variant.update(dict.fromkeys(self.variants[code], code))
+        self._by_election = {e: {} for e in self.election_ids}
+        for election_id, codes in election_names.items():
+            for code, names in codes.items():
+                for name in names:
+                    self._by_election[election_id].update(dict.fromkeys((name, normalize_name(name)), code))
+
+        self.name_en = self._attach(_load_json(SETTLEMENT_NAMES_EN_FILE) or {})
+        clusters = _load_json(SOCIOECONOMIC_FILE) or []
+        self.cluster = self._attach({item['name']: item['cluster'] for item in clusters if item.get('cluster')})
+        stations = (_load_json(COORDINATES_FILE) or {}).get('stations', {})
+        self.coordinates = self._attach(settlement_coordinates(stations))
+        self.wiki = self._attach({name: name for name in _load_json(SETTLEMENT_WIKI_FILE) or {}})
+
+    def _attach(self, values):
+        """
+        Resolve a name-keyed mapping to settlement codes.
+
+        Every resolved name becomes a known variant. A value stored under
+        the canonical name wins over the other variants.
+
+        Returns:
+            dict of code -> value
+        """
+        by_code = {}
+        for name, value in values.items():
+            code = self.lookup(name)
+            if code is None:
+                continue
+            self.by_variant.setdefault(name, code)
+            self.variants[code].add(name)
+            if code not in by_code or name == self.names[code]:
+                by_code[code] = value
+        return by_code
+
+    @property
+    def codes(self):
+        """All settlement codes, ascending."""
+        return sorted(self.names)
+
+    def lookup(self, name, election_id=None):
+        """
+        Settlement code of a name.
+
+        Known variants are a single hash lookup; other names are normalized
+        once. With election_id, that election's own names are tried first,
+        which separates names reused by a newer settlement code.
+
+        Returns:
+            int code, or None if the name is unknown
+        """
+        if election_id is not None:
+            code = self._by_election.get(election_id, {}).get(name)
+            if code is not None:
+                return code
+        code = self.by_variant.get(name)
+        if code is None and name:
+            code = self.by_variant.get(normalize_name(str(name).strip()))
+        return code
+
+    def entry(self, code):
+        """Registry record of a settlement code (JSON-ready)."""
+        record = {'id': code, 'name': self.names[code]}
+        if code in self.name_en:
+            record['name_en'] = self.name_en[code]
+        if code in self.coordinates:
+            record.update(self.coordinates[code])
+        if code in self.cluster:
+            record['cluster'] = self.cluster[code]
+        if code in self.wiki:
+            record['wiki'] = self.wiki[code]
+        record['last_election'] = self.last_election[code]
+        record['variants'] = sorted(self.variants[code])
+        return record
+
+
+@lru_cache(maxsize=1)
+def load_settlement_registry():
+    """
+    Build the settlement registry from all available elections (memoized).
+
+    Returns:
+        SettlementRegistry shared between callers; treat it as read-only
+    """
+    start = time.perf_counter()
+    registry = SettlementRegistry({e: election_settlements(e) for e in available_elections()})
+    logger.info(f"Settlement registry: {len(registry.names)} settlements, {len(registry.by_variant)} "
+                f"name variants ({time.perf_counter() - start:.2f}s)")
+    return registry
+
+
+def save_registry(registry, output=REGISTRY_OUTPUT):
+    """Write all registry records plus the variant table to JSON."""
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'settlements': [registry.entry(code) for code in registry.codes],
+        'variants': dict(sorted(registry.by_variant.items())),
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    logger.info(f"Saved {output}")
+
+
+def main():
+    """Build the settlement registry, report its coverage and save it."""
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Build the CBS-code settlement registry')
+    parser.add_argument('--output', default=str(REGISTRY_OUTPUT),
+                        help=f'Output JSON file (default: {REGISTRY_OUTPUT})')
+    args = parser.parse_args()
+
+    registry = load_settlement_registry()
+    n = len(registry.names)
+    for label, values in (('English names', registry.name_en), ('coordinates', registry.coordinates),
+                          ('socioeconomic clusters', registry.cluster), ('wiki entries', registry.wiki)):
+        logger.info(f"{label}: {len(values)}/{n} settlements")
+    save_registry(registry, args.output)
+
+
+if __name__ == '__main__':
+    main()
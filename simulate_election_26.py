@@ -14,8 +14,7 @@ Then run:
 
 import argparse
 import numpy as np
-import pandas as pd
-from party_config import ELECTIONS
+from election_store import load_raw_frame
 
 # ============================================================================
 # CONFIGURATION — Edit these to model different scenarios
@@ -194,8 +193,8 @@ def simulate(alpha=55, seed=42):
     rng = np.random.default_rng(seed)
 
     # Read E25 data
-    e25_config = ELECTIONS['25']
-    df = pd.read_csv(e25_config['file'], encoding=e25_config['encoding'])
+    # Raw rows: the simulated CSV keeps K25's city 9999 (double envelope) rows
+    df = load_raw_frame('25')
 
     # Identify metadata columns (up to and including כשרים)
     cols = list(df.columns)
@@ -547,10 +547,23 @@
     // Pre-load if starting in English
     if (currentLang === 'en') loadSettlementNames();
 
+    /** English names carried by data entries (map_*.json settlements), by Hebrew name. */
+    const _entryNames = {};
+
+    /** Register the English names of settlement entries ({name, name_en}).
+     *  Map entries use canonical names that settlement_names_en.json may only
+     *  know in another spelling, so their own name_en takes precedence. */
+    function registerSettlements(settlements) {
+        (settlements || []).forEach(s => {
+            if (s.name && s.name_en) _entryNames[s.name] = s.name_en;
+        });
+    }
+
     /** Get settlement display name (English transliteration or Hebrew original). */
     function settlementName(name) {
         if (!name) return '';
         if (currentLang === 'he') return name;
+        if (_entryNames[name]) return _entryNames[name];
         if (!_settlementMap) {
             loadSettlementNames();
             return name; // Return Hebrew until loaded
@@ -828,6 +841,7 @@
         electionName,
         settlementName,
         settlementMatches,
+        registerSettlements,
         fmtNum,
         getLang,
         isRTL,
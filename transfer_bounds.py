@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Deterministic (Duncan-Davis) bounds on vote transfer rates.
+
+Within one precinct, the number of voters n_ij who moved from party i to
+party j is only constrained by the ballot marginals: with x_i votes for i
+in the earlier election, y_j votes for j in the later one and N voters
+overall,
+
+    max(0, x_i + y_j - N) <= n_ij <= min(x_i, y_j)
+
+Summing the precinct bounds and dividing by the summed x_i bounds the
+national (or settlement) transfer rate M_ij. Narrow ranges mean a flow is
+pinned down by the data itself; wide ranges mean the least-squares matrix
+is doing the identifying.
+
+The votes are taken as they are. N_from and N_to are the precinct's full
+totals (valid votes, or eligible voters with the abstention column), and
+the lists that are not modelled form an implicit residual column on each
+side, so no later votes are rescaled. The upper bound holds without any
+assumption. The lower bound takes N as the larger of the two totals, which
+assumes the precinct's voters changed only by the net change of that
+total; with more turnover, fewer voters are forced into any one flow.
+Everything is vectorized over precincts, in chunks so the (n, k_from,
+k_to) intermediates stay small even with --all-lists.
+"""
+
+import numpy as np
+
+# Precincts per chunk of the (chunk, k_from, k_to) bound arrays
+BOUNDS_CHUNK = 2048
+
+
+def group_sum(inverse, values, n):
+    """Sum the rows of a 2-D array per group index in one bincount."""
+    k = values.shape[1]
+    flat = (inverse[:, np.newaxis] * k + np.arange(k)).ravel()
+    return np.bincount(flat, weights=values.ravel(), minlength=n * k).reshape(n, k)
+
+
+def precinct_bounds(X, Y, N_from, N_to):
+    """
+    Duncan-Davis bounds on the transfer counts of every precinct.
+
+    Args:
+        X: Earlier-election votes (n, k_from)
+        Y: Later-election votes (n, k_to)
+        N_from: Full earlier total of every precinct (n,), including the
+            lists missing from X
+        N_to: Full later total of every precinct (n,)
+
+    Returns:
+        (lower, upper) arrays of shape (n, k_from, k_to)
+    """
+    # A total below its modelled votes (a CSV sum mismatch) leaves no residual
+    N_from = np.maximum(N_from, X.sum(axis=1))
+    N_to = np.maximum(N_to, Y.sum(axis=1))
+    N = np.maximum(N_from, N_to)
+    x = X[:, :, np.newaxis]
+    y = Y[:, np.newaxis, :]
+    lower = np.maximum(0.0, x + y - N[:, np.newaxis, np.newaxis])
+    upper = np.minimum(x, y)
+    return lower, upper
+
+
+def bound_totals(X, Y, N_from, N_to, groups=None, n_groups=1, chunk=BOUNDS_CHUNK):
+    """
+    Summed precinct bounds per group of precincts.
+
+    Args:
+        X: Earlier-election votes (n, k_from)
+        Y: Later-election votes (n, k_to)
+        N_from: Full earlier total of every precinct (see precinct_bounds)
+        N_to: Full later total of every precinct
+        groups: Optional group index of every precinct (e.g. settlement);
+            None puts every precinct in group 0
+        n_groups: Number of groups
+        chunk: Precincts per vectorized chunk
+
+    Returns:
+        (lower, upper, x) with lower/upper count sums of shape
+        (n_groups, k_from, k_to) and the source vote sums x (n_groups, k_from)
+    """
+    n, k_from = X.shape
+    k_to = Y.shape[1]
+    inverse = np.zeros(n, dtype=int) if groups is None else np.asarray(groups)
+    lower = np.zeros((n_groups, k_from * k_to))
+    upper = np.zeros((n_groups, k_from * k_to))
+    for start in range(0, n, chunk):
+        rows = slice(start, start + chunk)
+        lo, hi = precinct_bounds(X[rows], Y[rows], N_from[rows], N_to[rows])
+        lower += group_sum(inverse[rows], lo.reshape(len(lo), -1), n_groups)
+        upper += group_sum(inverse[rows], hi.reshape(len(hi), -1), n_groups)
+    shape = (n_groups, k_from, k_to)
+    return lower.reshape(shape), upper.reshape(shape), group_sum(inverse, X, n_groups)
+
+
+def rate_bounds(lower, upper, x):
+    """
+    Turn summed count bounds into transfer rate bounds.
+
+    Works on the output of bound_totals per group, or on its sum over
+    groups for the national range. Sources without votes get the
+    uninformative range [0, 1].
+
+    Returns:
+        (lower, upper) rate arrays shaped like the count sums
+    """
+    x = x[..., np.newaxis]
+    empty = x <= 0
+    x = np.where(empty, 1.0, x)
+    return np.where(empty, 0.0, lower / x), np.where(empty, 1.0, upper / x)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Per-precinct and per-settlement residuals of a solved transfer matrix.
+
+For every matched precinct the fitted matrix predicts the later vote as
+X_i M. The residual files compare the observed and predicted vote shares
+of each target party, plus one scalar misfit per precinct: the total
+variation distance between the two share vectors (half the sum of the
+absolute share differences, 0 = perfect fit, 1 = disjoint votes).
+
+Two files are written per transition under data/residuals/:
+
+- residuals_<from>_to_<to><suffix>.npz: columnar arrays keyed by the
+  later election's canonical ballot_id ("<settlement code>__<ballot>",
+  stored as ASCII bytes) with float32 shares, plus the same columns
+  aggregated to settlements (settlement_* arrays, including the
+  Duncan-Davis transfer rate bounds when given), for numpy/pandas.
+- settlements_<from>_to_<to><suffix>.json: columnar per-settlement misfit
+  and the party with the largest share error, named like
+  generate_map_data so it can colour the settlements of geomap.html.
+
+Everything is a handful of array operations over the matched precincts,
+so exporting costs a few milliseconds per transition.
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from transfer_bounds import group_sum
+
+logger = logging.getLogger(__name__)
+
+# Output directory of the residual files
+RESIDUALS_DIR = Path('data/residuals')
+
+
+def _shares(votes):
+    """Row-normalize vote counts to shares (all-zero rows stay zero)."""
+    totals = votes.sum(axis=1, keepdims=True)
+    return votes / np.where(totals > 0, totals, 1.0)
+
+
+def settlement_index(stats):
+    """Index into stats['settlement_codes'] of every matched precinct."""
+    # ballot_id is "<settlement code>__<ballot number>"
+    return np.searchsorted(stats['settlement_codes'], np.char.partition(stats['ballot_id'], b'__')[:, 0])
+
+
+def precinct_residuals(Y, Y_pred):
+    """
+    Observed vs predicted shares of every matched precinct.
+
+    Args:
+        Y: Later-election votes (n, k_to)
+        Y_pred: Predicted votes X @ M (n, k_to)
+
+    Returns:
+        dict with 'observed' and 'predicted' shares (n, k_to), 'misfit'
+        (n,) total variation distance and 'votes' (n,) observed totals
+    """
+    observed = _shares(Y)
+    predicted = _shares(Y_pred)
+    return {
+        'observed': observed,
+        'predicted': predicted,
+        'misfit': 0.5 * np.abs(observed - predicted).sum(axis=1),
+        'votes': Y.sum(axis=1),
+    }
+
+
+def settlement_residuals(inverse, n, Y, Y_pred, misfit):
+    """
+    Aggregate precinct residuals to settlements.
+
+    Shares are recomputed from the summed observed and predicted votes, so
+    the settlement misfit measures systematic bias of the fit in that
+    settlement; 'mean_misfit' is the vote-weighted mean precinct misfit.
+
+    Args:
+        inverse: Settlement index of every precinct (0..n-1)
+        n: Number of settlements
+        Y, Y_pred: As in precinct_residuals
+        misfit: Precinct misfits from precinct_residuals
+
+    Returns:
+        dict of arrays with one row per settlement index
+    """
+    votes = Y.sum(axis=1)
+    set_votes = np.bincount(inverse, weights=votes, minlength=n)
+    observed = _shares(group_sum(inverse, Y, n))
+    predicted = _shares(group_sum(inverse, Y_pred, n))
+    return {
+        'ballots': np.bincount(inverse, minlength=n),
+        'votes': set_votes,
+        'observed': observed,
+        'predicted': predicted,
+        'misfit': 0.5 * np.abs(observed - predicted).sum(axis=1),
+        'mean_misfit': np.bincount(inverse, weights=misfit * votes, minlength=n)
+                       / np.where(set_votes > 0, set_votes, 1.0),
+    }
+
+
+def save_residuals(election_from, election_to, stats, M, names_to, suffix='', bounds=None):
+    """
+    Write the precinct and settlement residual files of one transition.
+
+    Args:
+        election_from: Earlier election ID
+        election_to: Later election ID
+        stats: Statistics from select_transition_stats (with per-precinct
+            x, y, ballot IDs and settlement names)
+        M: Transfer matrix (k_from, k_to)
+        names_to: Display names of the target columns
+        suffix: File suffix of the transfer variant (e.g. "_abstention")
+        bounds: Optional dict with per-settlement Duncan-Davis rate bounds
+            ('settlement_lower', 'settlement_upper'; see transfer_bounds)
+    """
+    start = time.perf_counter()
+    Y = stats['y']
+    Y_pred = stats['x'] @ np.asarray(M, dtype=float)
+    ballot_ids = stats['ballot_id']
+    codes = stats['settlement_codes']
+    inverse = settlement_index(stats)
+
+    precincts = precinct_residuals(Y, Y_pred)
+    settlements = settlement_residuals(inverse, len(codes), Y, Y_pred, precincts['misfit'])
+
+    RESIDUALS_DIR.mkdir(parents=True, exist_ok=True)
+    transition = f"{election_from}_to_{election_to}"
+    npz_file = RESIDUALS_DIR / f"residuals_{transition}{suffix}.npz"
+    np.savez(
+        npz_file,
+        ballot_id=ballot_ids,
+        from_ballot_id=stats['from_ballot_id'],
+        symbols_from=np.asarray(stats['symbols_from'], dtype=str),
+        symbols_to=np.asarray(stats['symbols_to'], dtype=str),
+        settlement_code=codes,
+        **{name: values.astype(np.float32) for name, values in precincts.items()},
+        **{f"settlement_{name}": values.astype(np.float32) for name, values in settlements.items()},
+        **({f"settlement_bounds_{side}": bounds[f"settlement_{side}"].astype(np.float32)
+            for side in ('lower', 'upper')} if bounds is not None else {}),
+    )
+
+    # Party with the largest share error in each settlement (observed - predicted)
+    diff = settlements['observed'] - settlements['predicted']
+    worst = np.abs(diff).argmax(axis=1)
+    symbols = np.asarray(stats['symbols_to'], dtype=str)
+    output = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'transition': transition,
+        'parties': dict(zip(symbols.tolist(), names_to)),
+        # Columnar: settlements[column][i] describes settlement i
+        'settlements': {
+            'code': np.char.decode(codes).tolist(),
+            'name': stats['settlement_names'].tolist(),
+            'ballots': settlements['ballots'].tolist(),
+            'votes': np.round(settlements['votes']).astype(int).tolist(),
+            'misfit': np.round(settlements['misfit'], 4).tolist(),
+            'mean_misfit': np.round(settlements['mean_misfit'], 4).tolist(),
+            'worst_party': symbols[worst].tolist(),
+            'worst_diff_pp': np.round(diff[np.arange(len(worst)), worst] * 100, 1).tolist(),
+        },
+    }
+    json_file = RESIDUALS_DIR / f"settlements_{transition}{suffix}.json"
+    with open(json_file, 'w', encoding='utf-8') as f:
+        # json.dumps uses the C encoder; json.dump to a file does not
+        f.write(json.dumps(output, ensure_ascii=False, separators=(',', ':')))
+
+    logger.info(f"Saved {npz_file} and {json_file} ({len(Y)} precincts, "
+                f"{len(codes)} settlements) in {time.perf_counter() - start:.3f}s")
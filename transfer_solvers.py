@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+"""
+Fast solvers for constrained vote transfer matrices.
+
+All solvers work on the small sufficient statistics of the least-squares
+problem instead of the full precinct matrices:
+
+    ||X M - Y||_F^2 = tr(M^T G M) - 2 tr(M^T C) + tr(Y^T Y)
+
+where G = X^T X (k_from x k_from) and C = X^T Y (k_from x k_to). A 13x13
+transition therefore costs microseconds per iteration regardless of the
+number of matched precincts.
+"""
+
+import numpy as np
+
+# Default stopping tolerance on the projected-gradient fixed-point residual
+# (max abs change of any matrix cell per iteration, in probability units).
+DEFAULT_TOL = 1e-10
+
+# Default iteration cap for the accelerated projected gradient loop
+DEFAULT_MAX_ITER = 20000
+
+# Looser tolerance for bootstrap replicates: they only feed percentiles that
+# are reported to 0.1 percentage points.
+BOOTSTRAP_TOL = 1e-6
+
+# Stopping tolerance of the outer block sweeps of solve_joint_simplex_lstsq
+JOINT_TOL = 1e-7
+
+# Maximum number of block sweeps of solve_joint_simplex_lstsq
+JOINT_MAX_SWEEPS = 500
+
+# Huber tuning constant, in robust scale units of the standardized residuals
+HUBER_C = 1.345
+
+# IRLS stops when no precinct weight changes by more than this
+IRLS_TOL = 1e-4
+
+# Maximum number of IRLS reweighting iterations
+IRLS_MAX_ITER = 50
+
+# Coarse tolerance after which solve_nnls first tries the exact support polish;
+# the KKT checks reject a wrong support and the loop then continues to tol.
+NNLS_POLISH_TOL = 1e-4
+
+# Bootstrap replicates whose Gram matrices are formed and solved together
+BOOTSTRAP_CHUNK = 250
+
+# Stopping tolerance (max abs change of any matrix cell per accelerated
+# step) and iteration cap of the Poisson EM
+POISSON_TOL = 1e-7
+POISSON_MAX_ITER = 5000
+
+# Share of the uniform matrix mixed into the Poisson EM warm start: EM
+# updates are multiplicative, so cells that start at zero stay at zero
+POISSON_START_MIX = 0.5
+
+
+def gram_matrices(X, Y):
+    """Compute the Gram matrices G = X^T X and C = X^T Y."""
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    return X.T @ X, X.T @ Y
+
+
+def gram_factor(G, C):
+    """
+    Reduce a least-squares problem to k rows using only its Gram matrices.
+
+    Returns (Xr, Yr) with Xr^T Xr = G and Xr^T Yr = C, so that
+    ||Xr M - Yr||_F^2 differs from ||X M - Y||_F^2 by a constant and any
+    least-squares solver (cvxpy, scipy nnls) gives the same minimizer on
+    the k x k problem as on the full precinct matrices.
+    """
+    eigvals, Q = np.linalg.eigh(np.asarray(G, dtype=float))
+    keep = eigvals > eigvals.max() * G.shape[0] * np.finfo(float).eps
+    root = np.sqrt(eigvals[keep])
+    Xr = root[:, np.newaxis] * Q[:, keep].T
+    Yr = (Q[:, keep].T @ np.asarray(C, dtype=float)) / root[:, np.newaxis]
+    return Xr, Yr
+
+
+def project_rows_to_simplex(V):
+    """
+    Euclidean projection of every row of V onto the probability simplex.
+
+    Uses the sort-based algorithm (Held et al. / Duchi et al.), vectorized
+    over all rows. Works on arrays of shape (..., k, m): each length-m row
+    along the last axis is projected independently.
+    """
+    V = np.asarray(V, dtype=float)
+    m = V.shape[-1]
+    U = -np.sort(-V, axis=-1)
+    css = np.cumsum(U, axis=-1) - 1.0
+    ind = np.arange(1, m + 1)
+    cond = U - css / ind > 0
+    rho = m - np.argmax(cond[..., ::-1], axis=-1)
+    theta = np.take_along_axis(css, (rho - 1)[..., np.newaxis], axis=-1) / rho[..., np.newaxis]
+    return np.maximum(V - theta, 0.0)
+
+
+def project_nonnegative(V):
+    """Projection onto the non-negative orthant."""
+    return np.maximum(V, 0.0)
+
+
+def _row_steps(G):
+    """
+    Per-row inverse step sizes for the preconditioned gradient step.
+
+    D = diag(sum_j |G_ij|) dominates G (Gershgorin), so a step of 1/d_i on
+    row i is a valid majorization. Because each row of M gets a single
+    scalar weight, the Euclidean projection onto the simplex is still exact
+    in the scaled metric.
+    """
+    d = np.abs(G).sum(axis=-1)
+    scale = d.max(axis=-1, keepdims=True) if d.ndim > 1 else d.max()
+    floor = np.maximum(scale * 1e-12, np.finfo(float).tiny)
+    return np.maximum(d, floor)
+
+
+def fista(G, C, project, M0=None, tol=DEFAULT_TOL, max_iter=DEFAULT_MAX_ITER, W=None):
+    """
+    Accelerated projected gradient (FISTA) for min 1/2 tr(M^T G M) - tr(M^T C).
+
+    Uses per-row diagonal preconditioning and adaptive (gradient-based)
+    restarts. G and C may carry a leading batch dimension, in which case all
+    problems in the batch are iterated together.
+
+    Args:
+        G: Gram matrix X^T X, shape (..., k, k)
+        C: Cross matrix X^T Y, shape (..., k, m)
+        project: Projection onto the feasible set, applied row-wise
+        M0: Optional warm start, shape (..., k, m)
+        tol: Stop when no cell changes by more than tol in one iteration
+        max_iter: Maximum number of iterations
+        W: Optional non-negative per-cell weights adding 1/2 sum(W * M^2)
+            to the objective, shape (..., k, m)
+
+    Returns:
+        (M, n_iter) tuple
+    """
+    G = np.asarray(G, dtype=float)
+    C = np.asarray(C, dtype=float)
+    d = _row_steps(G)
+    if W is not None:
+        W = np.asarray(W, dtype=float)
+        d = d + W.max(axis=-1)
+    step = 1.0 / d[..., np.newaxis]
+
+    if M0 is None:
+        M = project(np.full(C.shape, 1.0 / C.shape[-1]))
+    else:
+        M = project(np.array(M0, dtype=float))
+
+    Z = M.copy()
+    t = np.ones(C.shape[:-2])
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        grad = G @ Z - C
+        if W is not None:
+            grad += W * Z
+        M_next = project(Z - step * grad)
+        delta = M_next - M
+        if np.abs(delta).max() <= tol:
+            M = M_next
+            break
+
+        # Adaptive restart (per problem) when momentum points uphill
+        restart = np.sum(grad * delta, axis=(-2, -1)) > 0
+        t_next = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * t * t))
+        beta = np.where(restart, 0.0, (t - 1.0) / t_next)
+        Z = M_next + beta[..., np.newaxis, np.newaxis] * delta
+        t = np.where(restart, 1.0, t_next)
+        M = M_next
+
+    return M, n_iter
+
+
+def polish_on_support(G, C, M, row_sum=True, tol=1e-9):
+    """
+    Refine an approximate solution by solving the KKT system on its support.
+
+    Once the accelerated iterations have identified which cells are
+    non-zero, the optimum is the solution of an equality-constrained
+    least-squares problem on that support. Columns decouple given the row
+    multipliers, so the system is solved by a k x k Schur complement.
+
+    Returns:
+        Polished matrix, or None if the support guess fails the KKT checks
+    """
+    k, m = C.shape
+    support = M > 0
+    X_cols = []
+    S = np.zeros((k, k))
+    r = np.zeros(k)
+    try:
+        for j in range(m):
+            idx = np.flatnonzero(support[:, j])
+            if idx.size == 0:
+                X_cols.append((idx, None, None))
+                continue
+            H = G[np.ix_(idx, idx)]
+            Hinv_c = np.linalg.solve(H, C[idx, j])
+            Hinv_e = np.linalg.solve(H, np.eye(idx.size))
+            X_cols.append((idx, Hinv_c, Hinv_e))
+            S[np.ix_(idx, idx)] += Hinv_e
+            r[idx] += Hinv_c
+    except np.linalg.LinAlgError:
+        return None
+
+    if row_sum:
+        try:
+            nu = np.linalg.solve(S, r - 1.0)
+        except np.linalg.LinAlgError:
+            return None
+    else:
+        nu = np.zeros(k)
+
+    P = np.zeros((k, m))
+    for j, (idx, Hinv_c, Hinv_e) in enumerate(X_cols):
+        if idx.size:
+            P[idx, j] = Hinv_c - Hinv_e @ nu[idx]
+
+    # Primal feasibility on the support, dual feasibility off it
+    scale = max(np.abs(C).max(), 1.0)
+    if P.min() < -tol:
+        return None
+    mu = G @ P - C + nu[:, np.newaxis]
+    if (mu[~support] < -tol * scale).any():
+        return None
+
+    P = np.maximum(P, 0.0)
+    if row_sum:
+        P /= P.sum(axis=1, keepdims=True)
+    return P
+
+
+def solve_simplex_lstsq(G, C, M0=None, tol=DEFAULT_TOL, max_iter=DEFAULT_MAX_ITER, polish=True):
+    """
+    Solve min ||X M - Y||_F s.t. M >= 0, rows of M sum to 1, from Gram matrices.
+
+    Args:
+        G: X^T X, shape (k_from, k_from), or a batch (B, k_from, k_from)
+        C: X^T Y, shape (k_from, k_to), or a batch (B, k_from, k_to)
+        M0: Optional warm start
+        tol: Stopping tolerance of the projected gradient loop
+        max_iter: Iteration cap
+        polish: Whether to finish with an exact solve on the identified support
+            (single problems only)
+
+    Returns:
+        (M, info) where info holds the iteration count and whether the
+        polish step was accepted
+    """
+    M, n_iter = fista(G, C, project_rows_to_simplex, M0=M0, tol=tol, max_iter=max_iter)
+    polished = False
+    if polish and np.ndim(C) == 2:
+        P = polish_on_support(np.asarray(G, dtype=float), np.asarray(C, dtype=float), M)
+        if P is not None:
+            M, polished = P, True
+    return M, {'iterations': n_iter, 'polished': polished}
+
+
+def solve_nnls(G, C, M0=None, row_sum=False, tol=DEFAULT_TOL, max_iter=DEFAULT_MAX_ITER, polish=True):
+    """
+    Non-negative least squares for all destination columns at once.
+
+    Solves min ||X M - Y||_F s.t. M >= 0 from the Gram matrices. The
+    columns of M are independent NNLS problems sharing G, so one FISTA loop
+    over the whole k_from x k_to matrix replaces k_to scipy nnls calls on
+    the full precinct matrix. The loop stops early at NNLS_POLISH_TOL once
+    polish_on_support can make the result exact. Unlike scipy nnls on the
+    gram_factor rows, it stays bounded when G is rank deficient (lists
+    with no votes in the matched precincts, as in --all-lists).
+
+    With row_sum=True the rows of M must also sum to 1. The row-normalized
+    NNLS solution is then used as a feasible warm start for the simplex
+    constrained problem, and the result is never worse than that start.
+
+    Args:
+        G: X^T X, shape (k_from, k_from), or a batch (B, k_from, k_from)
+        C: X^T Y, shape (k_from, k_to), or a batch (B, k_from, k_to)
+        M0: Optional warm start
+        row_sum: Whether to enforce rows summing to 1 exactly
+        tol: Stopping tolerance of the projected gradient loop
+        max_iter: Iteration cap
+        polish: Whether to finish with an exact solve on the identified support
+            (single problems only)
+
+    Returns:
+        (M, info) where info holds the iteration count and whether the
+        polish step was accepted
+    """
+    G = np.asarray(G, dtype=float)
+    C = np.asarray(C, dtype=float)
+    if M0 is None:
+        # Lists without votes keep all-zero rows, as with scipy's nnls
+        M0 = np.zeros(C.shape)
+    polished = False
+    n_iter = 0
+    if polish and C.ndim == 2:
+        M0, n_iter = fista(G, C, project_nonnegative, M0=M0, tol=max(tol, NNLS_POLISH_TOL), max_iter=max_iter)
+        P = polish_on_support(G, C, M0, row_sum=False)
+        if P is not None:
+            M, polished = P, True
+    if not polished:
+        M, iters = fista(G, C, project_nonnegative, M0=M0, tol=tol, max_iter=max_iter)
+        n_iter += iters
+        if polish and C.ndim == 2:
+            P = polish_on_support(G, C, M, row_sum=False)
+            if P is not None:
+                M, polished = P, True
+    if not row_sum:
+        return M, {'iterations': n_iter, 'polished': polished}
+
+    row_sums = M.sum(axis=-1, keepdims=True)
+    start = project_rows_to_simplex(np.divide(M, row_sums, out=np.zeros_like(M), where=row_sums > 0))
+    M, info = solve_simplex_lstsq(G, C, M0=start, tol=tol, max_iter=max_iter, polish=polish)
+    if C.ndim == 2 and lstsq_objective(G, C, start) < lstsq_objective(G, C, M):
+        M = start
+    return M, {'iterations': n_iter + info['iterations'], 'polished': info['polished']}
+
+
+def solve_joint_simplex_lstsq(Gs, Cs, links, tol=DEFAULT_TOL, outer_tol=JOINT_TOL,
+                              max_iter=DEFAULT_MAX_ITER, max_sweeps=JOINT_MAX_SWEEPS):
+    """
+    Jointly solve several simplex-constrained problems coupled by smoothness.
+
+    Minimizes
+
+        sum_t 1/2 tr(M_t^T G_t M_t) - tr(M_t^T C_t)
+            + sum_links w/2 * ||M_t[cells_t] - M_u[cells_u]||^2
+
+    over row-stochastic M_t by block coordinate descent: every sweep
+    re-solves each M_t with the others fixed. With M_u fixed the coupling is
+    a per-cell weight W and a shift of C_t, so each block is a warm-started
+    FISTA solve of its own k x k problem and the cost grows linearly with
+    the number of transitions.
+
+    Args:
+        Gs: List of X_t^T X_t matrices
+        Cs: List of X_t^T Y_t matrices
+        links: List of (t, u, w, cells_t, cells_u) where cells_* are
+            (rows, cols) index arrays of the cells of M_t and M_u to pull
+            together with weight w
+        tol: Stopping tolerance of every block solve
+        outer_tol: Stop when no cell changes by more than this in a sweep
+        max_iter: Iteration cap of every block solve
+        max_sweeps: Maximum number of block sweeps
+
+    Returns:
+        (Ms, info) where info holds the number of sweeps and the total
+        number of projected gradient iterations
+    """
+    Ms = [solve_simplex_lstsq(G, C, tol=tol, max_iter=max_iter)[0] for G, C in zip(Gs, Cs)]
+    sweeps = n_iter = 0
+    if not links:
+        return Ms, {'sweeps': sweeps, 'iterations': n_iter}
+
+    for sweeps in range(1, max_sweeps + 1):
+        max_change = 0.0
+        for t, (G, C) in enumerate(zip(Gs, Cs)):
+            W = np.zeros(C.shape)
+            C_t = np.array(C, dtype=float)
+            for a, b, w, cells_a, cells_b in links:
+                if t not in (a, b):
+                    continue
+                own, other, other_cells = (cells_a, b, cells_b) if t == a else (cells_b, a, cells_a)
+                W[own] += w
+                C_t[own] += w * Ms[other][other_cells]
+            M, iters = fista(G, C_t, project_rows_to_simplex, M0=Ms[t], tol=tol, max_iter=max_iter, W=W)
+            max_change = max(max_change, float(np.abs(M - Ms[t]).max()))
+            Ms[t] = M
+            n_iter += iters
+        if max_change <= outer_tol:
+            break
+    return Ms, {'sweeps': sweeps, 'iterations': n_iter}
+
+
+def weighted_gram_matrices(X, Y, w):
+    """Weighted Gram matrices X^T diag(w) X and X^T diag(w) Y."""
+    Xw = np.asarray(X, dtype=float) * np.asarray(w, dtype=float)[:, np.newaxis]
+    return Xw.T @ X, Xw.T @ Y
+
+
+def huber_weights(z, c=HUBER_C):
+    """
+    Huber weights min(1, c s / z) of non-negative standardized residuals.
+
+    The robust scale s is the MAD-based 1.4826 * median(z).
+    """
+    z = np.asarray(z, dtype=float)
+    scale = 1.4826 * np.median(z)
+    if scale <= 0:
+        return np.ones_like(z)
+    return np.minimum(1.0, c * scale / np.maximum(z, np.finfo(float).tiny))
+
+
+def irls_simplex_lstsq(X, Y, weights=None, scale=None, M0=None, c=HUBER_C, tol=IRLS_TOL,
+                       max_iter=IRLS_MAX_ITER):
+    """
+    Huber-robust simplex-constrained least squares by iterative reweighting.
+
+    Each iteration forms the weighted Gram matrices (O(n k^2)), re-solves
+    warm-started from the previous matrix and recomputes Huber weights from
+    the precincts' residual norms divided by scale.
+
+    Args:
+        X: Previous election votes (n_precincts, k_from)
+        Y: Current election votes (n_precincts, k_to)
+        weights: Optional base precinct weights (default: all 1)
+        scale: Optional per-precinct residual scale, e.g. sqrt(eligible
+            voters) (default: all 1)
+        M0: Optional warm start
+        c: Huber tuning constant
+        tol: Stop when no Huber weight changes by more than tol
+        max_iter: Maximum number of reweighting iterations
+
+    Returns:
+        (M, huber, info) where huber holds the final per-precinct Huber
+        weights (1 = not downweighted) and info the iteration count
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    n = X.shape[0]
+    base = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    scale = np.ones(n) if scale is None else np.maximum(np.asarray(scale, dtype=float), 1.0)
+    huber = np.ones(n)
+    M = M0
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        M, _ = solve_simplex_lstsq(*weighted_gram_matrices(X, Y, base * huber), M0=M)
+        z = np.linalg.norm(Y - X @ M, axis=1) / scale
+        updated = huber_weights(z, c)
+        converged = np.abs(updated - huber).max() <= tol
+        huber = updated
+        if converged:
+            break
+    return M, huber, {'iterations': n_iter}
+
+
+def poisson_log_likelihood(X, Y, M, observed=None):
+    """
+    Poisson log-likelihood of Y given means X M, without the constant -sum(log y!).
+
+    observed optionally holds the flat indices of the nonzero cells of Y,
+    so repeated evaluations only take the logarithm where it matters.
+    """
+    mu = (X @ M).ravel()
+    if observed is None:
+        observed = np.flatnonzero(Y)
+    return float(Y.ravel()[observed] @ np.log(np.maximum(mu[observed], 1e-300)) - mu.sum())
+
+
+def _poisson_em_step(X, Y, M):
+    """One EM update: M_kj <- M_kj (X^T (Y / XM))_kj, rows renormalized."""
+    mu = X @ M
+    R = np.divide(Y, mu, out=np.zeros_like(Y), where=mu > 0)
+    M = M * (X.T @ R)
+    totals = M.sum(axis=1, keepdims=True)
+    return np.divide(M, totals, out=np.full_like(M, 1.0 / M.shape[1]), where=totals > 0)
+
+
+def poisson_simplex_em(X, Y, M0=None, tol=POISSON_TOL, max_iter=POISSON_MAX_ITER):
+    """
+    Maximum-likelihood transfer matrix under a Poisson count model.
+
+    Each later vote count is modelled as y_ij ~ Poisson(sum_k x_ik M_kj)
+    with M row-stochastic, so a residual is judged relative to the
+    precinct's expected count rather than in absolute votes. Treating the
+    unobserved flows n_ikj as the missing data gives the classic EM update
+    M_kj <- M_kj * sum_i x_ik y_ij / mu_ij, renormalized per row, which
+    keeps M on the simplex and never decreases the likelihood. Plain EM
+    needs thousands of steps; SQUAREM extrapolation (Varadhan & Roland,
+    2008) over pairs of steps, with a fallback to the plain step when the
+    extrapolation loses likelihood, cuts that to tens or hundreds.
+
+    Args:
+        X: Previous election votes (n_precincts, k_from)
+        Y: Current election votes (n_precincts, k_to)
+        M0: Optional warm start (e.g. the least-squares matrix); it is
+            mixed with the uniform matrix so no cell starts at zero
+        tol: Stop when no cell changes by more than tol in a step
+        max_iter: Maximum number of accelerated steps
+
+    Returns:
+        (M, info) with the iteration count and final log-likelihood
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    k_to = Y.shape[1]
+    M = np.full((X.shape[1], k_to), 1.0 / k_to)
+    if M0 is not None:
+        M = (1 - POISSON_START_MIX) * np.asarray(M0, dtype=float) + POISSON_START_MIX * M
+
+    observed = np.flatnonzero(Y)
+    log_likelihood = poisson_log_likelihood(X, Y, M, observed)
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        M1 = _poisson_em_step(X, Y, M)
+        M2 = _poisson_em_step(X, Y, M1)
+        r = M1 - M
+        v = M2 - 2 * M1 + M
+        alpha = min(-np.sqrt((r * r).sum() / max((v * v).sum(), 1e-300)), -1.0)
+        # Clip the extrapolated point back to the simplex; a row that clips
+        # to all zeros falls back to its plain EM step
+        M_next = project_nonnegative(M - 2 * alpha * r + alpha * alpha * v)
+        totals = M_next.sum(axis=1, keepdims=True)
+        M_next = np.where(totals > 0, M_next / np.where(totals > 0, totals, 1.0), M2)
+        M_next = _poisson_em_step(X, Y, M_next)
+        next_likelihood = poisson_log_likelihood(X, Y, M_next, observed)
+        if next_likelihood < log_likelihood:
+            # EM steps never decrease the likelihood: fall back to M2
+            M_next = M2
+            next_likelihood = poisson_log_likelihood(X, Y, M2, observed)
+        change = np.abs(M_next - M).max()
+        M, log_likelihood = M_next, next_likelihood
+        if change <= tol:
+            break
+    return M, {'iterations': n_iter, 'log_likelihood': log_likelihood}
+
+
+def lstsq_objective(G, C, M, yty=0.0):
+    """Value of ||X M - Y||_F^2 computed from the Gram matrices (yty = tr(Y^T Y))."""
+    return float(np.sum(M * (G @ M)) - 2.0 * np.sum(M * C) + yty)
+
+
+def precinct_outer_products(X, Y):
+    """
+    Per-precinct outer products x_i x_i^T and x_i y_i^T, flattened.
+
+    Any precinct-weighted Gram matrix is then a single matrix product:
+    X^T diag(w) X = (w @ XX).reshape(k, k), and likewise for X^T diag(w) Y.
+
+    Returns:
+        (XX, XY) with shapes (n, k*k) and (n, k*m)
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    n = X.shape[0]
+    XX = (X[:, :, np.newaxis] * X[:, np.newaxis, :]).reshape(n, -1)
+    XY = (X[:, :, np.newaxis] * Y[:, np.newaxis, :]).reshape(n, -1)
+    return XX, XY
+
+
+def bootstrap_counts(n, n_boot, seed=0, chunk_size=BOOTSTRAP_CHUNK):
+    """
+    Draw precinct bootstrap replicates as per-precinct draw counts.
+
+    Resampling the n precincts with replacement is the same as weighting
+    precinct i by the number of times it was drawn, so every replicate is a
+    row of counts summing to n.
+
+    Args:
+        n: Number of precincts
+        n_boot: Number of bootstrap replicates
+        seed: Seed of the resampling random generator
+        chunk_size: Replicates drawn together (bounds memory use)
+
+    Yields:
+        Float arrays of shape (chunk, n), n_boot rows in total
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        draws = rng.integers(0, n, size=(size, n)) + n * np.arange(size)[:, np.newaxis]
+        yield np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(float)
+
+
+def bootstrap_simplex_lstsq(X, Y, M_hat, n_boot, seed=0, weights=None, solve=None, tol=BOOTSTRAP_TOL,
+                            max_iter=DEFAULT_MAX_ITER, chunk_size=BOOTSTRAP_CHUNK):
+    """
+    Precinct bootstrap of the simplex-constrained transfer matrix.
+
+    Each replicate weights precinct i by its base weight times the number
+    of times it was drawn (see bootstrap_counts). The replicate Gram
+    matrices are weighted sums of the precomputed per-precinct outer
+    products, and each chunk of replicates is solved as one batched FISTA
+    problem warm-started from the full-sample solution M_hat.
+
+    Args:
+        X: Previous election votes (n_precincts, k_from)
+        Y: Current election votes (n_precincts, k_to)
+        M_hat: Full-sample solution used as the warm start
+        n_boot: Number of bootstrap replicates
+        seed: Seed of the resampling random generator
+        weights: Optional base precinct weights of the fit (default: all 1)
+        solve: Optional batched solver solve(G, C, M0) -> M used instead of
+            the simplex FISTA loop, e.g. batched NNLS
+        tol: Stopping tolerance of the batched projected gradient loop
+        max_iter: Iteration cap per chunk
+        chunk_size: Replicates solved together (bounds memory use)
+
+    Returns:
+        (samples, info) where samples has shape (n_boot, k_from, k_to) and
+        info holds the total FISTA iteration count over all chunks (0 with
+        a custom solve)
+    """
+    n, k = np.shape(X)
+    m = np.shape(Y)[1]
+    XX, XY = precinct_outer_products(X, Y)
+    base = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    M0 = project_rows_to_simplex(M_hat)
+
+    samples = np.empty((n_boot, k, m))
+    n_iter = 0
+    start = 0
+    for W in bootstrap_counts(n, n_boot, seed=seed, chunk_size=chunk_size):
+        size = len(W)
+        W *= base
+        G = (W @ XX).reshape(size, k, k)
+        C = (W @ XY).reshape(size, k, m)
+        M0_batch = np.broadcast_to(M0, (size, k, m))
+        if solve is None:
+            M, iters = fista(G, C, project_rows_to_simplex, M0=M0_batch, tol=tol, max_iter=max_iter)
+            n_iter += iters
+        else:
+            M = solve(G, C, M0_batch)
+        samples[start:start + size] = M
+        start += size
+    return samples, {'iterations': n_iter}
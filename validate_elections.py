@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Vectorized data-integrity validation of all elections.
+
+Every rule runs as one array expression over the stacked rows of all
+elections in the canonical store (election_store), instead of row by row:
+
+- missing_values: blank voter count or party vote cells (party cells are
+  zero-filled at ingest, which records how many it filled)
+- party_sum_mismatch: party votes do not add up to כשרים
+- negative_values: a negative vote or voter count
+- invalid_settlement_code: missing or non-numeric סמל ישוב
+- voted_exceeds_eligible: מצביעים > בזב (where בזב is known)
+- valid_invalid_mismatch: כשרים + פסולים differs from מצביעים by more than 1
+- eligible_missing: בזב is 0 (the whole of K17)
+- full_turnout: 100% turnout in a box with more than 100 eligible voters
+- duplicate_ids / city_9999: raw rows dropped at ingest, as recorded in
+  the store's manifest
+
+Votes are checked on the store's int32 matrices rather than the uint16
+vote tensor, which cannot hold a negative count.
+
+    python validate_elections.py
+
+writes a JSON report to data/validation_report.json; --strict exits with
+status 1 if any error-severity rule fires.
+"""
+
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from election_store import available_elections, load_election_frame, load_election_votes
+
+logger = logging.getLogger(__name__)
+
+# Report export
+VALIDATION_REPORT = Path('data/validation_report.json')
+
+# Ballot IDs listed per rule and election (counts are always complete)
+MAX_LISTED_IDS = 50
+
+# כשרים + פסולים may differ from מצביעים by this much (rounding in the CEC files)
+TURNOUT_TOLERANCE = 1
+
+# 100% turnout is only flagged in boxes with more eligible voters than this
+FULL_TURNOUT_MIN_ELIGIBLE = 100
+
+# Integrity rules: name -> (severity, description). The share of the
+# ingest rules (duplicate_ids, city_9999) is relative to the raw CSV rows,
+# that of the others to the normalized precincts
+RULES = {
+    'missing_values': ('error', 'blank voter count or party vote cell'),
+    'party_sum_mismatch': ('error', 'sum of party votes != כשרים'),
+    'negative_values': ('error', 'negative vote or voter count'),
+    'invalid_settlement_code': ('error', 'missing or non-numeric סמל ישוב'),
+    'voted_exceeds_eligible': ('error', 'מצביעים > בזב'),
+    'valid_invalid_mismatch': ('error', f'|כשרים + פסולים - מצביעים| > {TURNOUT_TOLERANCE}'),
+    'eligible_missing': ('warning', 'בזב is 0'),
+    'full_turnout': ('warning', f'100% turnout with more than {FULL_TURNOUT_MIN_ELIGIBLE} eligible'),
+    'duplicate_ids': ('warning', 'duplicate ballot ID (dropped at ingest)'),
+    'city_9999': ('info', 'city 9999 aggregated rows (dropped at ingest)'),
+}
+
+# Rules on the raw rows dropped at ingest
+INGEST_RULES = ('duplicate_ids', 'city_9999')
+
+# Voter count columns checked alongside the party votes
+COUNT_COLUMNS = {'eligible': 'בזב', 'voted': 'מצביעים', 'invalid': 'פסולים', 'valid': 'כשרים'}
+
+
+def stack_elections(election_ids):
+    """
+    Stack the rows of several elections into flat arrays.
+
+    Args:
+        election_ids: Elections in stacking order
+
+    Returns:
+        (columns, row_offsets, dropped, missing): dict of equal-length arrays
+        (voter counts with blanks as 0, missing_cells, party_sum, party_min,
+        settlement_code, ballot_id), the first row of every election plus
+        the total, every election's frame.attrs['dropped'], and every
+        election's number of blank cells per column (party votes summed)
+    """
+    parts = {name: [] for name in (*COUNT_COLUMNS, 'missing_cells', 'party_sum', 'party_min',
+                                   'settlement_code', 'ballot_id')}
+    row_offsets = [0]
+    dropped = {}
+    missing = {}
+    for election_id in election_ids:
+        df, _ = load_election_frame(election_id)
+        votes, _ = load_election_votes(election_id)
+        # Blank counts are masked before the integer cast, which they would break
+        blank = df[list(COUNT_COLUMNS.values())].isna()
+        party_blank = pd.Series(df.attrs.get('missing_party_cells', {}), dtype=np.int64)
+        missing_cells = blank.sum(axis=1).to_numpy() + party_blank.reindex(df.index, fill_value=0).to_numpy()
+        missing[election_id] = {column: int(n) for column, n in blank.sum().items() if n}
+        if len(party_blank):
+            missing[election_id]['party votes'] = int(party_blank.sum())
+        for name, column in COUNT_COLUMNS.items():
+            parts[name].append(df[column].fillna(0).to_numpy(dtype=np.int64))
+        parts['missing_cells'].append(missing_cells)
+        parts['party_sum'].append(votes.sum(axis=1, dtype=np.int64))
+        parts['party_min'].append(votes.min(axis=1, initial=0))
+        parts['settlement_code'].append(pd.to_numeric(df['סמל ישוב'], errors='coerce').to_numpy(dtype=float))
+        parts['ballot_id'].append(df.index.to_numpy(dtype=str))
+        row_offsets.append(row_offsets[-1] + len(df))
+        dropped[election_id] = df.attrs.get('dropped', {})
+    columns = {name: np.concatenate(values) for name, values in parts.items()}
+    return columns, np.array(row_offsets), dropped, missing
+
+
+def row_rules(c):
+    """
+    Evaluate the row-level rules on stacked columns.
+
+    Args:
+        c: Columns from stack_elections
+
+    Returns:
+        dict of rule name -> boolean row mask
+    """
+    counts_min = np.minimum.reduce([c[name] for name in COUNT_COLUMNS])
+    return {
+        'missing_values': c['missing_cells'] > 0,
+        'party_sum_mismatch': c['party_sum'] != c['valid'],
+        'negative_values': (c['party_min'] < 0) | (counts_min < 0),
+        'invalid_settlement_code': ~np.isfinite(c['settlement_code']),
+        'voted_exceeds_eligible': (c['voted'] > c['eligible']) & (c['eligible'] > 0),
+        'valid_invalid_mismatch': ((np.abs(c['valid'] + c['invalid'] - c['voted']) > TURNOUT_TOLERANCE)
+                                   & (c['voted'] > 0)),
+        'eligible_missing': c['eligible'] == 0,
+        'full_turnout': (c['eligible'] > FULL_TURNOUT_MIN_ELIGIBLE) & (c['voted'] == c['eligible']),
+    }
+
+
+def validate(election_ids=None):
+    """
+    Run every integrity rule over all elections in one pass.
+
+    Args:
+        election_ids: Elections to validate (default: all with a ballot file)
+
+    Returns:
+        Report dict: the rules, and per election its precinct and raw row
+        counts and the rules that fired, with their count, share and (up to
+        MAX_LISTED_IDS) ballot IDs
+    """
+    start = time.perf_counter()
+    election_ids = list(election_ids or available_elections())
+    columns, row_offsets, dropped, missing = stack_elections(election_ids)
+    masks = row_rules(columns)
+
+    elections = {e: {'precincts': int(row_offsets[i + 1] - row_offsets[i]), 'issues': {}}
+                 for i, e in enumerate(election_ids)}
+    for rule, mask in masks.items():
+        rows = np.flatnonzero(mask)
+        # Rows are stacked in election order, so each election's hits are one slice
+        bounds = np.searchsorted(rows, row_offsets)
+        for i, election_id in enumerate(election_ids):
+            hits = rows[bounds[i]:bounds[i + 1]]
+            if len(hits):
+                elections[election_id]['issues'][rule] = {
+                    'count': len(hits),
+                    'share': round(len(hits) / max(elections[election_id]['precincts'], 1), 4),
+                    'ballot_ids': columns['ballot_id'][hits[:MAX_LISTED_IDS]].tolist(),
+                }
+                if rule == 'missing_values':
+                    elections[election_id]['issues'][rule]['cells_by_column'] = missing[election_id]
+
+    for election_id in election_ids:
+        info = dropped[election_id]
+        election = elections[election_id]
+        n_duplicates = len(info.get('duplicate_ids', []))
+        n_aggregated = info.get('city_9999_rows', 0)
+        election['raw_rows'] = election['precincts'] + n_duplicates + n_aggregated
+        issues = election['issues']
+        if n_duplicates:
+            issues['duplicate_ids'] = {
+                'count': n_duplicates,
+                'share': round(n_duplicates / election['raw_rows'], 4),
+                'ballot_ids': info['duplicate_ids'][:MAX_LISTED_IDS],
+            }
+        if n_aggregated:
+            issues['city_9999'] = {
+                'count': n_aggregated,
+                'share': round(n_aggregated / election['raw_rows'], 4),
+                'valid_votes': info['city_9999_valid_votes'],
+            }
+
+    totals = {rule: sum(e['issues'].get(rule, {}).get('count', 0) for e in elections.values()) for rule in RULES}
+    return {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+        'rows': int(row_offsets[-1]),
+        'rules': {rule: {'severity': severity, 'description': description,
+                         'share_of': 'raw_rows' if rule in INGEST_RULES else 'precincts'}
+                  for rule, (severity, description) in RULES.items()},
+        'totals': totals,
+        'errors': sum(n for rule, n in totals.items() if RULES[rule][0] == 'error'),
+        'elections': elections,
+    }
+
+
+def main():
+    """Validate all elections, log a per-rule summary and save the report."""
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Check the integrity of all election ballot data')
+    parser.add_argument('--elections', nargs='+', help='Only validate specific elections, e.g. --elections 24 25')
+    parser.add_argument('--output', default=str(VALIDATION_REPORT),
+                        help=f'Output JSON file (default: {VALIDATION_REPORT})')
+    parser.add_argument('--strict', action='store_true', help='Exit with status 1 on any error-severity issue')
+    args = parser.parse_args()
+
+    report = validate(args.elections)
+    election_ids = list(report['elections'])
+    logger.info(f"\n{'Rule':<24} {'Severity':<8} " + ' '.join(f"{e:>6}" for e in election_ids))
+    for rule, (severity, _) in RULES.items():
+        counts = [report['elections'][e]['issues'].get(rule, {}).get('count', 0) for e in election_ids]
+        logger.info(f"{rule:<24} {severity:<8} " + ' '.join(f"{n:>6}" for n in counts))
+    logger.info(f"Validated {report['rows']} rows of {len(election_ids)} elections in "
+                f"{report['elapsed_ms']:.0f}ms: {report['errors']} errors")
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    logger.info(f"Saved {output}")
+
+    if args.strict and report['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
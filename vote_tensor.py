@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Compact, memory-mapped vote tensor over all elections.
+
+election_store keeps one frame per election. Cross-election work (all
+ballot rows of K16-K26 at once) wants the votes alone, without pandas, in
+one place. This module packs them into data/cache/vote_tensor/:
+
+1. head_values.npy: one flat uint16 array with, per election, the
+   (n_precincts, n_head) block of the lists that got votes in many boxes,
+   located by head_offsets.npy.
+2. tail_indptr/tail_indices/tail_values.npy: the long tail of small lists
+   (most of their cells are zero) as one CSR matrix over all rows, with
+   column indices local to each election's tail.
+3. row_offsets.npy: CSR-style first row of every election, plus
+   ballot_id.npy and a manifest with every election's party symbols.
+
+Rows are the rows of load_election_frame, in the same order. Slices of
+the tensor are views of the memory map:
+
+    tensor = load_vote_tensor()
+    tensor.votes('25', parties=['מחל', 'פה'], ballots=slice(0, 1000))
+
+Build (or rebuild) it with:
+
+    python vote_tensor.py
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from election_store import available_elections, frame_cache_key, load_election_frame, load_election_votes
+
+logger = logging.getLogger(__name__)
+
+# On-disk location of the tensor
+VOTE_TENSOR_DIR = Path('data/cache/vote_tensor')
+
+# Bump when the layout changes
+VOTE_TENSOR_VERSION = 1
+
+# Lists with votes in at least this share of an election's boxes are stored
+# dense. A CSR cell costs 6 bytes (int32 index + uint16 count) against 2 for
+# a dense one, so the sparse tail is smaller below one nonzero cell in three
+DENSE_MIN_NONZERO = 1 / 3
+
+# Vote counts are stored as uint16
+VOTE_DTYPE = np.uint16
+
+
+def tensor_cache_key(election_ids):
+    """Cache key of the tensor: layout version, dense threshold and every election's frame key."""
+    return {
+        'version': VOTE_TENSOR_VERSION,
+        'dense_min_nonzero': DENSE_MIN_NONZERO,
+        'elections': {e: frame_cache_key(e) for e in election_ids},
+    }
+
+
+def split_head_tail(votes, min_nonzero=DENSE_MIN_NONZERO):
+    """
+    Split an election's lists into the dense head and the sparse tail.
+
+    Returns:
+        (head, tail) boolean column masks
+    """
+    head = (votes > 0).mean(axis=0) >= min_nonzero if len(votes) else np.ones(votes.shape[1], dtype=bool)
+    return head, ~head
+
+
+def _write_tensor(output_dir, election_ids, key):
+    """Pack the votes of the given elections into .npy arrays plus a JSON manifest."""
+    elections = []
+    head_blocks, tail_blocks, ballot_ids = [], [], []
+    row_offsets, head_offsets = [0], [0]
+    for election_id in election_ids:
+        votes, symbols = load_election_votes(election_id)
+        if votes.size and votes.max() > np.iinfo(VOTE_DTYPE).max:
+            raise ValueError(f"Election {election_id} has more than {np.iinfo(VOTE_DTYPE).max} votes "
+                             f"for a list in one box")
+        head, tail = split_head_tail(votes)
+        head_blocks.append(votes[:, head].astype(VOTE_DTYPE).ravel())
+        tail_blocks.append(csr_matrix(votes[:, tail].astype(VOTE_DTYPE)))
+        df, _ = load_election_frame(election_id)
+        ballot_ids.append(df.index.to_numpy(dtype=str))
+
+        row_offsets.append(row_offsets[-1] + len(votes))
+        head_offsets.append(head_offsets[-1] + head_blocks[-1].size)
+        elections.append({
+            'id': election_id,
+            'symbols': symbols,
+            'head': [s for s, h in zip(symbols, head) if h],
+            'tail': [s for s, t in zip(symbols, tail) if t],
+        })
+
+    tail_nnz = np.cumsum([0] + [block.nnz for block in tail_blocks])
+    tail_indptr = np.concatenate([[0]] + [block.indptr[1:] + start
+                                          for block, start in zip(tail_blocks, tail_nnz[:-1])])
+
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=output_dir.parent, prefix=f'.{output_dir.name}.'))
+    arrays = {
+        'row_offsets': np.asarray(row_offsets, dtype=np.int64),
+        'head_offsets': np.asarray(head_offsets, dtype=np.int64),
+        'head_values': np.concatenate(head_blocks) if head_blocks else np.empty(0, dtype=VOTE_DTYPE),
+        # int32 throughout so scipy wraps the memory map without converting
+        'tail_indptr': tail_indptr.astype(np.int32),
+        'tail_indices': np.concatenate([block.indices for block in tail_blocks] or [[]]).astype(np.int32),
+        'tail_values': np.concatenate([block.data for block in tail_blocks] or [[]]).astype(VOTE_DTYPE),
+        'ballot_id': np.concatenate(ballot_ids) if ballot_ids else np.empty(0, dtype=str),
+    }
+    for name, values in arrays.items():
+        np.save(tmp_dir / f'{name}.npy', values)
+    with open(tmp_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump({'key': key, 'elections': elections}, f, ensure_ascii=False)
+
+    # Replace any stale tensor; another process may have won the race
+    shutil.rmtree(output_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, output_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _as_index(positions):
+    """Integer positions as a slice when they are consecutive, so indexing returns a view."""
+    positions = np.asarray(positions, dtype=np.intp)
+    if len(positions) and np.all(np.diff(positions) == 1):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+def _take(values, rows, cols):
+    """values[rows, cols] for row selections given as a slice, integer array or boolean mask."""
+    if isinstance(rows, slice) or isinstance(cols, slice):
+        return values[rows, cols]
+    return values[np.ix_(rows, cols)]
+
+
+class VoteTensor:
+    """Read-only, memory-mapped votes of all elections with per-election views."""
+
+    def __init__(self, directory=VOTE_TENSOR_DIR):
+        """
+        Memory-map a tensor written by load_vote_tensor.
+
+        Args:
+            directory: Tensor directory (default: data/cache/vote_tensor)
+        """
+        directory = Path(directory)
+        with open(directory / 'manifest.json', 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        for name in ('row_offsets', 'head_offsets', 'head_values', 'tail_indptr', 'tail_indices',
+                     'tail_values', 'ballot_id'):
+            setattr(self, name, np.load(directory / f'{name}.npy', mmap_mode='r'))
+
+        self._elections = {}
+        for i, entry in enumerate(self.manifest['elections']):
+            columns = {s: j for j, s in enumerate(entry['head'] + entry['tail'])}
+            self._elections[entry['id']] = dict(entry, position=i, columns=columns)
+
+    @property
+    def election_ids(self):
+        """Elections in the tensor, in chronological order."""
+        return list(self._elections)
+
+    @property
+    def n_rows(self):
+        """Ballot rows over all elections."""
+        return int(self.row_offsets[-1])
+
+    def _entry(self, election_id):
+        """Manifest entry of an election; KeyError if it is not in the tensor."""
+        if election_id not in self._elections:
+            raise KeyError(f"Election {election_id} is not in the vote tensor")
+        return self._elections[election_id]
+
+    def rows(self, election_id):
+        """Global row range of an election as a slice."""
+        i = self._entry(election_id)['position']
+        return slice(int(self.row_offsets[i]), int(self.row_offsets[i + 1]))
+
+    def symbols(self, election_id):
+        """All party symbols of an election, in CSV order."""
+        return list(self._entry(election_id)['symbols'])
+
+    def ballot_ids(self, election_id):
+        """Normalized ballot IDs of an election's rows (view)."""
+        return self.ballot_id[self.rows(election_id)]
+
+    def head(self, election_id):
+        """Dense (n_precincts, n_head) uint16 block of an election (view); columns are entry['head']."""
+        entry = self._entry(election_id)
+        i = entry['position']
+        block = self.head_values[int(self.head_offsets[i]):int(self.head_offsets[i + 1])]
+        return block.reshape(-1, len(entry['head']))
+
+    def tail(self, election_id):
+        """
+        Sparse tail of an election as a CSR matrix over the memory map.
+
+        Returns:
+            (n_precincts, n_tail) scipy.sparse.csr_matrix whose data and
+            indices are views; columns are entry['tail']
+        """
+        entry = self._entry(election_id)
+        rows = self.rows(election_id)
+        indptr = self.tail_indptr[rows.start:rows.stop + 1]
+        start, stop = int(indptr[0]), int(indptr[-1])
+        return csr_matrix((self.tail_values[start:stop], self.tail_indices[start:stop], indptr - start),
+                          shape=(rows.stop - rows.start, len(entry['tail'])), copy=False)
+
+    def votes(self, election, parties=None, ballots=None):
+        """
+        Vote counts of an election for a subset of lists and ballots.
+
+        Selections that only touch head lists, with consecutive parties and
+        a ballot slice, are views of the memory map. Other selections copy
+        only the selected cells; tail lists are densified for the selected
+        ballots alone.
+
+        Args:
+            election: Election ID
+            parties: Party symbols (default: all lists, in CSV order)
+            ballots: Rows as a slice, integer positions or boolean mask,
+                aligned with load_election_frame (default: all)
+
+        Returns:
+            uint16 array of shape (n_ballots, n_parties)
+
+        Raises:
+            KeyError: If the election or a party symbol is unknown
+        """
+        entry = self._entry(election)
+        symbols = entry['symbols'] if parties is None else list(parties)
+        missing = [s for s in symbols if s not in entry['columns']]
+        if missing:
+            raise KeyError(f"Unknown lists for election {election}: {', '.join(map(str, missing))}")
+        cols = np.array([entry['columns'][s] for s in symbols], dtype=np.intp)
+        rows = slice(None) if ballots is None else ballots
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+
+        n_head = len(entry['head'])
+        in_head = cols < n_head
+        if in_head.all():
+            return _take(self.head(election), rows, _as_index(cols))
+
+        tail = self.tail(election)[rows]
+        out = np.empty((tail.shape[0], len(cols)), dtype=VOTE_DTYPE)
+        if in_head.any():
+            out[:, in_head] = _take(self.head(election), rows, _as_index(cols[in_head]))
+        out[:, ~in_head] = tail[:, cols[~in_head] - n_head].toarray()
+        return out
+
+    def memory_summary(self):
+        """Per-election row, list and nonzero counts plus byte sizes of the dense and sparse parts."""
+        rows = []
+        for election_id in self.election_ids:
+            entry = self._entry(election_id)
+            tail = self.tail(election_id)
+            n = len(self.ballot_ids(election_id))
+            rows.append({
+                'election': election_id,
+                'precincts': n,
+                'head_lists': len(entry['head']),
+                'tail_lists': len(entry['tail']),
+                'tail_nonzero': int(tail.nnz),
+                'bytes': self.head(election_id).nbytes + tail.nnz * 6 + 4 * (n + 1),
+                'int32_dense_bytes': 4 * n * len(entry['symbols']),
+            })
+        return rows
+
+
+@lru_cache(maxsize=4)
+def load_vote_tensor(election_ids=None, directory=VOTE_TENSOR_DIR):
+    """
+    Open the vote tensor, (re)building it if missing or stale (memoized).
+
+    Args:
+        election_ids: Tuple of elections to include (default: all with a ballot file)
+        directory: Tensor directory
+
+    Returns:
+        VoteTensor shared between callers; treat it as read-only
+    """
+    election_ids = list(election_ids or available_elections())
+    directory = Path(directory)
+    key = tensor_cache_key(election_ids)
+    manifest_file = directory / 'manifest.json'
+    if manifest_file.exists():
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            if json.load(f)['key'] == key:
+                return VoteTensor(directory)
+
+    logger.info(f"Building vote tensor for elections {', '.join(election_ids)} in {directory}")
+    _write_tensor(directory, election_ids, key)
+    return VoteTensor(directory)
+
+
+def votes(election, parties=None, ballots=None):
+    """VoteTensor.votes on the default tensor (see there)."""
+    return load_vote_tensor().votes(election, parties=parties, ballots=ballots)
+
+
+def main():
+    """Build the vote tensor and report its size per election."""
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Pack all elections into a memory-mapped uint16 vote tensor')
+    parser.add_argument('--elections', nargs='+', help='Only include specific elections, e.g. --elections 24 25')
+    parser.add_argument('--output', default=str(VOTE_TENSOR_DIR),
+                        help=f'Tensor directory (default: {VOTE_TENSOR_DIR})')
+    args = parser.parse_args()
+
+    tensor = load_vote_tensor(tuple(args.elections) if args.elections else None, Path(args.output))
+    rows = tensor.memory_summary()
+    logger.info(f"\n{'Election':<10} {'Precincts':>10} {'Head':>5} {'Tail':>5} {'Tail nnz':>9} "
+                f"{'KB':>7} {'int32 KB':>9}")
+    for row in rows:
+        logger.info(f"{row['election']:<10} {row['precincts']:>10} {row['head_lists']:>5} "
+                    f"{row['tail_lists']:>5} {row['tail_nonzero']:>9} {row['bytes'] / 1024:>7.0f} "
+                    f"{row['int32_dense_bytes'] / 1024:>9.0f}")
+    logger.info(f"{tensor.n_rows} rows: {sum(r['bytes'] for r in rows) / 1024:.0f} KB "
+                f"(int32 dense: {sum(r['int32_dense_bytes'] for r in rows) / 1024:.0f} KB)")
+
+
+if __name__ == '__main__':
+    main()